@@ -1,23 +1,29 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='django-auditlog',
     version='0.4.5.1',
-    packages=['auditlog'],
+    packages=['auditlog', 'auditlog.migrations', 'auditlog.management', 'auditlog.management.commands'],
     package_dir={'': 'src'},
     url='https://github.com/haniffm/django-auditlogger',
     license='MIT',
     author='Jan-Jelle Kester',
     description='Audit log app for Django',
+    python_requires='>=3.7',
     install_requires=[
+        'Django>=2.2,<4.0',
         'django-jsonfield>=1.0.0',
     ],
     zip_safe=False,
     classifiers=[
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Framework :: Django',
+        'Framework :: Django :: 2.2',
+        'Framework :: Django :: 3.2',
         'License :: OSI Approved :: MIT License',
-    ],        
+    ],
 )
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+_old_rows = contextvars.ContextVar('auditlog_old_rows', default=None)
+
+
+def is_buffering(using):
+    """
+    Check whether change records for the given database are buffered until the current transaction is committed.
+
+    Buffering is enabled with the ``AUDITLOG_TRANSACTION_BUFFERING`` setting, and only applies inside an atomic block.
+
+    :param using: The database alias.
+    :type using: str
+    :return: Whether records are buffered.
+    :rtype: bool
+    """
+    if using is None or not getattr(settings, 'AUDITLOG_TRANSACTION_BUFFERING', False):
+        return False
+    return transaction.get_connection(using).in_atomic_block
+
+
+def buffer_record(record, using, emit):
+    """
+    Emit a change record (or a batch of them) once the current transaction on the given database is committed.
+    Records of a transaction (or savepoint) that is rolled back are discarded.
+
+    :param record: The change record, or a list of change records.
+    :type record: auditlog.records.ChangeRecord or list
+    :param using: The database alias.
+    :type using: str
+    :param emit: The function that emits the record.
+    :type emit: callable
+    """
+    # Django keeps the callbacks per database and per transaction, and drops the callbacks of rolled back savepoints.
+    transaction.on_commit(partial(emit, record), using=using)
+
+
+def _get_old_rows(using):
+    """
+    Get the prefetched old rows for a database, by model and primary key.
+    """
+    old_rows = _old_rows.get()
+    if old_rows is None:
+        old_rows = {}
+        _old_rows.set(old_rows)
+    return old_rows.setdefault(using, defaultdict(dict))
+
+
+@contextmanager
+def prefetch(instances, using=None):
+    """
+    Load the database rows of the given model instances with a single query per model, before they are changed and
+    saved. Saving one of the instances inside the block uses the prefetched row to calculate the changes instead of
+    fetching the row again. Every prefetched row is used once, saving an instance again fetches its row as usual.
+
+    Example::
+
+        with prefetch(orders):
+            for order in orders:
+                order.status = 'shipped'
+                order.save()
+
+    :param instances: The model instances (or a queryset) that will be saved.
+    :type instances: iterable
+    :param using: The database alias, defaults to the database the instances were loaded from.
+    :type using: str
+    """
+    pks = defaultdict(lambda: defaultdict(set))
+    for instance in instances:
+        if instance.pk is not None:
+            alias = using or instance._state.db or 'default'
+            pks[alias][instance._meta.model].add(instance.pk)
+
+    prefetched = []
+    for alias, models in pks.items():
+        old_rows = _get_old_rows(alias)
+        for model, model_pks in models.items():
+            rows = model._base_manager.using(alias).in_bulk(list(model_pks))
+            old_rows[model].update(rows)
+            prefetched.append((old_rows[model], model_pks))
+
+    try:
+        yield
+    finally:
+        for rows, model_pks in prefetched:
+            for pk in model_pks:
+                rows.pop(pk, None)
+
+
+def pop_old_row(model, pk, using):
+    """
+    Take the prefetched old row of a model instance, if it was prefetched with :py:func:`prefetch`.
+
+    :param model: The model.
+    :type model: Model
+    :param pk: The primary key of the instance.
+    :param using: The database alias.
+    :type using: str
+    :return: The old row or ``None``.
+    :rtype: Model
+    """
+    rows = (_old_rows.get() or {}).get(using)
+    if not rows or model not in rows:
+        return None
+    return rows[model].pop(pk, None)
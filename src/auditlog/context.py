@@ -0,0 +1,137 @@
+from __future__ import unicode_literals
+
+import asyncio
+import contextvars
+import functools
+from collections import Counter, OrderedDict
+
+_suspension = contextvars.ContextVar('auditlog_suspension', default=None)
+
+
+class Suspension(object):
+    """
+    A block of code in which changes to (some) registered models are not audited. Suspensions nest: a change is not
+    audited when any of the enclosing suspensions covers its model.
+    """
+    __slots__ = ('models', 'counts', 'parent')
+
+    def __init__(self, models=None, summary=False, parent=None):
+        """
+        :param models: The models that are not audited, defaults to all models.
+        :type models: frozenset
+        :param summary: Whether to count the changes that are not audited.
+        :type summary: bool
+        :param parent: The enclosing suspension.
+        :type parent: Suspension
+        """
+        self.models = models
+        self.counts = OrderedDict() if summary else None
+        self.parent = parent
+
+    def covers(self, model):
+        return self.models is None or model in self.models
+
+
+def is_suspended(model, action=None, count=1):
+    """
+    Check whether auditing changes to a model is suspended in the current context, and count the changes for the
+    summary of the suspension if it has one. When auditing is not suspended, this is a single context variable lookup.
+
+    :param model: The model.
+    :type model: Model
+    :param action: The action to count, one of the actions of :py:mod:`auditlog.records`.
+    :type action: str
+    :param count: The number of changes to count.
+    :type count: int
+    :return: Whether auditing is suspended.
+    :rtype: bool
+    """
+    suspension = _suspension.get()
+    while suspension is not None:
+        if suspension.covers(model):
+            if action is not None and suspension.counts is not None:
+                label = model._meta.label
+                if label not in suspension.counts:
+                    suspension.counts[label] = Counter()
+                suspension.counts[label][action] += count
+            return True
+        suspension = suspension.parent
+    return False
+
+
+class suspend(object):
+    """
+    Context manager and decorator that suspends auditing in the current thread or task. Inside the block the signal
+    receivers return right away: no changes are calculated, no queries are done and nothing is logged. Other threads and
+    concurrent requests are not affected.
+
+    When ``summary`` is enabled, the changes are counted by model and action and a single summary is logged when the
+    block is left.
+    """
+
+    def __init__(self, models=None, summary=False):
+        """
+        :param models: The models to suspend auditing for, defaults to all models.
+        :type models: list
+        :param summary: Whether to log the number of changes that were not audited when the block is left.
+        :type summary: bool
+        """
+        self.models = frozenset(models) if models is not None else None
+        self.summary = summary
+
+    def __enter__(self):
+        suspension = Suspension(self.models, self.summary, parent=_suspension.get())
+        _suspension.set(suspension)
+        return suspension
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Blocks are left in the reverse order they were entered, so the innermost suspension is the current one. The
+        # instance itself keeps no state, so it can be entered in several contexts (e.g., when it decorates a function).
+        suspension = _suspension.get()
+        _suspension.set(suspension.parent)
+
+        if suspension.counts:
+            log_summary(suspension.counts)
+
+    def __call__(self, func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def inner(*args, **kwargs):
+                with self:
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def inner(*args, **kwargs):
+                with self:
+                    return func(*args, **kwargs)
+        return inner
+
+
+def disable():
+    """
+    Context manager and decorator that suspends auditing of all models, see :py:class:`suspend`.
+
+    :rtype: suspend
+    """
+    return suspend()
+
+
+def log_summary(counts):
+    """
+    Log the number of changes that were not audited during a suspension.
+
+    :param counts: The number of changes by model label and action.
+    :type counts: dict
+    """
+    from auditlog.middleware import AuditlogMiddleware
+    from auditlog.receivers import logger
+    from auditlog.serializers import get_serializer
+
+    counts = {label: dict(actions) for label, actions in counts.items()}
+    logger.info(
+        "%s suspended auditing of %d changes: '%s'",
+        AuditlogMiddleware.get_actor().log_message,
+        sum(sum(actions.values()) for actions in counts.values()),
+        get_serializer().dumps(counts),
+        extra={'auditlog_changes': counts},
+    )
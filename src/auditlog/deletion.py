@@ -0,0 +1,167 @@
+from __future__ import unicode_literals
+
+import contextvars
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+from auditlog.records import ChangeRecord, DELETE, SUMMARY
+
+BOTH = 'both'
+SINGLE = 'single'
+CASCADE_SUMMARY = 'summary'
+
+DELETE_MODES = (BOTH, SINGLE, CASCADE_SUMMARY)
+
+_summaries = contextvars.ContextVar('auditlog_delete_summaries', default=None)
+
+
+def get_delete_mode():
+    """
+    Get the way deletes are logged, configured with the ``AUDITLOG_DELETE_MODE`` setting:
+
+    - ``both``: a record with all field values before and after the object is deleted (the default).
+    - ``single``: a single record after the object is deleted, with the field values calculated before.
+    - ``summary``: a single record per delete, listing the primary keys of all deleted objects by model. The field
+      values are not logged at all.
+
+    :return: The delete mode.
+    :rtype: str
+    """
+    mode = getattr(settings, 'AUDITLOG_DELETE_MODE', BOTH)
+    if mode not in DELETE_MODES:
+        raise ValueError("Unknown delete mode '{}', use one of {}.".format(mode, ', '.join(DELETE_MODES)))
+    return mode
+
+
+class DeleteSummary(object):
+    """
+    Collects the objects deleted by a single delete, including the objects deleted along by cascading. Django sends
+    ``pre_delete`` for all collected objects before deleting any of them, and ``post_delete`` after, so the delete is
+    done when every object that was announced in ``pre_delete`` has been reported in ``post_delete``.
+
+    Django deletes the objects in a transaction. When that transaction (or the savepoint it is part of) is rolled back,
+    the summary is discarded, so the objects that were announced are not added to the next delete.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.pending = set()
+        self.deleted = OrderedDict()
+        self.first = None
+        self.posting = False
+        self.committed = False
+
+        connection = transaction.get_connection(using)
+        self.in_transaction = connection.in_atomic_block
+        if self.in_transaction:
+            # Django drops the commit hooks of a transaction or savepoint that is rolled back.
+            self.hook = self.commit
+            transaction.on_commit(self.hook, using=using)
+
+    def commit(self):
+        self.committed = True
+
+    def is_rolled_back(self):
+        """
+        Check whether the transaction of the delete was rolled back.
+
+        :rtype: bool
+        """
+        if not self.in_transaction or self.committed:
+            return False
+        connection = transaction.get_connection(self.using)
+        return not any(hook[1] is self.hook for hook in connection.run_on_commit)
+
+    def add(self, instance):
+        """
+        Announce an object that is about to be deleted.
+        """
+        self.pending.add((instance._meta.model, instance.pk))
+
+    def remove(self, instance):
+        """
+        Report an object that is deleted.
+
+        :return: Whether all announced objects are deleted.
+        :rtype: bool
+        """
+        model = instance._meta.model
+        self.posting = True
+        self.pending.discard((model, instance.pk))
+        if self.first is None:
+            self.first = instance
+        self.deleted.setdefault(model._meta.label, []).append(
+            instance.pk if isinstance(instance.pk, (int, str)) else str(instance.pk)
+        )
+        return not self.pending
+
+    def get_record(self):
+        """
+        Create the change record listing the deleted objects.
+
+        :rtype: ChangeRecord
+        """
+        return ChangeRecord.for_instance(self.first, DELETE, SUMMARY, dict(self.deleted))
+
+
+def _get_summaries():
+    summaries = _summaries.get()
+    if summaries is None:
+        summaries = {}
+        _summaries.set(summaries)
+    return summaries
+
+
+def announce_delete(instance, using):
+    """
+    Add an object that is about to be deleted to the summary of the current delete on the given database.
+
+    :param instance: The model instance.
+    :type instance: Model
+    :param using: The database alias.
+    :type using: str
+    :return: The change record of an earlier delete that was not finished, if any.
+    :rtype: ChangeRecord
+    """
+    summaries = _get_summaries()
+    summary = summaries.get(using)
+    record = None
+
+    if summary is not None and summary.is_rolled_back():
+        # Nothing of the previous delete was deleted.
+        summary = None
+    elif summary is not None and summary.posting:
+        # A new delete started while objects of the previous one were never reported deleted (e.g., the delete
+        # failed). Log what was deleted and start over.
+        record = summary.get_record() if summary.first is not None else None
+        summary = None
+
+    if summary is None:
+        summary = summaries[using] = DeleteSummary(using)
+
+    summary.add(instance)
+    return record
+
+
+def report_delete(instance, using):
+    """
+    Report an object as deleted in the summary of the current delete on the given database.
+
+    :param instance: The model instance.
+    :type instance: Model
+    :param using: The database alias.
+    :type using: str
+    :return: The change record of the summary if the delete is done, otherwise ``None``.
+    :rtype: ChangeRecord
+    """
+    summaries = _get_summaries()
+    summary = summaries.get(using)
+    if summary is None or summary.is_rolled_back():
+        summary = summaries[using] = DeleteSummary(using)
+
+    if summary.remove(instance):
+        del summaries[using]
+        return summary.get_record()
+    return None
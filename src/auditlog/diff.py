@@ -1,17 +1,30 @@
 from __future__ import unicode_literals
 
+import copy
+import datetime
+import difflib
+import hashlib
+import time
+import uuid
+from collections import namedtuple
+from decimal import Decimal
+
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Model, NOT_PROVIDED, DateTimeField
+from django.db.models import Model, NOT_PROVIDED, BinaryField, DateTimeField
 from django.utils import timezone
 from django.utils.encoding import smart_text
 
+from auditlog.metrics import DIFF, get_metrics
+from auditlog.records import CREATE, UPDATE, DELETE
+
 
 def track_field(field):
     """
     Returns whether the given field should be tracked by Auditlog.
 
-    Won't track fields that are many-to-many relations.
+    Won't track fields that are many-to-many relations, those are tracked separately. Foreign keys and one-to-one
+    relations are tracked by the value of their attribute (``<name>_id``), so the related object is never fetched.
 
     :param field: The field to check.
     :type field: Field
@@ -23,7 +36,7 @@ def track_field(field):
         return False
 
     if getattr(field, 'remote_field', None) is not None:
-        return False
+        return field.concrete and (field.many_to_one or field.one_to_one)
 
     return True
 
@@ -48,6 +61,71 @@ def get_fields_in_model(instance):
     return instance._meta.fields
 
 
+def get_raw_value(obj, field):
+    """
+    Gets the native value of a given model instance field, as stored on the instance.
+
+    The value is read straight from the instance's ``__dict__``, only values that are not loaded on the instance are
+    looked up through the field's descriptor. For relations, the value is the primary key of the related object (the
+    value of the ``<name>_id`` attribute), the related object itself is not fetched.
+
+    :param obj: The model instance.
+    :type obj: Model
+    :param field: The field you want to find the value of.
+    :type field: Field
+    :return: The value of the field.
+    :rtype: Any
+    """
+    if obj is None:
+        return None
+
+    try:
+        return obj.__dict__[field.attname]
+    except KeyError:
+        pass
+
+    try:
+        value = getattr(obj, field.attname, None)
+    except ObjectDoesNotExist:
+        value = field.default if field.default is not NOT_PROVIDED else None
+
+    return value
+
+
+def get_datetime_value(obj, field):
+    """
+    Gets the value of a given model instance date/time field in its naive form.
+
+    :param obj: The model instance.
+    :type obj: Model
+    :param field: The field you want to find the value of.
+    :type field: DateTimeField
+    :return: The naive value of the field.
+    :rtype: datetime
+    """
+    # DateTimeFields are timezone-aware, so we need to convert the field
+    # to its naive form before we can accurately compare them for changes.
+    value = field.to_python(get_raw_value(obj, field))
+    if value is not None and settings.USE_TZ and not timezone.is_naive(value):
+        value = timezone.make_naive(value, timezone=timezone.utc)
+
+    return value
+
+
+def get_value_extractor(field):
+    """
+    Returns the function that gets the value of the given field from a model instance.
+
+    :param field: The field to get the extractor for.
+    :type field: Field
+    :return: A function that takes a model instance and the field, and returns the value to compare.
+    :rtype: callable
+    """
+    if isinstance(field, DateTimeField):
+        return get_datetime_value
+    return get_raw_value
+
+
 def get_field_value(obj, field):
     """
     Gets the value of a given model instance field.
@@ -59,76 +137,436 @@ def get_field_value(obj, field):
     :rtype: str
     """
     if isinstance(field, DateTimeField):
-        # DateTimeFields are timezone-aware, so we need to convert the field
-        # to its naive form before we can accurately compare them for changes.
-        try:
-            value = field.to_python(getattr(obj, field.name, None))
-            if value is not None and settings.USE_TZ and not timezone.is_naive(value):
-                value = timezone.make_naive(value, timezone=timezone.utc)
-        except ObjectDoesNotExist:
-            value = field.default if field.default is not NOT_PROVIDED else None
+        return get_datetime_value(obj, field)
+    return smart_text(get_raw_value(obj, field))
+
+
+def values_equal(old_value, new_value):
+    """
+    Checks whether two native field values are certainly the same, without converting them to strings. Values of
+    different types may still have the same string representation, so those are not considered equal here.
+
+    :param old_value: The old value.
+    :param new_value: The new value.
+    :return: Whether the values are equal.
+    :rtype: bool
+    """
+    if type(old_value) is not type(new_value):
+        return False
+    if isinstance(old_value, Decimal):
+        # Decimals that only differ in precision are equal, but have a different string representation.
+        return old_value.as_tuple() == new_value.as_tuple()
+    return old_value == new_value
+
+
+#: The types of values that are logged as they are, values of other types are logged as text.
+TYPED_VALUES = (bool, int, float, str, Decimal, datetime.date, datetime.time, datetime.timedelta, uuid.UUID)
+
+
+def typed_value(value):
+    """
+    Get the value to log for a native field value: the value itself if it is ``None`` or of one of the
+    :py:data:`TYPED_VALUES`, which the serializers encode natively, and its text otherwise.
+
+    :param value: The native value.
+    :return: The value to log.
+    """
+    if value is None or isinstance(value, TYPED_VALUES):
+        return value
+    return smart_text(value)
+
+
+def diff_full(field, old_value, new_value):
+    """
+    Diff strategy that records the old and new value. This is the default strategy.
+
+    Values are recorded as they are (see :py:func:`typed_value`), so the serializer can encode them natively. Values of
+    different types that have the same text (e.g., ``1`` and ``'1'``) are not considered a change.
+
+    :param field: The field.
+    :type field: Field
+    :param old_value: The old native value.
+    :param new_value: The new native value.
+    :return: The change, or ``None`` if the values have the same text.
+    :rtype: tuple
+    """
+    # Only values that differ are converted to strings, which may still turn out to be the same.
+    if smart_text(old_value) == smart_text(new_value):
+        return None
+    return typed_value(old_value), typed_value(new_value)
+
+
+def diff_json(field, old_value, new_value):
+    """
+    Diff strategy for dictionaries and lists (e.g., the values of a ``JSONField``) that only records the nested values
+    that changed, as a list of operations in the style of JSON Patch (RFC 6902) with the old value added::
+
+        {"patch": [{"op": "replace", "path": "/options/color", "old": "red", "value": "blue"}]}
+
+    Other values (e.g., when the object is created or deleted) are recorded in full, dictionaries and lists as copies.
+
+    :param field: The field.
+    :type field: Field
+    :param old_value: The old native value.
+    :param new_value: The new native value.
+    :return: The change, or ``None`` if the values are the same.
+    :rtype: dict or tuple
+    """
+    if not isinstance(old_value, (dict, list)) or not isinstance(new_value, (dict, list)):
+        if all(value is None or isinstance(value, (dict, list)) for value in (old_value, new_value)):
+            return copy.deepcopy(old_value), copy.deepcopy(new_value)
+        return diff_full(field, old_value, new_value)
+
+    patch = []
+    json_patch(old_value, new_value, '', patch)
+    return {'patch': patch} if patch else None
+
+
+def json_patch(old, new, path, patch):
+    """
+    Append the operations that turn ``old`` into ``new`` to ``patch``. Added and removed values are copied, so later
+    changes to the nested values of the instance do not change the patch.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            member = '{}/{}'.format(path, str(key).replace('~', '~0').replace('/', '~1'))
+            if key not in new:
+                patch.append({'op': 'remove', 'path': member, 'old': copy.deepcopy(old[key])})
+            else:
+                json_patch(old[key], new[key], member, patch)
+        for key in new:
+            if key not in old:
+                member = '{}/{}'.format(path, str(key).replace('~', '~0').replace('/', '~1'))
+                patch.append({'op': 'add', 'path': member, 'value': copy.deepcopy(new[key])})
+    elif isinstance(old, list) and isinstance(new, list):
+        for index in range(min(len(old), len(new))):
+            json_patch(old[index], new[index], '{}/{}'.format(path, index), patch)
+        # Removed from the end first, so the indexes stay valid when the patch is applied in order.
+        for index in range(len(old) - 1, len(new) - 1, -1):
+            patch.append({'op': 'remove', 'path': '{}/{}'.format(path, index), 'old': copy.deepcopy(old[index])})
+        for index in range(len(old), len(new)):
+            patch.append({'op': 'add', 'path': '{}/{}'.format(path, index), 'value': copy.deepcopy(new[index])})
+    elif type(old) is not type(new) or old != new:
+        patch.append({'op': 'replace', 'path': path, 'old': copy.deepcopy(old), 'value': copy.deepcopy(new)})
+
+
+def diff_text(field, old_value, new_value):
+    """
+    Diff strategy for long text that only records the changed lines, as the hunks of a unified diff without
+    context::
+
+        {"diff": "@@ -12 +12 @@\n-old line\n+new line"}
+
+    When the object is created or deleted, or the diff is not shorter than the values, the values are recorded in full.
+
+    :param field: The field.
+    :type field: Field
+    :param old_value: The old native value.
+    :param new_value: The new native value.
+    :return: The change, or ``None`` if the values are the same.
+    :rtype: dict or tuple
+    """
+    if old_value is None or new_value is None:
+        return diff_full(field, old_value, new_value)
+
+    old_value, new_value = smart_text(old_value), smart_text(new_value)
+    if old_value == new_value:
+        return None
+
+    # Split on newlines only, so other line endings stay part of the lines and a trailing newline is an empty last
+    # line. Joining the lines with newlines gives the exact value again.
+    lines = difflib.unified_diff(old_value.split('\n'), new_value.split('\n'), lineterm='', n=0)
+    # Skip the file headers.
+    diff = '\n'.join(line for index, line in enumerate(lines) if index > 1)
+    if len(diff) >= len(old_value) + len(new_value):
+        return old_value, new_value
+    return {'diff': diff}
+
+
+def diff_digest(field, old_value, new_value):
+    """
+    Diff strategy for binary and large values, that records the size and SHA-256 digest of values instead of the
+    values themselves. Binary values are always digested, other values only when their text is longer than the
+    ``AUDITLOG_DIFF_DIGEST_THRESHOLD`` setting (1024 characters by default)::
+
+        [{"size": 20480, "sha256": "9f86d0..."}, {"size": 20481, "sha256": "60303a..."}]
+
+    :param field: The field.
+    :type field: Field
+    :param old_value: The old native value.
+    :param new_value: The new native value.
+    :return: The change, or ``None`` if the values are the same.
+    :rtype: tuple
+    """
+    threshold = getattr(settings, 'AUDITLOG_DIFF_DIGEST_THRESHOLD', 1024)
+    old_value, new_value = digest_value(old_value, threshold), digest_value(new_value, threshold)
+    if old_value == new_value:
+        return None
+    return old_value, new_value
+
+
+def digest_value(value, threshold):
+    """
+    Get the size and digest of a binary value, or of the text of a value longer than the threshold. Other values are
+    returned as they are.
+    """
+    if value is None:
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
     else:
-        try:
-            value = smart_text(getattr(obj, field.name, None))
-        except ObjectDoesNotExist:
-            value = field.default if field.default is not NOT_PROVIDED else None
+        text = smart_text(value)
+        if len(text) <= threshold:
+            return typed_value(value)
+        data = text.encode('utf-8')
+    return {'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
 
-    return value
 
+FULL = 'full'
+JSON = 'json'
+TEXT = 'text'
+DIGEST = 'digest'
+
+DIFF_STRATEGIES = {
+    FULL: diff_full,
+    JSON: diff_json,
+    TEXT: diff_text,
+    DIGEST: diff_digest,
+}
+
+
+def get_diff_strategy(field, diff_strategies):
+    """
+    Returns the diff strategy of the given field: the strategy that was selected for the field, otherwise ``digest``
+    for binary fields and ``full`` for all other fields.
+
+    :param field: The field to get the strategy for.
+    :type field: Field
+    :param diff_strategies: The names of the strategies by field name.
+    :type diff_strategies: dict
+    :return: A function that takes the field and the old and new native value, and returns the change to log.
+    :rtype: callable
+    """
+    name = diff_strategies.get(field.name)
+    if name is None:
+        name = DIGEST if isinstance(field, BinaryField) else FULL
+    if name not in DIFF_STRATEGIES:
+        raise ValueError("Unknown diff strategy '{}' for field '{}', use one of {}.".format(
+            name, field.name, ', '.join(DIFF_STRATEGIES)))
+    return DIFF_STRATEGIES[name]
+
+
+DiffPlan = namedtuple('DiffPlan', ['model', 'fields', 'extractors', 'strategies', 'include_fields', 'exclude_fields',
+                                   'mask_value_fields'])
+DiffPlan.__doc__ = """
+The precompiled instructions to calculate the differences between two instances of a model: the tracked fields, after
+applying ``include_fields`` and ``exclude_fields``, and the value extractor and diff strategy to use for each of those
+fields.
+"""
+
+
+def compile_diff_plan(model, include_fields=(), exclude_fields=(), mask_value_fields=(), diff_strategies=None):
+    """
+    Compiles the diff plan for a model.
 
-def model_instance_diff(old, new):
+    :param model: The model to compile the plan for.
+    :type model: Model
+    :param include_fields: The fields to include. Implicitly excludes all other fields.
+    :type include_fields: list
+    :param exclude_fields: The fields to exclude. Overrides the fields to include.
+    :type exclude_fields: list
+    :param mask_value_fields: The fields to mask the values of.
+    :type mask_value_fields: list
+    :param diff_strategies: The names of the diff strategies to use by field name, see :py:data:`DIFF_STRATEGIES`.
+    :type diff_strategies: dict
+    :return: The diff plan.
+    :rtype: DiffPlan
+    """
+    include_fields = frozenset(include_fields)
+    exclude_fields = frozenset(exclude_fields)
+    diff_strategies = diff_strategies or {}
+
+    fields = tuple(
+        field for field in model._meta.fields
+        if track_field(field)
+        and (not include_fields or field.name in include_fields)
+        and field.name not in exclude_fields
+    )
+
+    return DiffPlan(
+        model=model,
+        fields=fields,
+        extractors=tuple(get_value_extractor(field) for field in fields),
+        strategies=tuple(get_diff_strategy(field, diff_strategies) for field in fields),
+        include_fields=include_fields,
+        exclude_fields=exclude_fields,
+        mask_value_fields=frozenset(mask_value_fields),
+    )
+
+
+class ModelSnapshot(object):
+    """
+    A compact copy of the tracked field values of a model instance, taken when the instance was loaded from (or last
+    saved to) the database. A snapshot can be passed to :py:func:`model_instance_diff` in place of the old instance so
+    the old values do not have to be fetched from the database again.
+
+    Only the values of the given fields are stored, keyed by their attribute name. Like on a model instance, the
+    values of deferred fields are missing.
+    """
+    __slots__ = ('model', 'pk', '__dict__')
+
+    def __init__(self, instance, fields):
+        """
+        :param instance: The model instance to take the snapshot of.
+        :type instance: Model
+        :param fields: The fields to store the values of.
+        :type fields: list
+        """
+        self.model = instance._meta.model
+        self.pk = instance.pk
+        self.update(instance, fields)
+
+    def update(self, instance, fields):
+        """
+        Store the current values of the given fields of the model instance.
+
+        :param instance: The model instance the snapshot was taken of.
+        :type instance: Model
+        :param fields: The fields to store the values of.
+        :type fields: list
+        """
+        values = instance.__dict__
+        for field in fields:
+            try:
+                value = values[field.attname]
+            except KeyError:
+                # Deferred field, the value is unknown.
+                self.__dict__.pop(field.attname, None)
+                continue
+
+            if isinstance(value, (dict, list)):
+                # Mutable values may be changed in place, which would change the snapshot as well.
+                value = copy.deepcopy(value)
+            self.__dict__[field.attname] = value
+
+    @property
+    def _meta(self):
+        return self.model._meta
+
+
+def model_instance_diff(old, new, fields=None):
     """
     Calculates the differences between two model instances. One of the instances may be ``None`` (i.e., a newly
     created model or deleted model). This will cause all fields with a value to have changed (from ``None``).
 
     :param old: The old state of the model instance.
-    :type old: Model
+    :type old: Model or ModelSnapshot
     :param new: The new state of the model instance.
     :type new: Model
+    :param fields: The names of the fields to compare, defaults to all tracked fields.
+    :type fields: collections.Container
     :return: A dictionary with the names of the changed fields as keys and a two tuple of the old and new field values
              as value.
     :rtype: dict
     """
     from auditlog.registry import auditlog
 
-    if not(old is None or isinstance(old, Model)):
+    if not(old is None or isinstance(old, (Model, ModelSnapshot))):
         raise TypeError("The supplied old instance is not a valid model instance.")
     if not(new is None or isinstance(new, Model)):
         raise TypeError("The supplied new instance is not a valid model instance.")
 
-    diff = {}
-
-    if old is not None and new is not None:
-        fields = set(old._meta.fields + new._meta.fields)
-        model_fields = auditlog.get_model_fields(new._meta.model)
+    if new is not None:
+        model = new._meta.model
     elif old is not None:
-        fields = set(get_fields_in_model(old))
-        model_fields = auditlog.get_model_fields(old._meta.model)
-    elif new is not None:
-        fields = set(get_fields_in_model(new))
-        model_fields = auditlog.get_model_fields(new._meta.model)
+        model = old._meta.model
     else:
-        fields = set()
-        model_fields = None
+        return None
 
-    fields = filter_fields(fields, model_fields)
+    metrics = get_metrics()
+    if metrics is not None:
+        started = time.perf_counter()
 
-    for field in fields:
-        old_value = get_field_value(old, field)
-        new_value = get_field_value(new, field)
+    plan = auditlog.get_diff_plan(model)
+    diff = {}
+
+    compared = [
+        (field, get_value, get_change) for field, get_value, get_change in zip(plan.fields, plan.extractors,
+                                                                             plan.strategies)
+        if fields is None or field.name in fields
+    ]
+    skipped = get_deferred_fields(new, compared)
+    load = get_deferred_fields(old, compared) - skipped
+    if load:
+        load_deferred_fields(old, [field for field, get_value, get_change in compared if field.attname in load])
+        skipped |= get_deferred_fields(old, compared)
+
+    for field, get_value, get_change in compared:
+        if field.attname in skipped:
+            continue
+
+        old_value = get_value(old, field)
+        new_value = get_value(new, field)
 
-        if old_value != new_value:
-            if field.name in model_fields['mask_value_fields']:
-                new_value, old_value = '########', '********'
+        if values_equal(old_value, new_value):
+            continue
 
-            diff[field.name] = (smart_text(old_value), smart_text(new_value))
+        if field.name in plan.mask_value_fields:
+            if diff_full(field, old_value, new_value) is not None:
+                diff[field.name] = ('********', '########')
+            continue
+
+        change = get_change(field, old_value, new_value)
+        if change is not None:
+            diff[field.name] = change
 
     if len(diff) == 0:
         diff = None
 
+    if metrics is not None:
+        action = CREATE if old is None else DELETE if new is None else UPDATE
+        metrics.observe(DIFF, model._meta.label, action, time.perf_counter() - started)
     return diff
 
 
+def get_deferred_fields(obj, fields):
+    """
+    Returns the attribute names of the given fields that are deferred on a model instance or snapshot, i.e., of which
+    the value is not loaded. This is the same check :py:meth:`Model.get_deferred_fields` does, limited to the given
+    fields.
+
+    :param obj: The model instance or snapshot, may be ``None``.
+    :type obj: Model or ModelSnapshot
+    :param fields: Tuples of a field, its value extractor and its diff strategy.
+    :type fields: list
+    :return: The attribute names of the deferred fields.
+    :rtype: set
+    """
+    if obj is None:
+        return set()
+    values = obj.__dict__
+    return {field.attname for field, get_value, get_change in fields if field.attname not in values}
+
+
+def load_deferred_fields(obj, fields):
+    """
+    Loads the values of deferred fields of a model instance or snapshot with a single query. Accessing the deferred
+    fields one by one would cost a query per field.
+
+    :param obj: The model instance or snapshot.
+    :type obj: Model or ModelSnapshot
+    :param fields: The deferred fields to load.
+    :type fields: list
+    """
+    using = obj._state.db if isinstance(obj, Model) else None
+    row = obj._meta.model._base_manager.using(using).filter(pk=obj.pk).values(
+        *[field.attname for field in fields]
+    ).first()
+
+    if row is not None:
+        obj.__dict__.update(row)
+
+
 def filter_fields(fields, model_fields):
     if model_fields and (model_fields['include_fields'] or model_fields['exclude_fields']) and fields:
         if model_fields['include_fields']:
@@ -0,0 +1,310 @@
+from __future__ import unicode_literals
+
+import csv
+import functools
+import gzip
+import io
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.db import connections
+from django.db.models import Count, Max, Min
+from django.utils.dateparse import parse_datetime
+
+from auditlog.serializers import load_serializer
+
+FORMATS = ('jsonl', 'csv')
+SPLITS = ('time', 'content_type')
+
+#: The columns of an export, in the order of the CSV columns.
+COLUMNS = ('id', 'timestamp', 'content_type', 'object_pk', 'action', 'changes', 'actor', 'remote_addr')
+FIELDS = ('pk', 'timestamp', 'content_type_id', 'object_pk', 'action', 'changes', 'actor_id', 'remote_addr')
+
+#: A part of an export that is written to its own file: the log entries in a time range and of some content types.
+Shard = namedtuple('Shard', ['number', 'path', 'since', 'until', 'content_types'])
+
+#: The number of rows and bytes that were written, and the time it took in seconds.
+ExportResult = namedtuple('ExportResult', ['shard', 'rows', 'bytes', 'seconds'])
+
+
+def get_queryset(since=None, until=None, content_types=None, using=None):
+    """
+    Get the log entries in a time range, ordered by primary key so an export can be resumed after the last primary key
+    it has written.
+
+    :param since: The start of the range (inclusive).
+    :type since: datetime
+    :param until: The end of the range (exclusive).
+    :type until: datetime
+    :param content_types: The primary keys of the content types to include, defaults to all.
+    :type content_types: list
+    :param using: The database alias.
+    :type using: str
+    :rtype: QuerySet
+    """
+    from auditlog.models import LogEntry
+
+    queryset = LogEntry.objects.using(using).order_by('pk')
+    if since is not None:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until is not None:
+        queryset = queryset.filter(timestamp__lt=until)
+    if content_types is not None:
+        queryset = queryset.filter(content_type__in=content_types)
+    return queryset
+
+
+def get_shard_path(path, number):
+    """
+    Get the path of a shard of an export: the number is inserted before the extensions of the file name, e.g.
+    ``export.3.jsonl.gz``.
+    """
+    directory, name = os.path.split(path)
+    stem, dot, extensions = name.partition('.')
+    return os.path.join(directory, '{}.{}{}{}'.format(stem, number, dot, extensions))
+
+
+def plan_shards(path, shards=1, split='time', since=None, until=None, content_types=None, using=None):
+    """
+    Split an export into shards of about the same size.
+
+    With the ``'time'`` split, the time range of the log entries is divided into equal parts. With the
+    ``'content_type'`` split, the content types are distributed over the shards by their number of log entries.
+
+    :param path: The path of the export.
+    :type path: str
+    :param shards: The number of shards.
+    :type shards: int
+    :param split: How to split the export, ``'time'`` or ``'content_type'``.
+    :type split: str
+    :return: The shards, fewer than requested if there are not enough log entries or content types to split.
+    :rtype: list
+    """
+    if split not in SPLITS:
+        raise ValueError("Unknown split '{}', use one of {}.".format(split, ', '.join(SPLITS)))
+
+    queryset = get_queryset(since, until, content_types, using).order_by()
+    if shards <= 1:
+        return [Shard(0, path, since, until, content_types)]
+
+    if split == 'time':
+        bounds = queryset.aggregate(first=Min('timestamp'), last=Max('timestamp'))
+        if bounds['first'] is None:
+            return [Shard(0, path, since, until, content_types)]
+        start = since or bounds['first']
+        end = until or bounds['last'] + timedelta(microseconds=1)
+        step = (end - start) / shards
+        edges = [start + step * number for number in range(shards)] + [end]
+        return [
+            Shard(number, get_shard_path(path, number), edges[number], edges[number + 1], content_types)
+            for number in range(shards)
+        ]
+
+    groups, sizes = [[] for number in range(shards)], [0] * shards
+    for row in queryset.values('content_type').annotate(count=Count('pk')).order_by('-count'):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(row['content_type'])
+        sizes[smallest] += row['count']
+    groups = [sorted(group) for group in groups if group] or [[]]
+    return [
+        Shard(number, get_shard_path(path, number), since, until, group) for number, group in enumerate(groups)
+    ]
+
+
+def dump_shards(shards):
+    """
+    Encode shards as JSON, to store them in the manifest of an export.
+    """
+    return json.dumps([
+        dict(shard._asdict(), since=shard.since and shard.since.isoformat(),
+             until=shard.until and shard.until.isoformat())
+        for shard in shards
+    ])
+
+
+def load_shards(data):
+    """
+    Decode the shards stored in the manifest of an export.
+    """
+    return [
+        Shard(**dict(shard, since=shard['since'] and parse_datetime(shard['since']),
+                     until=shard['until'] and parse_datetime(shard['until'])))
+        for shard in json.loads(data)
+    ]
+
+
+class ExportWriter(object):
+    """
+    Encodes chunks of log entries as JSON lines or CSV, optionally compressed.
+    """
+
+    def __init__(self, format='jsonl', compress=False, using=None):
+        """
+        :param format: The format, ``'jsonl'`` or ``'csv'``.
+        :type format: str
+        :param compress: Whether to compress every chunk as a gzip member. The concatenated members form a single gzip
+            file.
+        :type compress: bool
+        :param using: The database alias of the content types.
+        :type using: str
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from auditlog.models import LogEntry
+
+        if format not in FORMATS:
+            raise ValueError("Unknown format '{}', use one of {}.".format(format, ', '.join(FORMATS)))
+
+        self.format = format
+        self.compress = compress
+        self.serializer = load_serializer('auto')
+        self.actions = dict(LogEntry.Action.choices)
+        self.labels = {
+            content_type.pk: '{}.{}'.format(content_type.app_label, content_type.model)
+            for content_type in ContentType.objects.db_manager(using).all()
+        }
+
+    def header(self):
+        """
+        Encode the header of the export: the column names of a CSV file.
+
+        :rtype: bytes
+        """
+        if self.format != 'csv':
+            return b''
+        return self.encode_csv([COLUMNS])
+
+    def encode(self, rows):
+        """
+        Encode a chunk of rows of :py:data:`FIELDS`.
+
+        :param rows: The rows.
+        :type rows: list
+        :rtype: bytes
+        """
+        if self.format == 'csv':
+            return self.encode_csv(
+                (pk, timestamp.isoformat(), self.labels.get(content_type, content_type), object_pk,
+                 self.actions[action], self.serializer.dumps(changes) if changes is not None else '',
+                 actor if actor is not None else '', remote_addr or '')
+                for pk, timestamp, content_type, object_pk, action, changes, actor, remote_addr in rows
+            )
+        return self.finish(self.serializer.dump_many((
+            {'id': pk, 'timestamp': timestamp, 'content_type': self.labels.get(content_type, content_type),
+             'object_pk': object_pk, 'action': self.actions[action], 'changes': changes, 'actor': actor,
+             'remote_addr': remote_addr}
+            for pk, timestamp, content_type, object_pk, action, changes, actor, remote_addr in rows
+        ), bytearray()))
+
+    def encode_csv(self, rows):
+        output = io.StringIO()
+        csv.writer(output).writerows(rows)
+        return self.finish(output.getvalue().encode('utf-8'))
+
+    def finish(self, data):
+        return gzip.compress(bytes(data)) if self.compress and data else bytes(data)
+
+
+def export_shard(shard, format='jsonl', compress=False, chunk_size=2000, resume=False, using=None):
+    """
+    Export the log entries of a shard to its file, in constant memory. The log entries are read with a server-side
+    cursor (where the database supports it) in chunks of ``chunk_size``. Every chunk is written at once, after which the
+    last primary key and the size of the file are stored in a checkpoint file next to it (``<path>.checkpoint``), so an
+    interrupted export can be resumed after the last chunk that was written.
+
+    :param shard: The shard.
+    :type shard: Shard
+    :param format: The format, ``'jsonl'`` or ``'csv'``.
+    :type format: str
+    :param compress: Whether to compress the file with gzip.
+    :type compress: bool
+    :param chunk_size: The number of log entries to read and write at once.
+    :type chunk_size: int
+    :param resume: Whether to resume from the checkpoint of the shard, if any.
+    :type resume: bool
+    :param using: The database alias.
+    :type using: str
+    :return: The number of rows and bytes written by this call.
+    :rtype: ExportResult
+    """
+    started = time.time()
+    checkpoint_path = shard.path + '.checkpoint'
+    checkpoint = {'last_pk': None, 'offset': 0, 'done': False}
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    if checkpoint['done']:
+        return ExportResult(shard.number, 0, 0, 0.0)
+
+    writer = ExportWriter(format, compress, using)
+    queryset = get_queryset(shard.since, shard.until, shard.content_types, using)
+    if checkpoint['last_pk'] is not None:
+        queryset = queryset.filter(pk__gt=checkpoint['last_pk'])
+
+    def save_checkpoint(**changes):
+        checkpoint.update(changes)
+        with open(checkpoint_path + '.tmp', 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+    rows = written = 0
+    mode = 'r+b' if checkpoint['offset'] and os.path.exists(shard.path) else 'wb'
+    with open(shard.path, mode) as output:
+        # Anything after the checkpoint was written by an export that was interrupted before its next checkpoint.
+        if output.seek(0, os.SEEK_END) < checkpoint['offset']:
+            raise ValueError("The export '{}' is shorter than its checkpoint, start it over.".format(shard.path))
+        output.seek(checkpoint['offset'])
+        output.truncate()
+        if not checkpoint['offset']:
+            written += output.write(writer.header())
+
+        chunk = []
+        for row in queryset.values_list(*FIELDS).iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                written += output.write(writer.encode(chunk))
+                output.flush()
+                rows += len(chunk)
+                save_checkpoint(last_pk=chunk[-1][0], offset=output.tell())
+                chunk = []
+
+        if chunk:
+            written += output.write(writer.encode(chunk))
+            rows += len(chunk)
+        output.flush()
+        save_checkpoint(last_pk=chunk[-1][0] if chunk else checkpoint['last_pk'], offset=output.tell(), done=True)
+
+    return ExportResult(shard.number, rows, written, time.time() - started)
+
+
+def setup_worker():
+    """
+    Set up Django in a worker process of an export, which is needed when processes are spawned rather than forked.
+    """
+    import django
+
+    django.setup()
+
+
+def export(shards, workers=1, **kwargs):
+    """
+    Export shards, in parallel in a pool of ``workers`` processes if there is more than one. See
+    :py:func:`export_shard` for the keyword arguments.
+
+    :param shards: The shards to export.
+    :type shards: list
+    :param workers: The number of processes.
+    :type workers: int
+    :return: The result of every shard.
+    :rtype: list
+    """
+    if workers <= 1 or len(shards) <= 1:
+        return [export_shard(shard, **kwargs) for shard in shards]
+
+    # Forked processes must not share the connections of the parent.
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=setup_worker) as pool:
+        return list(pool.map(functools.partial(export_shard, **kwargs), shards))
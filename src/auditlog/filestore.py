@@ -0,0 +1,429 @@
+from __future__ import unicode_literals
+
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.encoding import smart_text
+
+from auditlog.records import iter_records
+from auditlog.serializers import load_serializer
+from auditlog.writer import should_store
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (Windows)
+    fcntl = None
+
+#: The length of a record in a segment, which precedes the serialized record.
+FRAME = struct.Struct('>I')
+#: An entry of an index: the hash of the model label and primary key, and the offset of the record in the segment.
+ENTRY = struct.Struct('>QQ')
+
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{8})\.log$')
+
+
+def object_key(label, pk):
+    """
+    Get the hash of a model label and primary key that the index is keyed by.
+
+    :param label: The label of the model.
+    :type label: str
+    :param pk: The primary key of the object.
+    :return: The 64 bit hash.
+    :rtype: int
+    """
+    key = '{}\x00{}'.format(label, smart_text(pk)).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+
+class FileStore(object):
+    """
+    Stores change records in append-only segment files in a directory, with an index to find the records of an object
+    without reading the segments.
+
+    Every record is appended to the active segment (``segment-00000001.log``, ...) as a 4 byte length followed by the
+    serialized record. For every record, a 16 byte entry with the hash of the model label and primary key and the
+    offset of the record is appended to the index of the segment (``.idx``). When the active segment has reached the
+    segment size, it is sealed: its index is sorted by hash (``.sidx``) so it can be binary searched, and a new segment
+    is started.
+
+    The records of a batch are written with a single write to the segment and to the index. The segment is written
+    first, so after a crash the index may miss the last records, or a record may be incomplete. This is repaired from
+    the segment before anything is written again; :py:meth:`rebuild` rebuilds all indexes from the segments.
+
+    Writes of processes sharing the directory are serialized with a lock on the ``lock`` file (where supported).
+    """
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024, serializer='json', fsync=False):
+        """
+        :param path: The directory to store the segments in.
+        :type path: str
+        :param segment_size: The size in bytes after which the active segment is sealed.
+        :type segment_size: int
+        :param serializer: The name of the serializer for the records, see
+            :py:func:`auditlog.serializers.load_serializer`.
+        :type serializer: str
+        :param fsync: Whether to flush the segment and index to disk after every write.
+        :type fsync: bool
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.serializer = load_serializer(serializer)
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._index_buffer = bytearray()
+        self._reset()
+
+    def _reset(self):
+        """
+        Forget the open files, e.g., in a forked process.
+        """
+        self._pid = os.getpid()
+        self._number = None
+        self._segment = None
+        self._index = None
+        self._lock_file = None
+
+    def segment_path(self, number, extension='log'):
+        return os.path.join(self.path, 'segment-{:08d}.{}'.format(number, extension))
+
+    def get_segments(self):
+        """
+        Get the numbers of the segments in the directory, in the order they were written.
+
+        :rtype: list
+        """
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(int(match.group(1)) for match in map(SEGMENT_PATTERN.match, names) if match)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the lock of this process and, where supported, the lock of the directory.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked, the open files are shared with the parent process (including the lock).
+                self._reset()
+            if self._lock_file is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._lock_file = open(os.path.join(self.path, 'lock'), 'ab')
+
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def write(self, records):
+        """
+        Append change records (and the records in batches) to the active segment, and add them to its index.
+
+        :param records: The change records and batches.
+        :type records: list
+        """
+        records = [record for record in iter_records(records) if should_store(record)]
+        if not records:
+            return
+
+        with self.locked():
+            self._open_active()
+            offset = os.fstat(self._segment.fileno()).st_size
+            if offset >= self.segment_size:
+                self._seal()
+                offset = 0
+
+            buffer, index_buffer = self._buffer, self._index_buffer
+            try:
+                for record in records:
+                    label = record.model._meta.label
+                    data = self.serializer.dumpb({
+                        'model': label,
+                        'pk': record.pk if isinstance(record.pk, (int, str)) else smart_text(record.pk),
+                        'action': record.action,
+                        'phase': record.phase,
+                        'changes': record.changes,
+                        'actor': record.actor.user_id,
+                        'remote_addr': record.actor.remote_addr,
+                        'timestamp': record.timestamp,
+                    })
+                    index_buffer += ENTRY.pack(object_key(label, record.pk), offset + len(buffer))
+                    buffer += FRAME.pack(len(data))
+                    buffer += data
+
+                self._append(self._segment, buffer)
+                self._append(self._index, index_buffer)
+            finally:
+                # The buffers are reused for the next batch.
+                del buffer[:]
+                del index_buffer[:]
+
+    def _append(self, file, data):
+        file.write(data)
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    def _open_active(self):
+        """
+        Open the active segment and its index, repairing the index if the last write was interrupted. Another process
+        may have started a new segment since the last write.
+        """
+        if self._number is not None and not os.path.exists(self.segment_path(self._number + 1)):
+            return
+
+        self._close()
+        segments = self.get_segments()
+        self._number = segments[-1] if segments else 1
+        for number in segments[:-1]:
+            if not os.path.exists(self.segment_path(number, 'sidx')):
+                # Interrupted while being sealed.
+                self.repair(number)
+                self.sort_index(number)
+        self.repair(self._number)
+        self._segment = open(self.segment_path(self._number), 'ab')
+        self._index = open(self.segment_path(self._number, 'idx'), 'ab')
+
+    def _close(self):
+        for file in (self._segment, self._index):
+            if file is not None:
+                file.close()
+        self._segment = self._index = None
+
+    def _seal(self):
+        """
+        Seal the active segment and start a new one.
+        """
+        self._close()
+        self.sort_index(self._number)
+        self._number += 1
+        self._segment = open(self.segment_path(self._number), 'ab')
+        self._index = open(self.segment_path(self._number, 'idx'), 'ab')
+
+    def sort_index(self, number):
+        """
+        Replace the index of a segment by an index sorted by hash.
+
+        :param number: The number of the segment.
+        :type number: int
+        """
+        path = self.segment_path(number, 'idx')
+        with open(path, 'rb') as file:
+            entries = sorted(ENTRY.iter_unpack(file.read()))
+        temp = self.segment_path(number, 'sidx.tmp')
+        with open(temp, 'wb') as file:
+            file.write(b''.join(ENTRY.pack(*entry) for entry in entries))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.segment_path(number, 'sidx'))
+        os.remove(path)
+
+    def repair(self, number):
+        """
+        Make the index of a segment cover all its records, starting after the last indexed record, and drop an
+        incomplete record at the end of the segment.
+
+        :param number: The number of the segment.
+        :type number: int
+        """
+        segment_path, index_path = self.segment_path(number), self.segment_path(number, 'idx')
+        if not os.path.exists(segment_path):
+            return
+
+        with open(index_path, 'ab+') as index:
+            size = index.seek(0, os.SEEK_END)
+            if size % ENTRY.size:
+                # An incomplete entry.
+                size -= size % ENTRY.size
+                index.truncate(size)
+
+            with open(segment_path, 'rb+') as segment:
+                end = 0
+                if size:
+                    index.seek(size - ENTRY.size)
+                    key, offset = ENTRY.unpack(index.read(ENTRY.size))
+                    segment.seek(offset)
+                    end = offset + FRAME.size + FRAME.unpack(segment.read(FRAME.size))[0]
+
+                segment.seek(end)
+                entries, offset, data = [], end, segment.read()
+                while len(data) - (offset - end) >= FRAME.size:
+                    length = FRAME.unpack_from(data, offset - end)[0]
+                    payload = data[offset - end + FRAME.size:offset - end + FRAME.size + length]
+                    if len(payload) < length:
+                        break
+                    record = self.serializer.loads(payload)
+                    entries.append(ENTRY.pack(object_key(record['model'], record['pk']), offset))
+                    offset += FRAME.size + length
+
+                if offset < end + len(data):
+                    # An incomplete record.
+                    segment.truncate(offset)
+
+            index.seek(0, os.SEEK_END)
+            index.write(b''.join(entries))
+
+    def rebuild(self):
+        """
+        Rebuild the indexes of all segments from the segments, e.g., after a crash or when indexes were lost.
+
+        :return: The number of segments.
+        :rtype: int
+        """
+        with self.locked():
+            self._close()
+            self._number = None
+            segments = self.get_segments()
+            for number in segments:
+                for extension in ('idx', 'sidx', 'sidx.tmp'):
+                    try:
+                        os.remove(self.segment_path(number, extension))
+                    except FileNotFoundError:
+                        pass
+                self.repair(number)
+                if number != segments[-1]:
+                    self.sort_index(number)
+        return len(segments)
+
+    def history(self, model, pk):
+        """
+        Get the stored records of an object, in the order they were written. Only the index of every segment is read,
+        and the records of the object.
+
+        :param model: The model, or its label (e.g., ``'shop.Order'``).
+        :type model: Model or str
+        :param pk: The primary key of the object.
+        :return: The records as dictionaries.
+        :rtype: list
+        """
+        label = model if isinstance(model, str) else model._meta.label
+        key = object_key(label, pk)
+        pk = smart_text(pk)
+
+        history = []
+        for number in self.get_segments():
+            offsets = self._find(number, key)
+            if not offsets:
+                continue
+            with open(self.segment_path(number), 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            with data:
+                for offset in offsets:
+                    length = FRAME.unpack_from(data, offset)[0]
+                    record = self.serializer.loads(data[offset + FRAME.size:offset + FRAME.size + length])
+                    # Different objects may have the same hash.
+                    if record['model'] == label and smart_text(record['pk']) == pk:
+                        history.append(record)
+        return history
+
+    def _find(self, number, key):
+        """
+        Get the offsets of the records with the given hash in a segment.
+        """
+        for extension in ('sidx', 'idx'):
+            try:
+                file = open(self.segment_path(number, extension), 'rb')
+            except FileNotFoundError:
+                # Not sealed (yet).
+                continue
+            with file:
+                if not os.fstat(file.fileno()).st_size:
+                    return []
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                    if extension == 'idx':
+                        # Another process may be appending an entry.
+                        entries = memoryview(index)[:len(index) - len(index) % ENTRY.size]
+                        try:
+                            return [offset for entry_key, offset in ENTRY.iter_unpack(entries) if entry_key == key]
+                        finally:
+                            entries.release()
+                    return search_index(index, key)
+        return []
+
+
+def search_index(index, key):
+    """
+    Get the offsets of the entries with the given hash in a sorted index.
+
+    :param index: The sorted index.
+    :type index: mmap.mmap
+    :param key: The hash.
+    :type key: int
+    :return: The offsets, in ascending order.
+    :rtype: list
+    """
+    low, high = 0, len(index) // ENTRY.size
+    while low < high:
+        middle = (low + high) // 2
+        if ENTRY.unpack_from(index, middle * ENTRY.size)[0] < key:
+            low = middle + 1
+        else:
+            high = middle
+
+    offsets = []
+    for position in range(low * ENTRY.size, len(index), ENTRY.size):
+        entry_key, offset = ENTRY.unpack_from(index, position)
+        if entry_key != key:
+            break
+        offsets.append(offset)
+    return offsets
+
+
+_store = None
+_configured = False
+
+
+def get_file_store():
+    """
+    Get the file store configured with the ``AUDITLOG_FILE_STORE`` setting, or ``None`` if records are not stored in
+    files.
+
+    :return: The file store.
+    :rtype: FileStore
+    """
+    global _store, _configured
+
+    if not _configured:
+        config = getattr(settings, 'AUDITLOG_FILE_STORE', None)
+        if config:
+            _store = FileStore(
+                path=config['PATH'],
+                segment_size=config.get('SEGMENT_SIZE', 64 * 1024 * 1024),
+                serializer=config.get('SERIALIZER', 'json'),
+                fsync=config.get('FSYNC', False),
+            )
+        _configured = True
+
+    return _store
+
+
+def reset_file_store(**kwargs):
+    """
+    Forget the configured file store, the next call to :py:func:`get_file_store` reads the settings again.
+    """
+    global _store, _configured
+
+    if kwargs.get('setting') not in (None, 'AUDITLOG_FILE_STORE'):
+        return
+
+    if _store is not None:
+        with _store.locked():
+            _store._close()
+    _store, _configured = None, False
+
+
+setting_changed.connect(reset_file_store)
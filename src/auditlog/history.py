@@ -0,0 +1,332 @@
+from __future__ import unicode_literals
+
+import re
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, DateTimeField, F, Max, Min, OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.encoding import smart_text
+
+from auditlog.diff import diff_digest
+
+
+class Unknown(object):
+    """
+    The value of a field that cannot be reconstructed from the log entries, e.g., because it is masked.
+    """
+
+    def __repr__(self):
+        return 'UNKNOWN'
+
+    def __bool__(self):
+        return False
+
+
+#: The value of fields of which the value is not known.
+UNKNOWN = Unknown()
+
+HUNK_PATTERN = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@$')
+
+
+def state_at(model, pk, when=None, using=None):
+    """
+    Reconstruct the values of the tracked fields of an object at a point in time from its log entries (see the
+    ``AUDITLOG_LOG_ENTRIES`` setting). Only the log entries after the last checkpoint before that time are replayed.
+
+    The values are converted back to the native values of the fields (e.g., decimals and datetimes). Fields of which the
+    value is not known are :py:data:`UNKNOWN`: masked fields, fields of which only a digest is logged, and fields that
+    did not change since the object was created if it was created before log entries were stored.
+
+    :param model: The model.
+    :type model: Model
+    :param pk: The primary key of the object.
+    :param when: The point in time, defaults to now.
+    :type when: datetime
+    :param using: The database alias of the log entries.
+    :type using: str
+    :return: The values by field name, or ``None`` if the object did not exist at that time (as far as the log entries
+        tell).
+    :rtype: dict
+    """
+    from django.contrib.contenttypes.models import ContentType
+
+    content_type = ContentType.objects.db_manager(using).get_for_model(model)
+    state, entry = replay(content_type, smart_text(pk), when, using)
+    if state is None:
+        return None
+
+    from auditlog.registry import auditlog
+
+    fields, m2m_fields = get_tracked_fields(model)
+    values = {name: state.get(name, UNKNOWN) for name in fields + m2m_fields}
+    for field in auditlog.get_diff_plan(model).fields:
+        values[field.name] = to_python(field, values[field.name])
+    return values
+
+
+def to_python(field, value):
+    """
+    Convert a value decoded from a log entry (e.g., the text of a decimal or a date) back to the native value of the
+    field. Date/time values are made aware when time zone support is enabled. Values that the field cannot convert are
+    returned as they are.
+
+    :param field: The field.
+    :type field: Field
+    :param value: The decoded value, or :py:data:`UNKNOWN`.
+    :return: The native value.
+    """
+    if value is None or value is UNKNOWN:
+        return value
+    try:
+        value = field.to_python(value)
+    except ValidationError:
+        return value
+    if isinstance(field, DateTimeField) and settings.USE_TZ and timezone.is_naive(value):
+        # Date/time values are logged in their naive form in UTC, see :py:func:`auditlog.diff.get_datetime_value`.
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def get_tracked_fields(model):
+    """
+    Get the names of the fields of a registered model of which the changes are logged.
+
+    :param model: The model.
+    :type model: Model
+    :return: The names of the fields, and the names of the many-to-many fields.
+    :rtype: tuple
+    """
+    from auditlog.registry import auditlog
+
+    plan = auditlog.get_diff_plan(model)
+    fields = [field.name for field in plan.fields]
+    m2m_fields = []
+    if auditlog.contains(model) and auditlog._registry[model]['m2m']:
+        from auditlog.m2m import get_m2m_fields
+
+        m2m_fields = [field.name for field in get_m2m_fields(model, plan.include_fields, plan.exclude_fields)]
+    return fields, m2m_fields
+
+
+def replay(content_type, object_pk, when=None, using=None):
+    """
+    Replay the log entries of an object, starting at the last checkpoint before the given time.
+
+    :return: The known values by field name (or ``None`` if the object did not exist), and the last log entry that was
+        replayed (or ``None`` if there are no log entries).
+    :rtype: tuple
+    """
+    from auditlog.models import Checkpoint, LogEntry
+
+    checkpoints = Checkpoint.objects.using(using).filter(content_type=content_type, object_pk=object_pk)
+    entries = LogEntry.objects.using(using).filter(content_type=content_type, object_pk=object_pk)
+    if when is not None:
+        checkpoints = checkpoints.filter(timestamp__lte=when)
+        entries = entries.filter(timestamp__lte=when)
+
+    checkpoint = checkpoints.select_related('log_entry').order_by('-timestamp', '-log_entry_id').first()
+    state, entry = None, None
+    if checkpoint is not None:
+        state, entry = dict(checkpoint.state), checkpoint.log_entry
+        entries = entries.filter(
+            Q(timestamp__gt=checkpoint.timestamp) | Q(timestamp=checkpoint.timestamp, pk__gt=checkpoint.log_entry_id)
+        )
+
+    model = content_type.model_class()
+    for entry in entries.order_by('timestamp', 'pk').iterator():
+        state = apply_entry(model, state, entry)
+    return state, entry
+
+
+def apply_entry(model, state, entry):
+    """
+    Apply the changes of a log entry to the known values of an object.
+
+    :param model: The model.
+    :type model: Model
+    :param state: The known values by field name, or ``None`` if the object does not exist.
+    :type state: dict
+    :param entry: The log entry.
+    :type entry: auditlog.models.LogEntry
+    :return: The new known values, or ``None`` if the object is deleted.
+    :rtype: dict
+    """
+    from auditlog.models import LogEntry
+    from auditlog.registry import auditlog
+
+    if entry.action == LogEntry.Action.DELETE:
+        return None
+
+    plan = auditlog.get_diff_plan(model)
+    strategies = dict(zip((field.name for field in plan.fields), plan.strategies))
+    if entry.action == LogEntry.Action.CREATE:
+        # Changes are diffed against ``None`` when an object is created, so fields that are not logged are ``None`` and
+        # relations are empty.
+        fields, m2m_fields = get_tracked_fields(model)
+        state = {name: None for name in fields if name not in plan.mask_value_fields}
+        state.update((name, []) for name in m2m_fields)
+    elif state is None:
+        # The object was created before log entries were stored.
+        state = {}
+
+    for name, change in (entry.changes or {}).items():
+        if name in plan.mask_value_fields:
+            state.pop(name, None)
+        elif strategies.get(name) is diff_digest and isinstance(change, list) and isinstance(change[1], dict):
+            state.pop(name, None)
+        elif isinstance(change, dict):
+            value = apply_structured_change(state.get(name, UNKNOWN), change)
+            if value is UNKNOWN:
+                state.pop(name, None)
+            else:
+                state[name] = value
+        else:
+            state[name] = change[1]
+    return state
+
+
+def apply_structured_change(value, change):
+    """
+    Apply a change that is not logged as the old and new value: a JSON patch, the hunks of a text diff, or the primary
+    keys added to or removed from a many-to-many relation.
+
+    :param value: The known value before the change, or :py:data:`UNKNOWN`.
+    :param change: The change.
+    :type change: dict
+    :return: The value after the change, or :py:data:`UNKNOWN`.
+    """
+    if value is UNKNOWN:
+        return UNKNOWN
+    if 'added' in change or 'removed' in change:
+        pks = set(value) | set(change.get('added', ()))
+        pks -= set(change.get('removed', ()))
+        return sorted(pks, key=lambda pk: (str(type(pk)), pk))
+    if 'patch' in change:
+        return apply_json_patch(value, change['patch'])
+    if 'diff' in change:
+        return apply_text_diff(value, change['diff'])
+    return UNKNOWN
+
+
+def apply_json_patch(value, patch):
+    """
+    Apply the operations logged by :py:func:`auditlog.diff.diff_json`.
+    """
+    import copy
+
+    value = copy.deepcopy(value)
+    for operation in patch:
+        tokens = [token.replace('~1', '/').replace('~0', '~') for token in operation['path'].split('/')[1:]]
+        if not tokens:
+            value = operation.get('value')
+            continue
+
+        parent = value
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        key = int(tokens[-1]) if isinstance(parent, list) else tokens[-1]
+
+        if operation['op'] == 'remove':
+            del parent[key]
+        elif operation['op'] == 'add' and isinstance(parent, list):
+            parent.insert(key, operation['value'])
+        else:
+            parent[key] = operation['value']
+    return value
+
+
+def apply_text_diff(value, diff):
+    """
+    Apply the hunks logged by :py:func:`auditlog.diff.diff_text`.
+    """
+    lines = smart_text(value).split('\n')
+    result, position = [], 0
+    hunk = None
+    for line in diff.split('\n'):
+        match = HUNK_PATTERN.match(line)
+        if match:
+            start, count = int(match.group(1)), int(match.group(2) or 1)
+            # Without removed lines, the start is the line after which lines are added.
+            start = start - 1 if count else start
+            result.extend(lines[position:start])
+            position = start + count
+            hunk = True
+        elif hunk and line.startswith('+'):
+            result.append(line[1:])
+    result.extend(lines[position:])
+    return '\n'.join(result)
+
+
+def get_checkpoint_settings():
+    """
+    Get the number of log entries and the number of seconds after which a checkpoint of an object is written,
+    configured with the ``AUDITLOG_CHECKPOINT_EVERY`` (100) and ``AUDITLOG_CHECKPOINT_INTERVAL`` (``None``) settings.
+
+    :rtype: tuple
+    """
+    return (
+        getattr(settings, 'AUDITLOG_CHECKPOINT_EVERY', 100),
+        getattr(settings, 'AUDITLOG_CHECKPOINT_INTERVAL', None),
+    )
+
+
+def checkpoint(entries, using=None):
+    """
+    Write checkpoints for the objects of the given log entries that have had ``AUDITLOG_CHECKPOINT_EVERY`` log entries
+    since their last checkpoint, or of which the last checkpoint is older than ``AUDITLOG_CHECKPOINT_INTERVAL``
+    seconds. The number of log entries since the last checkpoint of all objects is counted with a single query, and
+    every checkpoint replays at most the log entries since the previous checkpoint.
+
+    :param entries: The log entries that were just stored.
+    :type entries: list
+    :param using: The database alias of the log entries.
+    :type using: str
+    :return: The checkpoints that were written.
+    :rtype: list
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from auditlog.models import Checkpoint, LogEntry
+
+    every, interval = get_checkpoint_settings()
+    if not entries or (every is None and interval is None):
+        return []
+
+    keys = {(entry.content_type_id, entry.object_pk) for entry in entries}
+    last_checkpoint = Checkpoint.objects.using(using).filter(
+        content_type=OuterRef('content_type'), object_pk=OuterRef('object_pk'),
+    ).order_by('-timestamp', '-log_entry_id')
+    counts = LogEntry.objects.using(using).filter(
+        content_type__in={content_type for content_type, object_pk in keys},
+        object_pk__in={object_pk for content_type, object_pk in keys},
+    ).annotate(
+        checkpoint_timestamp=Subquery(last_checkpoint.values('timestamp')[:1]),
+    ).filter(
+        Q(checkpoint_timestamp__isnull=True) | Q(timestamp__gt=F('checkpoint_timestamp')),
+    ).order_by().values('content_type', 'object_pk').annotate(
+        count=Count('pk'), first=Min('timestamp'), since=Max('checkpoint_timestamp'),
+    )
+
+    now = timezone.now() if settings.USE_TZ else datetime.now()
+    due = []
+    for row in counts:
+        key = (row['content_type'], row['object_pk'])
+        if key not in keys:
+            continue
+        if every is not None and row['count'] >= every:
+            due.append(key)
+        elif interval is not None and now - (row['since'] or row['first']) >= timedelta(seconds=interval):
+            due.append(key)
+
+    checkpoints = []
+    for content_type_id, object_pk in due:
+        content_type = ContentType.objects.db_manager(using).get_for_id(content_type_id)
+        state, entry = replay(content_type, object_pk, using=using)
+        if state is not None and entry is not None:
+            checkpoints.append(Checkpoint(
+                content_type_id=content_type_id, object_pk=object_pk, log_entry=entry, timestamp=entry.timestamp,
+                state=state,
+            ))
+    Checkpoint.objects.using(using).bulk_create(checkpoints)
+    return checkpoints
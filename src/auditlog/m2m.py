@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+from auditlog.records import ChangeRecord, UPDATE, SUCCESS
+
+PRE_ACTIONS = ('pre_remove', 'pre_clear')
+POST_ACTIONS = ('post_add', 'post_remove', 'post_clear')
+
+
+def get_m2m_fields(model, include_fields=(), exclude_fields=()):
+    """
+    Get the many-to-many fields of a model that are tracked, applying the same filtering as for the other fields.
+
+    :param model: The model.
+    :type model: Model
+    :param include_fields: The fields to include. Implicitly excludes all other fields.
+    :type include_fields: list
+    :param exclude_fields: The fields to exclude. Overrides the fields to include.
+    :type exclude_fields: list
+    :return: The tracked many-to-many fields.
+    :rtype: tuple
+    """
+    return tuple(
+        field for field in model._meta.many_to_many
+        if (not include_fields or field.name in include_fields) and field.name not in exclude_fields
+    )
+
+
+def serialize_pks(pks):
+    """
+    Sort primary keys and make them JSON serializable.
+
+    :param pks: The primary keys.
+    :type pks: set
+    :rtype: list
+    """
+    return [pk if isinstance(pk, (int, str)) else str(pk) for pk in sorted(pks)]
+
+
+def get_related_pks(field, instance, reverse, pk_set, using=None):
+    """
+    Get the primary keys of the objects that are currently related to an instance through a many-to-many field, with a
+    single query on the 'through' table that does not load the related objects.
+
+    :param field: The many-to-many field.
+    :type field: ManyToManyField
+    :param instance: The instance of which the relation is changed, the model of the field unless ``reverse``.
+    :type instance: Model
+    :param reverse: Whether the relation is changed from the related model.
+    :type reverse: bool
+    :param pk_set: Only look at these primary keys of the other side of the relation, defaults to all.
+    :type pk_set: set
+    :param using: The database alias.
+    :type using: str
+    :return: The primary keys of the related objects.
+    :rtype: set
+    """
+    source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    if reverse:
+        source, target = target, source
+
+    queryset = field.remote_field.through._default_manager.using(using).filter(**{source: instance.pk})
+    if pk_set is not None:
+        queryset = queryset.filter(**{target + '__in': pk_set})
+    return set(queryset.values_list(target, flat=True))
+
+
+def get_m2m_records(model, field, instance, action, reverse, pk_set, using=None):
+    """
+    Create the change records for a change of a many-to-many relation. A change from the side of the field results in
+    a single record with the added or removed primary keys, a change from the related model results in a record for
+    each object of the registered model.
+
+    :param model: The registered model.
+    :type model: Model
+    :param field: The many-to-many field.
+    :type field: ManyToManyField
+    :param instance: The instance of which the relation is changed.
+    :type instance: Model
+    :param action: The ``post_*`` action of the ``m2m_changed`` signal.
+    :type action: str
+    :param reverse: Whether the relation is changed from the related model.
+    :type reverse: bool
+    :param pk_set: The primary keys of the objects that were added or removed on the other side of the relation.
+    :type pk_set: set
+    :param using: The database alias the relation was changed on.
+    :type using: str
+    :rtype: list
+    """
+    if not pk_set:
+        return []
+
+    key = 'added' if action == 'post_add' else 'removed'
+
+    if not reverse:
+        changes = {field.name: {key: serialize_pks(pk_set)}}
+        return [ChangeRecord.for_instance(instance, UPDATE, SUCCESS, changes, using=using)]
+
+    changes = {field.name: {key: serialize_pks([instance.pk])}}
+    return [ChangeRecord.for_object(model, pk, UPDATE, SUCCESS, changes, using=using) for pk in sorted(pk_set)]
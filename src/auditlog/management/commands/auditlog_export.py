@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+
+import os
+import time
+from datetime import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from auditlog.export import FORMATS, SPLITS, dump_shards, export, load_shards, plan_shards
+
+
+class Command(BaseCommand):
+    help = "Exports the log entries to JSON lines or CSV, optionally compressed and in shards written in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The file to export to, e.g. 'auditlog-2020-03.jsonl.gz'.")
+        parser.add_argument('--format', choices=FORMATS, default='jsonl', help="The format of the export.")
+        parser.add_argument('--gzip', action='store_true', default=False, help="Compress the export with gzip.")
+        parser.add_argument('--since', help="Only export log entries from this date or time on (ISO 8601).")
+        parser.add_argument('--until', help="Only export log entries before this date or time (ISO 8601).")
+        parser.add_argument('--model', action='append', dest='models', metavar='MODEL',
+                            help="Only export the log entries of this model, e.g. 'shop.Order'. Can be repeated.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="The number of processes, each of which writes a shard of the export.")
+        parser.add_argument('--split', choices=SPLITS, default='time',
+                            help="Split the shards by time range or by content type.")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="The number of log entries to read and write at once.")
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help="Resume an interrupted export from its checkpoints.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="The database to export from.")
+
+    def handle(self, *args, **options):
+        path, using = options['path'], options['database']
+        if options['workers'] < 1 or options['chunk_size'] < 1:
+            raise CommandError("The number of workers and the chunk size must be positive.")
+
+        # The shards are stored, so a resumed export uses the same shards even if log entries were added since.
+        manifest = path + '.manifest'
+        if options['resume'] and os.path.exists(manifest):
+            with open(manifest) as manifest_file:
+                shards = load_shards(manifest_file.read())
+        else:
+            shards = plan_shards(
+                path, options['workers'], options['split'], self.parse_time(options['since']),
+                self.parse_time(options['until']), self.get_content_types(options['models'], using), using,
+            )
+            with open(manifest, 'w') as manifest_file:
+                manifest_file.write(dump_shards(shards))
+
+        started = time.time()
+        try:
+            results = export(
+                shards, workers=options['workers'], format=options['format'], compress=options['gzip'],
+                chunk_size=options['chunk_size'], resume=options['resume'], using=using,
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        seconds = max(time.time() - started, 1e-6)
+
+        if options['verbosity'] > 1:
+            for result in results:
+                self.stdout.write("Shard {}: {} rows, {} bytes in {:.2f} s.".format(
+                    result.shard, result.rows, result.bytes, result.seconds))
+        rows, written = sum(result.rows for result in results), sum(result.bytes for result in results)
+        self.stdout.write("Exported {} rows ({} bytes) to {} files in {:.2f} s: {:.0f} rows/s, {:.0f} bytes/s.".format(
+            rows, written, len(shards), seconds, rows / seconds, written / seconds,
+        ))
+
+    def parse_time(self, value):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise CommandError("Invalid date or time '{}', use ISO 8601.".format(value))
+            parsed = datetime.combine(date, datetime.min.time())
+        if settings.USE_TZ and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def get_content_types(self, labels, using):
+        from django.contrib.contenttypes.models import ContentType
+
+        if not labels:
+            return None
+        try:
+            models = [apps.get_model(label) for label in labels]
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+        content_types = ContentType.objects.db_manager(using).get_for_models(*models)
+        return sorted(content_type.pk for content_type in content_types.values())
@@ -0,0 +1,35 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auditlog.filestore import get_file_store
+from auditlog.serializers import load_serializer
+
+
+class Command(BaseCommand):
+    help = "Prints the history of an object from the file store, one JSON encoded record per line."
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', nargs='?', help="The label of the model, e.g. 'shop.Order'.")
+        parser.add_argument('pk', nargs='?', help="The primary key of the object.")
+        parser.add_argument('--rebuild', action='store_true', default=False,
+                            help="Rebuild the indexes from the segments first, e.g. after a crash.")
+
+    def handle(self, *args, **options):
+        store = get_file_store()
+        if store is None:
+            raise CommandError("The file store is not configured, see the AUDITLOG_FILE_STORE setting.")
+
+        if options['rebuild']:
+            segments = store.rebuild()
+            self.stderr.write("Rebuilt the indexes of {} segments.".format(segments))
+        elif not options['model']:
+            raise CommandError("Pass a model label and primary key, or --rebuild.")
+
+        if options['model']:
+            if options['pk'] is None:
+                raise CommandError("Pass the primary key of the object.")
+
+            serializer = load_serializer('json')
+            for record in store.history(options['model'], options['pk']):
+                self.stdout.write(serializer.dumps(record))
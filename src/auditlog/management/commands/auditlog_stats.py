@@ -0,0 +1,51 @@
+from __future__ import unicode_literals
+
+import argparse
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from auditlog.metrics import BYTES, CALLS, DIFF, EMIT, FETCH, QUERIES, RECEIVER, SERIALIZE, collect_metrics
+
+COLUMNS = (
+    ('calls', CALLS, 1),
+    ('queries', QUERIES, 1),
+    ('receiver ms', RECEIVER, 1000),
+    ('fetch ms', FETCH, 1000),
+    ('diff ms', DIFF, 1000),
+    ('serialize ms', SERIALIZE, 1000),
+    ('emit ms', EMIT, 1000),
+    ('bytes', BYTES, 1),
+)
+
+
+class Command(BaseCommand):
+    help = "Prints the overhead of auditing per model and action while running another management command."
+
+    def add_arguments(self, parser):
+        parser.add_argument('command', help="The management command to measure, e.g. 'loaddata'.")
+        parser.add_argument('arguments', nargs=argparse.REMAINDER, help="The arguments of the command.")
+
+    def handle(self, *args, **options):
+        with collect_metrics() as metrics:
+            call_command(options['command'], *options['arguments'])
+
+        totals = metrics.get_totals()
+        rows = [
+            ['{} {}'.format(label, action)] + [self.format(values[name] * scale) for title, name, scale in COLUMNS]
+            for (label, action), values in sorted(totals.items())
+        ]
+        rows.append(['total'] + [
+            self.format(sum(values[name] for values in totals.values()) * scale) for title, name, scale in COLUMNS
+        ])
+
+        header = ['model action'] + [title for title, name, scale in COLUMNS]
+        widths = [max(len(row[index]) for row in [header] + rows) for index in range(len(header))]
+        for row in [header] + rows:
+            self.stdout.write('  '.join(
+                cell.ljust(width) if index == 0 else cell.rjust(width)
+                for index, (cell, width) in enumerate(zip(row, widths))
+            ))
+
+    def format(self, value):
+        return '{:.0f}'.format(value) if value == int(value) else '{:.2f}'.format(value)
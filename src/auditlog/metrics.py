@@ -0,0 +1,279 @@
+from __future__ import unicode_literals
+
+import abc
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+#: The number of calls of a signal receiver.
+CALLS = 'calls'
+#: The number of queries issued by a signal receiver.
+QUERIES = 'queries'
+#: The seconds spent in a signal receiver.
+RECEIVER = 'receiver'
+#: The seconds spent fetching the old values of an object.
+FETCH = 'fetch'
+#: The seconds spent comparing the old and new values of an object.
+DIFF = 'diff'
+#: The seconds spent serializing the changes of a record, measured once when the record is emitted.
+SERIALIZE = 'serialize'
+#: The seconds spent passing records to the logger and the sinks, or buffering them.
+EMIT = 'emit'
+#: The size in bytes of the serialized changes of a record, measured once when the record is emitted.
+BYTES = 'bytes'
+
+METRICS = (CALLS, QUERIES, RECEIVER, FETCH, DIFF, SERIALIZE, EMIT, BYTES)
+
+
+class Metrics(object, metaclass=abc.ABCMeta):
+    """
+    Receives the measurements of the overhead of auditing. Subclass it to pass the measurements to a monitoring system,
+    and configure the subclass with the ``AUDITLOG_METRICS`` setting. A subclass must implement :py:meth:`observe`, or
+    it cannot be configured.
+    """
+
+    @abc.abstractmethod
+    def observe(self, name, label, action, value):
+        """
+        Record a measurement.
+
+        :param name: The name of the metric, one of :py:data:`METRICS`.
+        :type name: str
+        :param label: The label of the model, e.g. ``'shop.Order'``.
+        :type label: str
+        :param action: The action, one of the actions of :py:mod:`auditlog.records`.
+        :type action: str
+        :param value: The value: a number of calls, queries or bytes, or a duration in seconds.
+        :type value: float
+        """
+
+
+class InProcessMetrics(Metrics):
+    """
+    Keeps the number, sum and maximum of the measurements of every metric, model and action in memory.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, label, action, value):
+        key = (label, action, name)
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                self.stats[key] = [1, value, value]
+            else:
+                stat[0] += 1
+                stat[1] += value
+                if value > stat[2]:
+                    stat[2] = value
+
+    def get_totals(self):
+        """
+        Get the sum of the measurements of every metric, by model label and action.
+
+        :return: The sums by metric name, by label and action.
+        :rtype: dict
+        """
+        totals = {}
+        with self.lock:
+            for (label, action, name), (count, total, maximum) in self.stats.items():
+                totals.setdefault((label, action), dict.fromkeys(METRICS, 0))[name] = total
+        return totals
+
+    def reset(self):
+        """
+        Forget all measurements.
+        """
+        with self.lock:
+            self.stats.clear()
+
+
+_metrics = None
+_configured = False
+_collector = contextvars.ContextVar('auditlog_metrics_collector', default=None)
+
+
+def get_metrics():
+    """
+    Get the metrics hook configured with the ``AUDITLOG_METRICS`` setting: ``True`` for an :py:class:`InProcessMetrics`,
+    or the path to a :py:class:`Metrics` class. By default nothing is measured. While :py:func:`collect_metrics` is
+    used, the measurements made in its context go to its registry instead.
+
+    :return: The metrics hook, or ``None`` if nothing is measured.
+    :rtype: Metrics
+    """
+    global _metrics, _configured
+
+    collector = _collector.get()
+    if collector is not None:
+        return collector
+
+    if not _configured:
+        hook = getattr(settings, 'AUDITLOG_METRICS', False)
+        if hook is True:
+            _metrics = InProcessMetrics()
+        elif hook:
+            _metrics = import_string(hook)()
+        else:
+            _metrics = None
+        _configured = True
+
+    return _metrics
+
+
+def reset_metrics(**kwargs):
+    """
+    Forget the configured metrics hook, the next call to :py:func:`get_metrics` reads the settings again.
+    """
+    global _metrics, _configured
+
+    if kwargs.get('setting') not in (None, 'AUDITLOG_METRICS'):
+        return
+    _metrics, _configured = None, False
+
+
+setting_changed.connect(reset_metrics)
+
+
+@contextmanager
+def collect_metrics():
+    """
+    Context manager that measures the overhead of auditing in an :py:class:`InProcessMetrics` registry of its own,
+    regardless of the ``AUDITLOG_METRICS`` setting. Only the changes made in the current thread (or async task) are
+    measured::
+
+        with collect_metrics() as metrics:
+            import_orders()
+        print(metrics.get_totals())
+
+    :rtype: InProcessMetrics
+    """
+    metrics = InProcessMetrics()
+    token = _collector.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _collector.reset(token)
+
+
+@contextmanager
+def measure(name, model, action):
+    """
+    Context manager that records the seconds spent in the block.
+
+    :param name: The name of the metric.
+    :type name: str
+    :param model: The model.
+    :type model: Model
+    :param action: The action.
+    :type action: str
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(name, model._meta.label, action, time.perf_counter() - started)
+
+
+class QueryCounter(object):
+    """
+    Database execute wrapper that counts the queries.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def instrument(get_model_action):
+    """
+    Decorator for signal receivers that records the calls, the queries issued and the seconds spent in the receiver.
+
+    :param get_model_action: Gets the model and action the receiver is called for from the arguments of the receiver.
+        The receiver is not measured if it returns ``None``.
+    :type get_model_action: callable
+    """
+    def decorator(receiver):
+        @functools.wraps(receiver)
+        def inner(sender, *args, **kwargs):
+            metrics = get_metrics()
+            model_action = get_model_action(sender, *args, **kwargs) if metrics is not None else None
+            if model_action is None:
+                return receiver(sender, *args, **kwargs)
+
+            label, action = model_action[0]._meta.label, model_action[1]
+            counter = QueryCounter()
+            started = time.perf_counter()
+            try:
+                with connections[kwargs.get('using') or DEFAULT_DB_ALIAS].execute_wrapper(counter):
+                    return receiver(sender, *args, **kwargs)
+            finally:
+                metrics.observe(RECEIVER, label, action, time.perf_counter() - started)
+                metrics.observe(CALLS, label, action, 1)
+                metrics.observe(QUERIES, label, action, counter.count)
+        return inner
+    return decorator
+
+
+class AuditOverheadError(AssertionError):
+    """
+    Raised by :py:func:`assert_audit_overhead` when auditing costs more than allowed.
+    """
+
+
+@contextmanager
+def assert_audit_overhead(max_queries=None, max_seconds=None, models=None):
+    """
+    Test helper that fails when auditing the changes made in the block issues more queries or takes more time than
+    allowed::
+
+        with assert_audit_overhead(max_queries=1):
+            order.save()
+
+    :param max_queries: The maximum number of queries issued by the signal receivers.
+    :type max_queries: int
+    :param max_seconds: The maximum number of seconds spent in the signal receivers.
+    :type max_seconds: float
+    :param models: The models to check, defaults to all models.
+    :type models: list
+    :raises AuditOverheadError: If auditing costs more than allowed.
+    """
+    labels = {model._meta.label for model in models} if models is not None else None
+
+    with collect_metrics() as metrics:
+        yield metrics
+
+    totals = {
+        key: values for key, values in metrics.get_totals().items() if labels is None or key[0] in labels
+    }
+    queries = sum(values[QUERIES] for values in totals.values())
+    seconds = sum(values[RECEIVER] for values in totals.values())
+    if max_queries is not None and queries > max_queries:
+        raise AuditOverheadError("Auditing issued {} queries, more than the allowed {}: {}".format(
+            queries, max_queries, format_totals(totals, QUERIES)))
+    if max_seconds is not None and seconds > max_seconds:
+        raise AuditOverheadError("Auditing took {:.6f} seconds, more than the allowed {}: {}".format(
+            seconds, max_seconds, format_totals(totals, RECEIVER)))
+
+
+def format_totals(totals, name):
+    return ', '.join(
+        '{} {} {}'.format(label, action, values[name]) for (label, action), values in sorted(totals.items())
+    )
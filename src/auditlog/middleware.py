@@ -1,4 +1,10 @@
-import threading
+import asyncio
+import contextvars
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 
 # Use MiddlewareMixin when present (Django >= 1.10)
 try:
@@ -6,18 +12,142 @@ try:
 except:
     MiddlewareMixin = object
 
+from auditlog.writer import adefer_flush, defer_flush
+
+auditlog_context = contextvars.ContextVar('auditlog_context', default=None)
+
+
+class Actor(object):
+    """
+    The user and remote address changes are attributed to. The display string of the user and the session hash (an
+    HMAC of the password hash) are only computed when they are first needed, and then kept for the rest of the request.
+    """
+    __slots__ = ('user', 'remote_addr', '_display', '_session_hash')
+
+    def __init__(self, user=None, remote_addr=None):
+        """
+        :param user: The authenticated user, or ``None``.
+        :type user: Model
+        :param remote_addr: The remote address of the request.
+        :type remote_addr: str
+        """
+        self.user = user
+        self.remote_addr = remote_addr
+        self._display = None
+        self._session_hash = None
+
+    @property
+    def user_id(self):
+        return self.user.pk if self.user else None
+
+    @property
+    def display(self):
+        """
+        The user as a string.
+
+        :rtype: str
+        """
+        if self._display is None:
+            self._display = str(self.user) if self.user else 'An unauthenticated user'
+        return self._display
+
+    @property
+    def session_hash(self):
+        """
+        The session hash of the user.
+
+        :rtype: str
+        """
+        if self._session_hash is None:
+            self._session_hash = self.user.get_session_auth_hash() if self.user else 'NO_SESSION'
+        return self._session_hash
+
+    @property
+    def log_message(self):
+        """
+        The prefix of the log messages of changes made by this actor.
+
+        :rtype: str
+        """
+        return f"{self.remote_addr} user '{self.display}' {self.session_hash}"
+
 
 class AuditlogMiddleware(MiddlewareMixin):
     """
     Middleware to couple the request's user to the logger in signal.
+
+    The user and remote address are stored in a context variable, so concurrent requests that are handled in the same
+    thread (e.g., async views under ASGI) do not see each other's user. The context is cleared when the response is
+    returned, also when handling the request raised an exception.
+
+    Every request gets a correlation id. When the ``AUDITLOG_AGGREGATE_REQUESTS`` setting is enabled, the change
+    records of a request are collected and emitted in batches of at most ``AUDITLOG_AGGREGATE_CHUNK_SIZE`` (100)
+    records when the request is done. Log entries that are buffered when the ``AUDITLOG_LOG_ENTRIES`` setting is
+    enabled are stored when the request is done as well.
     """
-    thread_local = threading.local()
+    sync_capable = True
+    async_capable = True
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self._acall(request)
+
+        context = self.get_context(request)
+        with defer_flush():
+            token = auditlog_context.set(context)
+            try:
+                return self.get_response(request)
+            finally:
+                auditlog_context.reset(token)
+                self.flush(context)
+
+    async def _acall(self, request):
+        """
+        Async version of :py:meth:`__call__`, used when the middleware chain is running asynchronously.
+        """
+        context = self.get_context(request)
+        async with adefer_flush():
+            token = auditlog_context.set(context)
+            try:
+                return await self.get_response(request)
+            finally:
+                auditlog_context.reset(token)
+                # Emitting resolves related objects and writes to the handlers, which must not block the event loop.
+                await sync_to_async(self.flush)(context)
 
-    def process_request(self, request):
+    def flush(self, context):
         """
-        Gets the current user from the request and attaches it to the local thread.
+        Emit the change records collected during a request in batches.
+
+        :param context: The auditlog context of the request.
+        :type context: dict
+        """
+        records = context['records']
+        if not records:
+            return
+
+        from auditlog.records import ChangeBatch
+        from auditlog.receivers import emit_change
+
+        size = getattr(settings, 'AUDITLOG_AGGREGATE_CHUNK_SIZE', 100)
+        for offset in range(0, len(records), size):
+            emit_change(ChangeBatch(
+                correlation_id=context['correlation_id'],
+                actor=context['actor'],
+                records=records[offset:offset + size],
+                timestamp=time.time(),
+            ))
+        del records[:]
+
+    def get_context(self, request):
         """
+        Gets the current user and remote address from the request.
 
+        :param request: The request.
+        :type request: HttpRequest
+        :return: The auditlog context of the request.
+        :rtype: dict
+        """
         # In case of proxy, set 'original' address
         if request.META.get('HTTP_X_FORWARDED_FOR'):
             remote_addr = request.META.get('HTTP_X_FORWARDED_FOR').split(',')[0]
@@ -30,21 +160,54 @@ class AuditlogMiddleware(MiddlewareMixin):
         else:
             current_user = None
 
-        # Initialize thread local storage
-        self.thread_local.auditlog = {
+        return {
             'remote_addr': remote_addr,
             'current_user': current_user,
+            'actor': Actor(current_user, remote_addr),
+            'correlation_id': uuid.uuid4().hex,
+            'records': [] if getattr(settings, 'AUDITLOG_AGGREGATE_REQUESTS', False) else None,
         }
 
     @classmethod
     def get_user(cls):
-        if hasattr(cls.thread_local, 'auditlog'):
-            return cls.thread_local.auditlog.get('current_user')
+        context = auditlog_context.get()
+        if context is not None:
+            return context.get('current_user')
 
     @classmethod
     def get_remote_address(cls):
-        if hasattr(cls.thread_local, 'auditlog'):
-            return cls.thread_local.auditlog.get('remote_addr')
+        context = auditlog_context.get()
+        if context is not None:
+            return context.get('remote_addr')
+
+    @classmethod
+    def get_correlation_id(cls):
+        context = auditlog_context.get()
+        if context is not None:
+            return context.get('correlation_id')
+
+    @classmethod
+    def get_collected_records(cls):
+        """
+        Get the list the change records of the current request are collected in, or ``None`` if they are not collected.
+
+        :rtype: list
+        """
+        context = auditlog_context.get()
+        if context is not None:
+            return context.get('records')
+
+    @classmethod
+    def get_actor(cls):
+        """
+        Get the actor of the current request, or an anonymous actor outside of a request.
+
+        :rtype: Actor
+        """
+        context = auditlog_context.get()
+        if context is not None:
+            return context['actor']
+        return Actor()
 
     def is_authenticated(self, user):
         """Return whether or not a User is authenticated.
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 02:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('auditlog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Checkpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_pk', models.CharField(max_length=255, verbose_name='object pk')),
+                ('timestamp', models.DateTimeField(verbose_name='timestamp')),
+                ('state', jsonfield.fields.JSONField(default=dict, verbose_name='state')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype', verbose_name='content type')),
+                ('log_entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='auditlog.logentry', verbose_name='log entry')),
+            ],
+            options={
+                'verbose_name': 'checkpoint',
+                'verbose_name_plural': 'checkpoints',
+                'get_latest_by': 'timestamp',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='checkpoint',
+            index=models.Index(fields=['content_type', 'object_pk', 'timestamp'], name='auditlog_ch_content_f51672_idx'),
+        ),
+    ]
@@ -0,0 +1,131 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils.encoding import smart_text
+from jsonfield.fields import JSONField
+
+
+class LogEntryManager(models.Manager):
+    """
+    Custom manager for the :py:class:`LogEntry` model.
+    """
+
+    def get_for_object(self, instance):
+        """
+        Get log entries for the specified model instance.
+
+        :param instance: The model instance to get log entries for.
+        :type instance: Model
+        :return: QuerySet of log entries for the given model instance.
+        :rtype: QuerySet
+        """
+        content_type = ContentType.objects.get_for_model(instance.__class__)
+        return self.filter(content_type=content_type, object_pk=smart_text(instance.pk))
+
+    def get_for_objects(self, queryset):
+        """
+        Get log entries for the objects in the specified queryset.
+
+        :param queryset: The queryset to get the log entries for.
+        :type queryset: QuerySet
+        :return: The LogEntry objects for the objects in the given queryset.
+        :rtype: QuerySet
+        """
+        content_type = ContentType.objects.get_for_model(queryset.model)
+        pks = [smart_text(pk) for pk in queryset.values_list('pk', flat=True)]
+        return self.filter(content_type=content_type, object_pk__in=pks)
+
+    def get_for_model(self, model):
+        """
+        Get log entries for all objects of a specified type.
+
+        :param model: The model to get log entries for.
+        :type model: class
+        :return: QuerySet of log entries for the given model.
+        :rtype: QuerySet
+        """
+        return self.filter(content_type=ContentType.objects.get_for_model(model))
+
+
+class LogEntry(models.Model):
+    """
+    Represents an entry in the audit log. The content type is saved along with the textual primary key, so the primary
+    key of the object can be of any type.
+
+    Log entries are only written when the ``AUDITLOG_LOG_ENTRIES`` setting is enabled, see
+    :py:mod:`auditlog.writer`.
+    """
+
+    class Action:
+        """
+        The actions that Auditlog distinguishes: creating, updating and deleting objects. Viewing objects is not logged.
+        """
+        CREATE = 0
+        UPDATE = 1
+        DELETE = 2
+
+        choices = (
+            (CREATE, "create"),
+            (UPDATE, "update"),
+            (DELETE, "delete"),
+        )
+
+    content_type = models.ForeignKey(to=ContentType, on_delete=models.CASCADE, related_name='+',
+                                     verbose_name="content type")
+    object_pk = models.CharField(max_length=255, verbose_name="object pk")
+    action = models.PositiveSmallIntegerField(choices=Action.choices, verbose_name="action")
+    changes = JSONField(blank=True, null=True, verbose_name="change message",
+                        encoder_class='django.core.serializers.json.DjangoJSONEncoder')
+    actor = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True,
+                              related_name='+', verbose_name="actor")
+    remote_addr = models.GenericIPAddressField(blank=True, null=True, verbose_name="remote address")
+    timestamp = models.DateTimeField(verbose_name="timestamp")
+
+    objects = LogEntryManager()
+
+    class Meta:
+        get_latest_by = 'timestamp'
+        ordering = ['-timestamp']
+        verbose_name = "log entry"
+        verbose_name_plural = "log entries"
+        indexes = [
+            models.Index(fields=['content_type', 'object_pk', 'timestamp']),
+            models.Index(fields=['actor', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return "{action} {content_type} {object_pk}".format(
+            action=self.get_action_display(),
+            content_type=self.content_type_id,
+            object_pk=self.object_pk,
+        )
+
+
+class Checkpoint(models.Model):
+    """
+    The state of the tracked fields of an object after a log entry, so :py:func:`auditlog.history.state_at` only needs
+    to replay the log entries after the checkpoint. Checkpoints are written by :py:func:`auditlog.history.checkpoint`.
+    """
+    content_type = models.ForeignKey(to=ContentType, on_delete=models.CASCADE, related_name='+',
+                                     verbose_name="content type")
+    object_pk = models.CharField(max_length=255, verbose_name="object pk")
+    log_entry = models.ForeignKey(to=LogEntry, on_delete=models.CASCADE, related_name='+', verbose_name="log entry")
+    timestamp = models.DateTimeField(verbose_name="timestamp")
+    state = JSONField(verbose_name="state", encoder_class='django.core.serializers.json.DjangoJSONEncoder')
+
+    class Meta:
+        get_latest_by = 'timestamp'
+        verbose_name = "checkpoint"
+        verbose_name_plural = "checkpoints"
+        indexes = [
+            models.Index(fields=['content_type', 'object_pk', 'timestamp']),
+        ]
+
+    def __str__(self):
+        return "{content_type} {object_pk} at {timestamp}".format(
+            content_type=self.content_type_id,
+            object_pk=self.object_pk,
+            timestamp=self.timestamp,
+        )
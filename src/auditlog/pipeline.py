@@ -0,0 +1,352 @@
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+
+from auditlog.filestore import get_file_store
+from auditlog.records import resolve_related
+from auditlog.writer import defer_flush, get_writer
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COUNT = 'count'
+
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COUNT)
+
+_STOP = object()
+
+#: Reports the batches the worker thread failed to write. This is not the audit logger, whose handlers may be the
+#: cause of the failure.
+error_logger = logging.getLogger('auditlog.pipeline')
+
+
+class AuditlogPipeline(object):
+    """
+    Writes change records to the handlers of a logger from a background thread, so slow handlers do not add to the
+    time it takes to save a model instance.
+
+    Records are put on a bounded queue. A worker thread takes them off the queue in batches, renders them and passes
+    every batch to each handler while holding the handler's lock only once. When the queue is full, the overflow policy
+    decides what happens:
+
+    - ``block``: wait until there is room on the queue.
+    - ``drop_oldest``: discard the oldest record on the queue to make room.
+    - ``drop_newest``: discard the new record.
+    - ``count``: discard the new record, and log a warning with the number of discarded records as soon as the queue
+      has room again.
+
+    The number of discarded records is available as :py:attr:`dropped` for every policy. Records of a batch that could
+    not be written are reported to the ``auditlog.pipeline`` logger and counted as discarded as well.
+
+    The worker thread is started on the first record that is put on the queue in a process. A process that is forked
+    from a process with a running pipeline (e.g., a gunicorn worker) gets a new queue and starts its own thread.
+    """
+
+    def __init__(self, logger, max_size=10000, batch_size=100, overflow=BLOCK, flush_timeout=5.0):
+        """
+        :param logger: The logger whose handlers the records are written to.
+        :type logger: logging.Logger
+        :param max_size: The maximum number of records on the queue.
+        :type max_size: int
+        :param batch_size: The maximum number of records written to the handlers at once.
+        :type batch_size: int
+        :param overflow: The overflow policy, one of ``OVERFLOW_POLICIES``.
+        :type overflow: str
+        :param flush_timeout: The number of seconds to wait for the queue to be written when the pipeline is stopped.
+        :type flush_timeout: float
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                "Unknown overflow policy '{}', use one of {}.".format(overflow, ', '.join(OVERFLOW_POLICIES))
+            )
+
+        self.logger = logger
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.flush_timeout = flush_timeout
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """
+        Create a fresh queue, without a worker thread.
+        """
+        self._queue = queue.Queue(self.max_size)
+        self._thread = None
+        self._pid = os.getpid()
+        self._unreported = 0
+        self._failed = False
+
+    def _ensure_started(self):
+        """
+        Start the worker thread if it is not running in this process.
+        """
+        if self._pid != os.getpid():
+            # Forked, the queue and thread belong to the parent process.
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    thread = threading.Thread(target=self._run, name='auditlog-pipeline')
+                    thread.daemon = True
+                    thread.start()
+                    self._thread = thread
+
+    def put(self, record):
+        """
+        Put a change record on the queue, applying the overflow policy if the queue is full.
+
+        :param record: The change record.
+        :type record: auditlog.records.ChangeRecord
+        """
+        self._ensure_started()
+
+        if self.overflow == BLOCK:
+            self._queue.put(record)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow != DROP_OLDEST:
+                    self._drop()
+                    return
+
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            else:
+                self._queue.task_done()
+                self._drop()
+
+    def _drop(self):
+        with self._lock:
+            self.dropped += 1
+            self._unreported += 1
+
+    def flush(self, timeout=None):
+        """
+        Wait until all records that are on the queue are written.
+
+        :param timeout: The maximum number of seconds to wait, or ``None`` to wait indefinitely.
+        :type timeout: float
+        :return: Whether all records were written, ``False`` if the queue was not empty in time or a batch failed to be
+            written since the last flush.
+        :rtype: bool
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return True
+
+        deadline = None if timeout is None else time.time() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+
+        with self._lock:
+            failed, self._failed = self._failed, False
+        return not failed
+
+    def stop(self, timeout=None):
+        """
+        Write the remaining records and stop the worker thread.
+
+        :param timeout: The maximum number of seconds to wait, defaults to the flush timeout of the pipeline.
+        :type timeout: float
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return
+
+        if timeout is None:
+            timeout = self.flush_timeout
+
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        """
+        Take records off the queue in batches and write them, until the pipeline is stopped.
+        """
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = _STOP in batch
+            records = [record for record in batch if record is not _STOP]
+
+            try:
+                self.write(records)
+            except Exception:
+                # The worker must keep running.
+                error_logger.exception("Failed to write a batch of %d audit log records", len(records))
+                with self._lock:
+                    self.dropped += len(records)
+                    self._failed = True
+            finally:
+                # The worker thread is not part of a request, so its connections are never closed otherwise.
+                close_old_connections()
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop:
+                return
+
+    def write(self, records):
+        """
+        Write a batch of change records to the handlers of the logger if it is enabled for ``INFO`` records, and store
+        them as log entries and in the file store when those are enabled.
+
+        :param records: The change records.
+        :type records: list
+        """
+        records = resolve_related(records)
+        log_records = []
+        if self.logger.isEnabledFor(logging.INFO):
+            log_records.extend(self.make_log_record(record) for record in records)
+
+        if self._unreported and self.overflow == COUNT and self.logger.isEnabledFor(logging.WARNING):
+            with self._lock:
+                dropped, self._unreported = self._unreported, 0
+            log_records.append(self.logger.makeRecord(
+                self.logger.name, logging.WARNING, __file__, 0,
+                "%d audit log records were dropped because the queue was full", (dropped,), None,
+            ))
+
+        for handler in get_handlers(self.logger) if log_records else []:
+            handler.acquire()
+            try:
+                for log_record in log_records:
+                    if log_record.levelno >= handler.level and handler.filter(log_record):
+                        handler.emit(log_record)
+            finally:
+                handler.release()
+            handler.flush()
+
+        writer = get_writer()
+        if writer is not None:
+            with defer_flush():
+                for record in records:
+                    writer.write(record)
+
+        store = get_file_store()
+        if store is not None:
+            store.write(records)
+
+    def make_log_record(self, record):
+        """
+        Create the log record for a change record, dated at the time of the change.
+
+        :param record: The change record.
+        :type record: auditlog.records.ChangeRecord
+        :return: The log record.
+        :rtype: logging.LogRecord
+        """
+        log_record = self.logger.makeRecord(
+            self.logger.name, logging.INFO, __file__, 0, record, None, None,
+            extra={'auditlog_record': record, 'auditlog_changes': record.changes},
+        )
+        log_record.created = record.timestamp
+        log_record.msecs = (record.timestamp - int(record.timestamp)) * 1000
+        return log_record
+
+
+def get_handlers(logger):
+    """
+    Get the handlers a record logged to the given logger is passed to, taking propagation into account.
+
+    :param logger: The logger.
+    :type logger: logging.Logger
+    :return: The handlers.
+    :rtype: list
+    """
+    handlers = []
+    while logger:
+        handlers.extend(logger.handlers)
+        if not logger.propagate:
+            break
+        logger = logger.parent
+    if not handlers and logging.lastResort is not None:
+        handlers.append(logging.lastResort)
+    return handlers
+
+
+_pipeline = None
+_configured = False
+
+
+def get_pipeline():
+    """
+    Get the pipeline configured with the ``AUDITLOG_PIPELINE`` setting, or ``None`` if records are written to the
+    audit logger directly.
+
+    :return: The pipeline.
+    :rtype: AuditlogPipeline
+    """
+    global _pipeline, _configured
+
+    if not _configured:
+        config = getattr(settings, 'AUDITLOG_PIPELINE', None)
+        if config:
+            from auditlog.receivers import logger
+
+            _pipeline = AuditlogPipeline(
+                logger=logging.getLogger(config.get('LOGGER', logger.name)),
+                max_size=config.get('MAX_SIZE', 10000),
+                batch_size=config.get('BATCH_SIZE', 100),
+                overflow=config.get('OVERFLOW', BLOCK),
+                flush_timeout=config.get('FLUSH_TIMEOUT', 5.0),
+            )
+        _configured = True
+
+    return _pipeline
+
+
+def reset_pipeline(**kwargs):
+    """
+    Stop the configured pipeline, the next call to :py:func:`get_pipeline` reads the settings again.
+    """
+    global _pipeline, _configured
+
+    if kwargs.get('setting') not in (None, 'AUDITLOG_PIPELINE'):
+        return
+
+    if _pipeline is not None:
+        _pipeline.stop()
+    _pipeline, _configured = None, False
+
+
+def _shutdown():
+    if _pipeline is not None:
+        _pipeline.stop()
+
+
+setting_changed.connect(reset_pipeline)
+atexit.register(_shutdown)
@@ -0,0 +1,183 @@
+from __future__ import unicode_literals
+
+from django.db import connections, models, transaction
+
+from auditlog.context import is_suspended
+from auditlog.diff import model_instance_diff
+from auditlog.records import ChangeRecord, CREATE, UPDATE, SUCCESS
+from auditlog.receivers import is_auditing, log_changes, logger
+
+
+def chunked(items, size):
+    """
+    Split a list into chunks of the given size.
+
+    :param items: The list to split.
+    :type items: list
+    :param size: The maximum size of a chunk.
+    :type size: int
+    :return: The chunks.
+    :rtype: generator
+    """
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+class AuditlogQuerySetMixin(object):
+    """
+    Mixin for querysets of registered models that logs the changes made by :py:meth:`update`,
+    :py:meth:`bulk_create` and :py:meth:`bulk_update`, which do not send the ``pre_save`` and ``post_save`` signals.
+
+    The affected rows are handled in chunks of at most :py:attr:`audit_chunk_size` rows, fewer if the database limits
+    the number of query parameters. The old values of a chunk are fetched with a single query, so the number of extra
+    queries only depends on the number of chunks.
+
+    Deleting through a queryset sends the ``pre_delete`` and ``post_delete`` signals for every object, so those changes
+    are logged by the signal receivers.
+    """
+    audit_chunk_size = 1000
+
+    def _is_audited(self, action=None, count=0):
+        """
+        Check whether the changes are audited. When auditing is suspended, the given number of changes is counted for
+        the summary of the suspension instead.
+        """
+        from auditlog.registry import auditlog
+
+        if not auditlog.contains(self.model) or is_suspended(self.model, action, count):
+            return False
+        return is_auditing()
+
+    def _get_chunk_size(self):
+        """
+        Get the number of rows in a chunk, so the primary keys of a chunk fit in the query parameters of the database.
+        """
+        max_query_params = connections[self.db].features.max_query_params
+        if max_query_params is None:
+            return self.audit_chunk_size
+        return min(self.audit_chunk_size, max_query_params)
+
+    def _iter_pk_chunks(self):
+        """
+        Iterate over the primary keys of the rows of the queryset in chunks, in the order of the primary keys. Every
+        chunk is read after the previous chunk is handled, starting after its last primary key. The rows are locked
+        where the database supports it, so they do not change before they are updated.
+        """
+        connection = connections[self.db]
+        queryset = self.order_by('pk')
+        if connection.features.has_select_for_update and not self.query.distinct:
+            if connection.features.has_select_for_update_of:
+                queryset = queryset.select_for_update(of=('self',))
+            else:
+                queryset = queryset.select_for_update()
+
+        chunk_size = self._get_chunk_size()
+        chunk = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        while chunk:
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            chunk = list(queryset.filter(pk__gt=chunk[-1]).values_list('pk', flat=True)[:chunk_size])
+
+    def _get_old_rows(self, pks):
+        """
+        Fetch the tracked fields of the rows with the given primary keys in a single query.
+        """
+        from auditlog.registry import auditlog
+
+        fields = [field.attname for field in auditlog.get_diff_plan(self.model).fields]
+        return self.model._base_manager.using(self.db).only(*fields).in_bulk(pks)
+
+    def update(self, **kwargs):
+        if not self.query.can_filter() or not self._is_audited():
+            rows = super(AuditlogQuerySetMixin, self).update(**kwargs)
+            is_suspended(self.model, UPDATE, rows)
+            return rows
+
+        rows = 0
+        last_pk = None
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            for chunk in self._iter_pk_chunks():
+                old_rows = self._get_old_rows(chunk)
+                # The rows of the queryset in the range of the chunk are exactly the rows of the chunk.
+                queryset = self.filter(pk__lte=chunk[-1])
+                if last_pk is not None:
+                    queryset = queryset.filter(pk__gt=last_pk)
+                rows += super(AuditlogQuerySetMixin, queryset).update(**kwargs)
+                last_pk = chunk[-1]
+                new_rows = self._get_old_rows(chunk)
+
+                records = []
+                for pk, new in new_rows.items():
+                    changes = model_instance_diff(old_rows.get(pk), new)
+                    if changes:
+                        records.append(ChangeRecord.for_instance(new, UPDATE, SUCCESS, changes))
+                log_changes(records, self.db)
+
+        return rows
+
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super(AuditlogQuerySetMixin, self).bulk_create(objs, *args, **kwargs)
+
+        if self._is_audited(CREATE, len(objs)):
+            # Databases that cannot return the rows of a bulk insert do not set the primary keys of the objects, so
+            # there is no object to log the changes of.
+            created = [obj for obj in objs if obj.pk is not None]
+            if len(created) < len(objs):
+                logger.warning(
+                    "The creation of %d %s objects by bulk_create() is not logged, the database did not return their "
+                    "primary keys", len(objs) - len(created), self.model._meta.label,
+                )
+
+            for chunk in chunked(created, self._get_chunk_size()):
+                records = [
+                    ChangeRecord.for_instance(obj, CREATE, SUCCESS, model_instance_diff(None, obj)) for obj in chunk
+                ]
+                log_changes(records, self.db)
+
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if not self._is_audited():
+            rows = super(AuditlogQuerySetMixin, self).bulk_update(objs, fields, *args, **kwargs)
+            is_suspended(self.model, UPDATE, rows or 0)
+            return rows
+
+        objs = list(objs)
+        fields = frozenset(fields)
+        rows = None
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            for chunk in chunked(objs, self._get_chunk_size()):
+                old_rows = self._get_old_rows([obj.pk for obj in chunk])
+                # Django implements bulk_update() with update(), which must not log the changes again.
+                chunk_rows = models.QuerySet(self.model, using=self.db).bulk_update(chunk, fields, *args, **kwargs)
+                if chunk_rows is not None:
+                    rows = (rows or 0) + chunk_rows
+
+                records = []
+                for obj in chunk:
+                    changes = model_instance_diff(old_rows.get(obj.pk), obj, fields=fields)
+                    if changes:
+                        records.append(ChangeRecord.for_instance(obj, UPDATE, SUCCESS, changes))
+                log_changes(records, self.db)
+
+        return rows
+
+
+class AuditlogQuerySet(AuditlogQuerySetMixin, models.QuerySet):
+    """
+    Queryset that logs the changes made by bulk operations, see :py:class:`AuditlogQuerySetMixin`.
+    """
+    pass
+
+
+class AuditlogManager(models.Manager.from_queryset(AuditlogQuerySet)):
+    """
+    Manager for registered models that logs the changes made by bulk operations, see
+    :py:class:`AuditlogQuerySetMixin`.
+    """
+    pass
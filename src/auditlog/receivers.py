@@ -1,75 +1,545 @@
-import json
+import functools
 import logging
 
-from auditlog.diff import model_instance_diff
-from auditlog.utils import get_default_log_message
+from django.conf import settings
+
+from auditlog.buffering import buffer_record, is_buffering, pop_old_row
+from auditlog.context import is_suspended
+from auditlog.deletion import BOTH, CASCADE_SUMMARY, SINGLE, announce_delete, get_delete_mode, report_delete
+from auditlog.diff import ModelSnapshot, model_instance_diff
+from auditlog.filestore import get_file_store
+from auditlog.m2m import PRE_ACTIONS, POST_ACTIONS, get_m2m_records, get_related_pks
+from auditlog.metrics import EMIT, FETCH, instrument, measure
+from auditlog.middleware import AuditlogMiddleware
+from auditlog.pipeline import get_pipeline
+from auditlog.records import (ChangeRecord, CREATE, UPDATE, DELETE, ATTEMPT, SUCCESS, measure_serialization,
+                              resolve_related)
+from auditlog.writer import get_writer, is_enabled as stores_log_entries
 
 logger = logging.getLogger("django.auditlogger")
 
+SAVE_MODES = (BOTH, SINGLE)
+
+
+def get_save_mode():
+    """
+    Get the way saves are logged, configured with the ``AUDITLOG_SAVE_MODE`` setting:
+
+    - ``both``: a record with the changes before the object is saved, and a record after (the default).
+    - ``single``: a single record with the changes after the object is saved. The changes of an update are calculated
+      before the object is saved.
+
+    :return: The save mode.
+    :rtype: str
+    """
+    mode = getattr(settings, 'AUDITLOG_SAVE_MODE', BOTH)
+    if mode not in SAVE_MODES:
+        raise ValueError("Unknown save mode '{}', use one of {}.".format(mode, ', '.join(SAVE_MODES)))
+    return mode
+
+
+def is_auditing():
+    """
+    Check whether changes are audited at all: the audit logger, or the logger of the background pipeline, is enabled
+    for ``INFO`` records, or records are stored as log entries or in the file store.
+
+    :rtype: bool
+    """
+    pipeline = get_pipeline()
+    return (
+        logger.isEnabledFor(logging.INFO) or (pipeline is not None and pipeline.logger.isEnabledFor(logging.INFO))
+        or stores_log_entries() or get_file_store() is not None
+    )
+
+
+def is_skipped(sender, action=None, **kwargs):
+    """
+    Check whether a signal should be ignored: auditing is suspended for the model (see
+    :py:class:`auditlog.context.suspend`), or the instance is saved as is (e.g., by ``loaddata``) and the
+    ``AUDITLOG_SKIP_RAW`` setting is enabled.
+
+    :param sender: The model.
+    :type sender: Model
+    :param action: The action to count in the summary of a suspension.
+    :type action: str
+    :return: Whether the signal should be ignored.
+    :rtype: bool
+    """
+    if is_suspended(sender, action):
+        return True
+    return kwargs.get('raw', False) and getattr(settings, 'AUDITLOG_SKIP_RAW', False)
+
 
+def get_save_action(sender, instance, created=None, **kwargs):
+    """
+    Get the model and action of a save, to measure the signal receivers by.
+    """
+    if created is None:
+        created = instance.pk is None
+    return sender, CREATE if created else UPDATE
+
+
+def get_delete_action(sender, **kwargs):
+    """
+    Get the model and action of a delete, to measure the signal receivers by.
+    """
+    return sender, DELETE
+
+
+def get_m2m_action(sender, **kwargs):
+    """
+    Get the registered model and action of a change to a many-to-many relation, to measure the signal receiver by.
+    """
+    from auditlog.registry import auditlog
+
+    tracked = auditlog.get_m2m_field(sender)
+    return (tracked[0], UPDATE) if tracked is not None else None
+
+
+@instrument(get_save_action)
 def log_post_save(sender, instance, created, **kwargs):
     """
     Signal receiver that creates a log entry when a model instance is first saved to the database.
 
     Direct use is discouraged, connect your model through :py:func:`auditlog.registry.register` instead.
     """
-    log_msg = get_default_log_message()
+    if is_skipped(sender, CREATE if created else UPDATE, **kwargs):
+        # The snapshot no longer holds the values in the database.
+        instance.__dict__.pop('_auditlog_snapshot', None)
+        instance.__dict__.pop('_auditlog_sampled', None)
+        return
 
-    if created:
-        changes = model_instance_diff(None, instance)
-        msg = f"{log_msg} successfully created new object"
-        logger.info(f"{msg} '{instance._meta.object_name}(id:{instance.pk})': '{json.dumps(changes)}'")
-    else:
-        msg = f"{log_msg} successfully updated object"
-        logger.info(f"{msg} '{instance._meta.object_name}(id:{instance.pk})'")
+    from auditlog.registry import auditlog
 
+    using = kwargs.get('using')
+    fields = get_saved_fields(sender, kwargs.get('update_fields'))
 
+    if fields is not None and not fields:
+        # None of the tracked fields were saved.
+        return
+
+    if is_auditing():
+        audited, sampled = sample_change(sender, instance, CREATE if created else UPDATE, fields, decide=False)
+        if created:
+            changes = model_instance_diff(None, instance, fields=sampled)
+            if audited or changes is not None:
+                log_change(ChangeRecord.for_instance(instance, CREATE, SUCCESS, changes, using=using), using)
+        else:
+            # Calculated before the object was saved.
+            changes = instance.__dict__.pop('_auditlog_changes', None)
+            if sampled is None or sampled:
+                attempted = changes is not None and get_save_mode() != SINGLE
+                log_change(ChangeRecord.for_instance(instance, UPDATE, SUCCESS, changes, attempted, using), using)
+
+    if auditlog.uses_snapshot(sender):
+        # The saved values are the old values of the next save.
+        if fields is None:
+            take_snapshot(sender, instance)
+        else:
+            snapshot = get_snapshot(instance)
+            if snapshot is not None:
+                snapshot.update(instance, [field for field in auditlog.get_snapshot_fields(sender)
+                                           if field.name in fields])
+            else:
+                # The values of the fields that were not saved are unknown.
+                instance.__dict__.pop('_auditlog_snapshot', None)
+
+
+@instrument(get_save_action)
 def log_pre_save(sender, instance, **kwargs):
     """
     Signal receiver that creates a log entry when a model instance is changed and saved to the database.
 
+    When only some fields are saved (``save(update_fields=...)``), only those fields are fetched and compared.
+
+    Depending on the ``AUDITLOG_SAVE_MODE`` setting, the changes are only calculated here and logged by
+    :py:func:`log_post_save`.
+
     Direct use is discouraged, connect your model through :py:func:`auditlog.registry.register` instead.
     """
+    if is_skipped(sender, **kwargs) or not is_auditing():
+        return
+
+    using = kwargs.get('using')
+    single = get_save_mode() == SINGLE
 
-    log_msg = get_default_log_message()
+    # Changes left behind by a save that failed.
+    instance.__dict__.pop('_auditlog_changes', None)
 
     if instance.pk is None:
-        changes = model_instance_diff(None, instance)
-        msg = f"{log_msg} attempting to create new object"
-        logger.info(f"{msg} '{instance._meta.object_name}': '{json.dumps(changes)}'")
+        if not single:
+            audited, fields = sample_change(sender, instance, CREATE)
+            changes = model_instance_diff(None, instance, fields=fields)
+            if audited or changes is not None:
+                log_change(ChangeRecord.for_instance(instance, CREATE, ATTEMPT, changes), using)
     else:
-        try:
-            old = sender.objects.get(pk=instance.pk)
-        except sender.DoesNotExist:
-            pass
-        else:
-            changes = model_instance_diff(old, instance)
+        fields = get_saved_fields(sender, kwargs.get('update_fields'))
+        if fields is not None and not fields:
+            # None of the tracked fields are saved.
+            return
 
-            msg = f"{log_msg} attempting to change fields of"
-            logger.info(f"{msg} '{instance._meta.object_name}(id:{instance.pk})': '{json.dumps(changes)}'")
+        audited, fields = sample_change(sender, instance, UPDATE, fields)
+        if fields is not None and not fields:
+            # The change is dropped by the sampling policy of the model.
+            return
 
+        old = get_old_instance(sender, instance, using, fields)
 
+        if old is not None:
+            changes = model_instance_diff(old, instance, fields=fields)
+            if not audited and changes is None:
+                # None of the fields that are always logged have changed.
+                instance._auditlog_sampled = (False, frozenset())
+                return
+            # The record after the save holds the changes as well, so only changes that are saved are stored.
+            instance._auditlog_changes = changes
+            if not single:
+                log_change(ChangeRecord.for_instance(instance, UPDATE, ATTEMPT, changes), using)
+
+
+@instrument(get_delete_action)
 def log_pre_delete(sender, instance, **kwargs):
     """
     Signal receiver that creates a log entry just before a model instance is about to get deleted.
+
+    Depending on the ``AUDITLOG_DELETE_MODE`` setting, the changes are only calculated here and logged by
+    :py:func:`log_post_delete`.
     """
+    if is_suspended(sender) or not is_auditing():
+        return
 
-    log_msg = get_default_log_message()
+    using = kwargs.get('using')
+    mode = get_delete_mode()
 
-    changes = model_instance_diff(instance, None)
-    msg = f"{log_msg} attempting to delete object"
-    logger.info(f"{msg} '{instance._meta.object_name}(id:{instance.pk})' with fields: '{json.dumps(changes)}'")
+    if mode == CASCADE_SUMMARY:
+        record = announce_delete(instance, using)
+        if record is not None:
+            log_change(record, using)
+        return
 
+    audited, fields = sample_change(sender, instance, DELETE)
+    if fields is not None and not fields:
+        return
 
+    changes = model_instance_diff(instance, None, fields=fields)
+    if not audited and changes is None:
+        instance._auditlog_sampled = (False, frozenset())
+        return
+
+    if mode == SINGLE:
+        instance._auditlog_changes = changes
+    else:
+        log_change(ChangeRecord.for_instance(instance, DELETE, ATTEMPT, changes), using)
+
+
+@instrument(get_delete_action)
 def log_post_delete(sender, instance, **kwargs):
     """
     Signal receiver that creates a log entry when a model instance is deleted from the database.
 
     Direct use is discouraged, connect your model through :py:func:`auditlog.registry.register` instead.
     """
-    if instance.pk is not None:
-        log_msg = get_default_log_message()
+    if instance.pk is None or is_suspended(sender, DELETE) or not is_auditing():
+        return
+
+    using = kwargs.get('using')
+
+    if get_delete_mode() == CASCADE_SUMMARY:
+        record = report_delete(instance, using)
+        if record is not None:
+            log_change(record, using)
+        return
+
+    audited, fields = sample_change(sender, instance, DELETE, decide=False)
+    if fields is not None and not fields:
+        return
+
+    try:
+        # Calculated before the object was deleted.
+        changes = instance.__dict__.pop('_auditlog_changes')
+    except KeyError:
+        changes = model_instance_diff(instance, None, fields=fields)
+    if not audited and changes is None:
+        return
+
+    log_change(ChangeRecord.for_instance(instance, DELETE, SUCCESS, changes, using=using), using)
+
+
+@instrument(get_m2m_action)
+def log_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Signal receiver that creates a log entry when a many-to-many relation of a model instance changes. The primary keys
+    of the added or removed objects are logged, the objects themselves are never loaded.
+
+    Before objects are removed or the relation is cleared, the primary keys of the objects that are actually related
+    are fetched with a single query, so removing objects that were not related is not logged.
+
+    Direct use is discouraged, register your model with ``m2m=True`` through :py:func:`auditlog.registry.register`
+    instead.
+    """
+    if action not in PRE_ACTIONS and action not in POST_ACTIONS:
+        return
+
+    from auditlog.registry import auditlog
+
+    tracked = auditlog.get_m2m_field(sender)
+    if tracked is None or is_suspended(tracked[0], UPDATE if action in POST_ACTIONS else None):
+        return
+    if not is_auditing():
+        return
+
+    registered, field = tracked
+    using = kwargs.get('using')
+    pending = instance.__dict__.setdefault('_auditlog_m2m', {})
+
+    if action in PRE_ACTIONS:
+        pending[sender] = get_related_pks(field, instance, reverse, pk_set if action == 'pre_remove' else None, using)
+        return
+
+    if action == 'post_add':
+        # Django only passes the objects that were not related yet.
+        pks = pk_set
+    else:
+        pks = pending.pop(sender, pk_set)
+
+    log_changes(get_m2m_records(registered, field, instance, action, reverse, pks, using), using)
+
 
-        changes = model_instance_diff(instance, None)
-        msg = f"{log_msg} successfully deleted"
-        logger.info(f"{msg} '{instance._meta.object_name}(id:{instance.pk})' with fields: '{json.dumps(changes)}'")
+def log_change(record, using=None):
+    """
+    Emit a change record, or buffer it until the current transaction on the given database is committed when the
+    ``AUDITLOG_TRANSACTION_BUFFERING`` setting is enabled.
+
+    :param record: The change record.
+    :type record: ChangeRecord
+    :param using: The database alias the change was made on.
+    :type using: str
+    """
+    with measure(EMIT, record.model, record.action):
+        if is_buffering(using):
+            buffer_record(record, using, emit_change)
+        else:
+            emit_change(record)
+
+
+def log_changes(records, using=None):
+    """
+    Emit a batch of change records, or buffer them until the current transaction on the given database is committed.
+
+    :param records: The change records.
+    :type records: list
+    :param using: The database alias the changes were made on.
+    :type using: str
+    """
+    if not records:
+        return
+
+    with measure(EMIT, records[0].model, records[0].action):
+        if is_buffering(using):
+            buffer_record(records, using, emit_changes)
+        else:
+            emit_changes(records)
+
+
+def emit_changes(records):
+    """
+    Pass a batch of change records to the audit logger. See :py:func:`emit_change`.
+
+    :param records: The change records, or batches of change records.
+    :type records: list
+    """
+    collected = AuditlogMiddleware.get_collected_records()
+    if collected is not None:
+        collected.extend(records)
+        return
+
+    measure_serialization(records)
+
+    pipeline = get_pipeline()
+    if pipeline is not None:
+        for record in records:
+            pipeline.put(record)
+        return
+
+    writer = get_writer()
+    records = resolve_related(records)
+    for record in records:
+        logger.info(record, extra={'auditlog_record': record, 'auditlog_changes': record.changes})
+        if writer is not None:
+            writer.write(record)
+
+    store = get_file_store()
+    if store is not None:
+        store.write(records)
+
+
+def emit_change(record):
+    """
+    Pass a change record to the audit logger. The record is rendered to a message only when a handler emits it. The
+    record itself and the changes are passed to the handlers as the ``auditlog_record`` and ``auditlog_changes``
+    attributes of the log record, for handlers that want structured data.
+
+    When the ``AUDITLOG_PIPELINE`` setting is configured, the record is put on the queue of the pipeline instead and
+    written by its background thread. When the ``AUDITLOG_AGGREGATE_REQUESTS`` setting is enabled, records of changes
+    made during a request are collected and emitted in batches by :py:class:`auditlog.middleware.AuditlogMiddleware`.
+    When the ``AUDITLOG_LOG_ENTRIES`` setting is enabled, the record is also stored as a
+    :py:class:`auditlog.models.LogEntry`, and when the ``AUDITLOG_FILE_STORE`` setting is configured, in the
+    :py:class:`auditlog.filestore.FileStore`. The related objects of changed foreign keys are resolved when the records
+    are written, see :py:func:`auditlog.records.resolve_related`.
+
+    :param record: The change record, or a batch of change records.
+    :type record: ChangeRecord or ChangeBatch
+    """
+    emit_changes([record])
+
+
+def take_snapshot(sender, instance, **kwargs):
+    """
+    Signal receiver that stores the tracked field values of a model instance, so :py:func:`log_pre_save` does not need
+    to fetch the old values from the database.
+
+    Direct use is discouraged, register your model with ``snapshot=True`` through
+    :py:func:`auditlog.registry.register` instead.
+    """
+    if is_suspended(sender):
+        return
+
+    from auditlog.registry import auditlog
+
+    instance._auditlog_snapshot = ModelSnapshot(instance, auditlog.get_snapshot_fields(sender))
+
+
+def refresh_snapshot(refresh_from_db):
+    """
+    Wrap the ``refresh_from_db`` method of a model that uses snapshots, so the snapshot holds the values that are
+    reloaded. Otherwise, changes made by others before the instance was reloaded would be logged as part of its next
+    save.
+
+    :param refresh_from_db: The method to wrap.
+    :type refresh_from_db: callable
+    :return: The wrapped method.
+    :rtype: callable
+    """
+    @functools.wraps(refresh_from_db)
+    def inner(instance, using=None, fields=None, **kwargs):
+        refresh_from_db(instance, using=using, fields=fields, **kwargs)
+
+        from auditlog.registry import auditlog
+
+        model = instance._meta.model
+        snapshot = get_snapshot(instance)
+        if fields is None or snapshot is None or is_suspended(model):
+            instance.__dict__.pop('_auditlog_snapshot', None)
+            if fields is None:
+                take_snapshot(model, instance)
+        else:
+            snapshot.update(instance, [field for field in auditlog.get_snapshot_fields(model)
+                                       if field.name in fields or field.attname in fields])
+
+    inner.refreshes_snapshot = True
+    return inner
+
+
+def get_saved_fields(sender, update_fields):
+    """
+    Get the names of the tracked fields that are saved when a model instance is saved with ``update_fields``.
+
+    :param sender: The model.
+    :type sender: Model
+    :param update_fields: The ``update_fields`` passed to the signal.
+    :type update_fields: frozenset
+    :return: The names of the tracked fields that are saved, or ``None`` if all fields are saved.
+    :rtype: frozenset
+    """
+    if update_fields is None:
+        return None
+
+    from auditlog.registry import auditlog
+
+    return frozenset(
+        field.name for field in auditlog.get_diff_plan(sender).fields
+        if field.name in update_fields or field.attname in update_fields
+    )
+
+
+def sample_change(sender, instance, action, fields=None, decide=True):
+    """
+    Apply the sampling policy of a model (see :py:meth:`auditlog.registry.AuditlogModelRegistry.register`) to a save or
+    delete, before the old values are fetched or compared. The decision made before the change is stored on the
+    instance, so the records before and after the change are both kept or both dropped.
+
+    :param sender: The model.
+    :type sender: Model
+    :param instance: The model instance.
+    :type instance: Model
+    :param action: The action.
+    :type action: str
+    :param fields: The names of the tracked fields that are saved, or ``None`` if all fields are saved.
+    :type fields: frozenset
+    :param decide: Whether to decide again, rather than use the decision made before the change.
+    :type decide: bool
+    :return: Whether the change is audited, and the names of the fields to compare: ``fields`` if the change is
+        audited, otherwise the fields that are always logged. If the latter is empty, nothing is logged.
+    :rtype: tuple
+    """
+    from auditlog.registry import auditlog
+
+    policy = auditlog.get_sampling_policy(sender)
+    if policy is None:
+        return True, fields
+
+    sampled = instance.__dict__.pop('_auditlog_sampled', None)
+    if decide or sampled is None:
+        sampled = policy.sample(sender, action, instance.pk, fields)
+        if decide:
+            instance._auditlog_sampled = sampled
+    return sampled
+
+
+def get_old_instance(sender, instance, using=None, fields=None):
+    """
+    Get the state of a model instance as stored in the database: its snapshot, the row prefetched with
+    :py:func:`auditlog.buffering.prefetch`, or otherwise the row fetched from the database.
+
+    :param sender: The model.
+    :type sender: Model
+    :param instance: The model instance.
+    :type instance: Model
+    :param using: The database alias.
+    :type using: str
+    :param fields: The names of the fields to fetch, defaults to all fields.
+    :type fields: frozenset
+    :return: The old state, or ``None`` if the instance does not exist in the database.
+    :rtype: Model or ModelSnapshot
+    """
+    old = get_snapshot(instance)
+    if old is None:
+        old = pop_old_row(sender, instance.pk, using)
+    if old is None:
+        queryset = sender.objects.using(using)
+        if fields is not None:
+            queryset = queryset.only(*fields)
+        try:
+            with measure(FETCH, sender, UPDATE):
+                old = queryset.get(pk=instance.pk)
+        except sender.DoesNotExist:
+            pass
+    return old
+
+
+def get_snapshot(instance):
+    """
+    Get the snapshot of the values the model instance had in the database, if one is available.
+
+    Instances that were not loaded from the database (e.g., constructed with a primary key) have no usable snapshot,
+    and neither have instances of which the primary key has changed.
+
+    :param instance: The model instance.
+    :type instance: Model
+    :return: The snapshot or ``None``.
+    :rtype: ModelSnapshot
+    """
+    snapshot = instance.__dict__.get('_auditlog_snapshot')
+    if snapshot is None or instance._state.adding or snapshot.pk != instance.pk:
+        return None
+    return snapshot
@@ -0,0 +1,284 @@
+from __future__ import unicode_literals
+
+import time
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+
+from auditlog.metrics import BYTES, SERIALIZE, get_metrics
+from auditlog.serializers import get_serializer
+
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+
+ATTEMPT = 'attempt'
+SUCCESS = 'success'
+SUMMARY = 'summary'
+
+MESSAGES = {
+    (CREATE, ATTEMPT): "{prefix} attempting to create new object '{name}': '{changes}'",
+    (CREATE, SUCCESS): "{prefix} successfully created new object '{name}(id:{pk})': '{changes}'",
+    (UPDATE, ATTEMPT): "{prefix} attempting to change fields of '{name}(id:{pk})': '{changes}'",
+    (UPDATE, SUCCESS): "{prefix} successfully updated object '{name}(id:{pk})'",
+    (DELETE, ATTEMPT): "{prefix} attempting to delete object '{name}(id:{pk})' with fields: '{changes}'",
+    (DELETE, SUCCESS): "{prefix} successfully deleted '{name}(id:{pk})' with fields: '{changes}'",
+    (DELETE, SUMMARY): "{prefix} successfully deleted {count} objects: '{changes}'",
+}
+
+
+class ChangeRecord(namedtuple('ChangeRecord', ['action', 'phase', 'model', 'pk', 'changes', 'actor', 'timestamp',
+                                               'attempted', 'using'], defaults=(False, None))):
+    """
+    An immutable record of a change to a model instance. The record only holds references to the data it was created
+    with, the log message (including the changes, encoded by the serializer configured with the ``AUDITLOG_SERIALIZER``
+    setting) is rendered when the record is converted to a string. This makes it cheap to pass a record to a logger
+    that may not emit it.
+
+    The ``attempted`` flag marks a record after a change of which the changes were already logged by the record before
+    the change, its message leaves the changes out. ``using`` is the alias of the database the change was made on.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def for_instance(cls, instance, action, phase, changes=None, attempted=False, using=None):
+        """
+        Create a change record for a model instance, with the actor of the current request.
+
+        :param instance: The model instance that changed.
+        :type instance: Model
+        :param action: The action, one of ``CREATE``, ``UPDATE`` or ``DELETE``.
+        :type action: str
+        :param phase: The phase of the action, ``ATTEMPT``, ``SUCCESS`` or ``SUMMARY``.
+        :type phase: str
+        :param changes: The changes as returned by :py:func:`auditlog.diff.model_instance_diff`. For a ``SUMMARY``
+            the primary keys of the objects involved by model label.
+        :type changes: dict
+        :param attempted: Whether the changes were logged by the record before the change.
+        :type attempted: bool
+        :param using: The database alias the change was made on, defaults to the database of the instance.
+        :type using: str
+        :return: The change record.
+        :rtype: ChangeRecord
+        """
+        return cls.for_object(
+            instance._meta.model, instance.pk, action, phase, changes, attempted, using or instance._state.db,
+        )
+
+    @classmethod
+    def for_object(cls, model, pk, action, phase, changes=None, attempted=False, using=None):
+        """
+        Create a change record for an object of which only the primary key is known, with the actor of the current
+        request.
+
+        :param model: The model of the object.
+        :type model: Model
+        :param pk: The primary key of the object.
+        :param action: The action, one of ``CREATE``, ``UPDATE`` or ``DELETE``.
+        :type action: str
+        :param phase: The phase of the action, ``ATTEMPT``, ``SUCCESS`` or ``SUMMARY``.
+        :type phase: str
+        :param changes: The changes.
+        :type changes: dict
+        :param attempted: Whether the changes were logged by the record before the change.
+        :type attempted: bool
+        :param using: The database alias the change was made on.
+        :type using: str
+        :return: The change record.
+        :rtype: ChangeRecord
+        """
+        from auditlog.middleware import AuditlogMiddleware
+
+        return cls(
+            action=action,
+            phase=phase,
+            model=model,
+            pk=pk,
+            changes=changes,
+            actor=AuditlogMiddleware.get_actor(),
+            timestamp=time.time(),
+            attempted=attempted,
+            using=using,
+        )
+
+    @property
+    def user(self):
+        return self.actor.user
+
+    @property
+    def remote_addr(self):
+        return self.actor.remote_addr
+
+    @property
+    def object_name(self):
+        return self.model._meta.object_name
+
+    @property
+    def message(self):
+        """
+        The rendered log message.
+
+        :rtype: str
+        """
+        template = MESSAGES[self.action, self.phase]
+        if self.changes is not None and not self.attempted and '{changes}' not in template:
+            template += ": '{changes}'"
+
+        return template.format(
+            prefix=self.actor.log_message,
+            name=self.object_name,
+            pk=self.pk,
+            changes=get_serializer().dumps(self.changes),
+            count=sum(len(pks) for pks in self.changes.values()) if self.phase == SUMMARY else None,
+        )
+
+    def as_dict(self):
+        """
+        The record as a dictionary that can be encoded by a serializer, without the actor.
+
+        :rtype: dict
+        """
+        return {
+            'action': self.action,
+            'phase': self.phase,
+            'model': self.model._meta.label,
+            'pk': self.pk if isinstance(self.pk, (int, str)) or self.pk is None else str(self.pk),
+            'changes': self.changes,
+        }
+
+    def __str__(self):
+        return self.message
+
+
+class ChangeBatch(namedtuple('ChangeBatch', ['correlation_id', 'actor', 'records', 'timestamp'])):
+    """
+    An immutable batch of the change records of a single request. The actor is only included once, and every batch of
+    a request carries the same correlation id. Like a :py:class:`ChangeRecord`, the message is only rendered when the
+    batch is converted to a string.
+    """
+    __slots__ = ()
+
+    @property
+    def changes(self):
+        """
+        The change records as dictionaries.
+
+        :rtype: list
+        """
+        return [record.as_dict() for record in self.records]
+
+    @property
+    def message(self):
+        """
+        The rendered log message.
+
+        :rtype: str
+        """
+        return "{prefix} request {correlation_id} logged {count} changes: '{changes}'".format(
+            prefix=self.actor.log_message,
+            correlation_id=self.correlation_id,
+            count=len(self.records),
+            changes=get_serializer().dumps(self.changes),
+        )
+
+    def __str__(self):
+        return self.message
+
+
+def iter_records(records):
+    """
+    Iterate over change records, including the records in batches.
+
+    :param records: The change records and batches.
+    :type records: list
+    """
+    for record in records:
+        if isinstance(record, ChangeBatch):
+            yield from record.records
+        else:
+            yield record
+
+
+def measure_serialization(records):
+    """
+    Measure the time it takes to serialize the changes of change records, and their size, when the overhead of
+    auditing is measured (see :py:func:`auditlog.metrics.get_metrics`). The records in a batch are measured as they are
+    serialized in the message of the batch. Every record is measured once, however often its message is rendered.
+
+    :param records: The change records and batches.
+    :type records: list
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        return
+
+    serializer = get_serializer()
+    for record in records:
+        batched = isinstance(record, ChangeBatch)
+        for item in record.records if batched else [record]:
+            started = time.perf_counter()
+            changes = serializer.dumps(item.as_dict() if batched else item.changes)
+            label = item.model._meta.label
+            metrics.observe(SERIALIZE, label, item.action, time.perf_counter() - started)
+            metrics.observe(BYTES, label, item.action, len(changes.encode('utf-8')))
+
+
+def resolve_related(records):
+    """
+    Replace the primary keys of related objects in the changes of foreign keys by the display string of the object,
+    when the ``AUDITLOG_RESOLVE_RELATED`` setting is enabled. The related objects of all given records are fetched with
+    a single :py:meth:`~django.db.models.query.QuerySet.in_bulk` query per related model.
+
+    :param records: The change records and batches.
+    :type records: list
+    :return: The change records and batches with the resolved changes.
+    :rtype: list
+    """
+    if not getattr(settings, 'AUDITLOG_RESOLVE_RELATED', False):
+        return records
+
+    from auditlog.registry import auditlog
+
+    relations = {}
+    wanted = defaultdict(set)
+    for record in iter_records(records):
+        if record.phase == SUMMARY or not record.changes:
+            continue
+        if record.model not in relations:
+            plan = auditlog.get_diff_plan(record.model)
+            relations[record.model] = {
+                field.name: field for field in plan.fields
+                if field.is_relation and field.name not in plan.mask_value_fields
+            }
+        for name, values in record.changes.items():
+            field = relations[record.model].get(name)
+            if field is not None:
+                wanted[field.target_field].update(value for value in values if value is not None)
+
+    if not wanted:
+        return records
+
+    displays = {}
+    for target, values in wanted.items():
+        # Foreign keys may refer to a unique field other than the primary key (``to_field``).
+        objects = target.model._default_manager.in_bulk(
+            list(values), field_name=target.attname,
+        )
+        displays[target] = {value: "{}(id:{})".format(obj, value) for value, obj in objects.items()}
+
+    def resolve(record):
+        fields = relations.get(record.model)
+        if record.phase == SUMMARY or not record.changes or not fields:
+            return record
+        changes = dict(record.changes)
+        for name, values in record.changes.items():
+            if name in fields:
+                lookup = displays.get(fields[name].target_field, {})
+                changes[name] = tuple(lookup.get(value, value) for value in values)
+        return record._replace(changes=changes)
+
+    return [
+        record._replace(records=[resolve(item) for item in record.records]) if isinstance(record, ChangeBatch)
+        else resolve(record)
+        for record in records
+    ]
@@ -1,34 +1,55 @@
 from __future__ import unicode_literals
 
-from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.core.signals import setting_changed
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, post_init, m2m_changed
 from django.db.models import Model
 
+from auditlog.context import suspend
+from auditlog.diff import compile_diff_plan
+from auditlog.m2m import get_m2m_fields
+from auditlog.sampling import SamplingPolicy
+
 
 class AuditlogModelRegistry(object):
     """
     A registry that keeps track of the models that use Auditlog to track changes.
     """
     def __init__(self, custom=None):
-        from auditlog.receivers import log_pre_save, log_post_save, log_pre_delete, log_post_delete
+        from auditlog.receivers import (log_pre_save, log_post_save, log_pre_delete, log_post_delete, log_m2m_changed,
+                                        take_snapshot)
 
         self._registry = {}
+        self._plans = {}
+        self._m2m_fields = None
         self._signals = {
             pre_save: log_pre_save,
             post_save: log_post_save,
             pre_delete: log_pre_delete,
             post_delete: log_post_delete
         }
+        self._snapshot_signals = {
+            post_init: take_snapshot,
+        }
+        self._refresh_methods = {}
+        self._m2m_signals = {
+            m2m_changed: log_m2m_changed,
+        }
 
         if custom:
             self._signals.update(custom)
 
-    def register(self, model=None, m2m=False, include_fields=[], exclude_fields=[], mask_value_fields=[]):
+        # Overriding settings in tests may swap models or change how fields are compared.
+        setting_changed.connect(self._clear_plans, dispatch_uid=(self.__class__, id(self), setting_changed))
+
+    def register(self, model=None, m2m=False, include_fields=[], exclude_fields=[], mask_value_fields=[],
+                 snapshot=False, diff_strategies={}, sample_rate=1.0, rate_limit=None, always_log_fields=[]):
         """
         Register a model with auditlog. Auditlog will then track mutations on this model's instances.
 
         :param model: The model to register.
         :type model: Model
-        :param m2m: If many to many models should be checked as well.
+        :param m2m: If many to many relations should be tracked as well. The fields to include and exclude apply to the
+            many to many fields too.
         :type m2m: bool
         :param include_fields: The fields to include. Implicitly excludes all other fields.
         :type include_fields: list
@@ -36,11 +57,29 @@ class AuditlogModelRegistry(object):
         :type exclude_fields: list
         :param mask_value_fields: The fields to mask the values of.
         :type mask_value_fields: list
+        :param snapshot: Keep a snapshot of the tracked field values of every instance loaded from the database, so the
+            old values do not need to be fetched again when the instance is saved.
+        :type snapshot: bool
+        :param diff_strategies: How the changes of fields are recorded, by field name: ``'full'`` (the old and new
+            value, the default), ``'json'`` (the changed nested values), ``'text'`` (the changed lines) or ``'digest'``
+            (the size and digest of large values, the default for binary fields).
+        :type diff_strategies: dict
+        :param sample_rate: The fraction of the saves and deletes to audit, between 0 and 1. Whether a change is audited
+            is decided before the old values are fetched or compared.
+        :type sample_rate: float
+        :param rate_limit: The maximum number of saves and deletes to audit per object and action, and the period in
+            seconds in which they are allowed, e.g. ``(10, 60)``.
+        :type rate_limit: tuple
+        :param always_log_fields: The fields of which changes are audited even if the change is dropped by sampling or
+            the rate limit.
+        :type always_log_fields: list
         """
-        def registrar(cls):
-            if m2m:
-                raise NotImplementedError("We do not have support for m2m fields yet. Set m2m param to false.")
+        if sample_rate < 1 or rate_limit is not None:
+            sampling = SamplingPolicy(sample_rate, rate_limit, always_log_fields)
+        else:
+            sampling = None
 
+        def registrar(cls):
             """Register models for a given class."""
             if not issubclass(cls, Model):
                 raise TypeError("Supplied model is not a valid model.")
@@ -50,7 +89,17 @@ class AuditlogModelRegistry(object):
                 'exclude_fields': exclude_fields,
                 'mask_value_fields': mask_value_fields,
                 'm2m': m2m,
+                'snapshot': snapshot,
+                'diff_strategies': diff_strategies,
+                'sampling': sampling,
+                'model_fields': {
+                    'include_fields': include_fields,
+                    'exclude_fields': exclude_fields,
+                    'mask_value_fields': mask_value_fields,
+                },
             }
+            self._plans[cls] = self._compile_plan(cls)
+            self._m2m_fields = None
             self._connect_signals(cls)
 
             # We need to return the class, as the decorator is basically
@@ -89,8 +138,36 @@ class AuditlogModelRegistry(object):
         except KeyError:
             pass
         else:
+            self._plans.pop(model, None)
+            self._m2m_fields = None
             self._disconnect_signals(model)
 
+    def suspend(self, models=None, summary=False):
+        """
+        Suspend auditing in the current thread or task, as a context manager or decorator::
+
+            with auditlog.suspend(models=[MyModel], summary=True):
+                import_rows()
+
+        Inside the block, changes to the given models (by default all models) are not calculated, fetched or logged.
+
+        :param models: The models to suspend auditing for, defaults to all models.
+        :type models: list
+        :param summary: Whether to log the number of changes that were not audited when the block is left.
+        :type summary: bool
+        :rtype: auditlog.context.suspend
+        """
+        return suspend(models, summary)
+
+    def disable(self):
+        """
+        Suspend auditing of all models in the current thread or task, as a context manager or decorator. See
+        :py:meth:`suspend`.
+
+        :rtype: auditlog.context.suspend
+        """
+        return suspend()
+
     def _connect_signals(self, model):
         """
         Connect signals for the model.
@@ -99,6 +176,22 @@ class AuditlogModelRegistry(object):
             receiver = self._signals[signal]
             signal.connect(receiver, sender=model, dispatch_uid=self._dispatch_uid(signal, model))
 
+        if self._registry[model]['snapshot']:
+            for signal, receiver in self._snapshot_signals.items():
+                signal.connect(receiver, sender=model, dispatch_uid=self._dispatch_uid(signal, model))
+
+            # Reloading the values from the database must reload the snapshot as well.
+            from auditlog.receivers import refresh_snapshot
+
+            if not getattr(model.refresh_from_db, 'refreshes_snapshot', False):
+                self._refresh_methods[model] = model.__dict__.get('refresh_from_db')
+                model.refresh_from_db = refresh_snapshot(model.refresh_from_db)
+
+        if self._registry[model]['m2m']:
+            # The 'through' models may not be resolved yet, so the receiver looks up the relation when it is changed.
+            for signal, receiver in self._m2m_signals.items():
+                signal.connect(receiver, dispatch_uid=self._dispatch_uid(signal, None))
+
     def _disconnect_signals(self, model):
         """
         Disconnect signals for the model.
@@ -106,6 +199,16 @@ class AuditlogModelRegistry(object):
         for signal, receiver in self._signals.items():
             signal.disconnect(sender=model, dispatch_uid=self._dispatch_uid(signal, model))
 
+        for signal, receiver in self._snapshot_signals.items():
+            signal.disconnect(sender=model, dispatch_uid=self._dispatch_uid(signal, model))
+
+        if model in self._refresh_methods:
+            refresh_from_db = self._refresh_methods.pop(model)
+            if refresh_from_db is None:
+                del model.refresh_from_db
+            else:
+                model.refresh_from_db = refresh_from_db
+
     def _dispatch_uid(self, signal, model):
         """
         Generate a dispatch_uid.
@@ -113,11 +216,98 @@ class AuditlogModelRegistry(object):
         return self.__class__, model, signal
 
     def get_model_fields(self, model):
-        return {
-            'include_fields': self._registry[model]['include_fields'],
-            'exclude_fields': self._registry[model]['exclude_fields'],
-            'mask_value_fields': self._registry[model]['mask_value_fields'],
-        }
+        return self._registry[model]['model_fields']
+
+    def get_diff_plan(self, model):
+        """
+        Get the compiled diff plan for a model. Models that are not registered get a plan without any filtering, which
+        is not cached.
+
+        :param model: The model to get the plan for.
+        :type model: Model
+        :return: The diff plan.
+        :rtype: auditlog.diff.DiffPlan
+        """
+        try:
+            return self._plans[model]
+        except KeyError:
+            plan = self._compile_plan(model)
+            if model in self._registry:
+                self._plans[model] = plan
+            return plan
+
+    def _compile_plan(self, model):
+        """
+        Compile the diff plan for a model from its registration options.
+        """
+        options = self._registry.get(model)
+        if options is None:
+            return compile_diff_plan(model)
+        return compile_diff_plan(
+            model,
+            include_fields=options['include_fields'],
+            exclude_fields=options['exclude_fields'],
+            mask_value_fields=options['mask_value_fields'],
+            diff_strategies=options['diff_strategies'],
+        )
+
+    def _clear_plans(self, **kwargs):
+        """
+        Drop all compiled diff plans, they will be compiled again when needed.
+        """
+        self._plans.clear()
+        self._m2m_fields = None
+
+    def get_m2m_field(self, through):
+        """
+        Get the registered model and the tracked many-to-many field that use a 'through' model.
+
+        :param through: The 'through' model of the relation.
+        :type through: Model
+        :return: The registered model and the field, or ``None`` if the relation is not tracked.
+        :rtype: tuple
+        """
+        if self._m2m_fields is None:
+            self._m2m_fields = {
+                field.remote_field.through: (model, field)
+                for model, options in self._registry.items() if options['m2m']
+                for field in get_m2m_fields(model, options['include_fields'], options['exclude_fields'])
+            }
+        return self._m2m_fields.get(through)
+
+    def uses_snapshot(self, model):
+        """
+        Check if the old field values of a model are taken from a snapshot instead of the database.
+
+        :param model: The model to check.
+        :type model: Model
+        :return: Whether snapshots are enabled for the model.
+        :rtype: bool
+        """
+        return model in self._registry and self._registry[model]['snapshot']
+
+    def get_sampling_policy(self, model):
+        """
+        Get the policy that decides which changes to a model are audited.
+
+        :param model: The model.
+        :type model: Model
+        :return: The policy, or ``None`` if all changes are audited.
+        :rtype: auditlog.sampling.SamplingPolicy
+        """
+        options = self._registry.get(model)
+        return options['sampling'] if options is not None else None
+
+    def get_snapshot_fields(self, model):
+        """
+        Get the fields of a model of which the values are stored in a snapshot.
+
+        :param model: The model to get the fields for.
+        :type model: Model
+        :return: The tracked fields of the model.
+        :rtype: tuple
+        """
+        return self.get_diff_plan(model).fields
 
 
 auditlog = AuditlogModelRegistry()
@@ -0,0 +1,155 @@
+from __future__ import unicode_literals
+
+import atexit
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+#: The maximum number of token buckets a policy keeps, the least recently used buckets are dropped first.
+MAX_BUCKETS = 10000
+
+
+class SamplingPolicy(object):
+    """
+    Decides which changes to a model are audited: a random sample of the changes, limited to a number of changes per
+    object and action in a period (a token bucket). Changes to the fields that are always logged are audited even if
+    the change is dropped, but only the changes of those fields.
+
+    The token buckets are kept in memory, so every process limits the changes on its own. At most
+    :py:data:`MAX_BUCKETS` buckets are kept, the least recently used buckets are dropped first.
+    """
+
+    def __init__(self, rate=1.0, limit=None, always_log_fields=()):
+        """
+        :param rate: The fraction of the changes to audit, between 0 and 1.
+        :type rate: float
+        :param limit: The maximum number of changes per object and action, and the period in seconds in which they are
+            allowed, e.g. ``(10, 60)``. Changes are allowed in bursts of at most that number.
+        :type limit: tuple
+        :param always_log_fields: The names of the fields of which changes are never dropped.
+        :type always_log_fields: list
+        """
+        if not 0 <= rate <= 1:
+            raise ValueError("The sample rate must be between 0 and 1.")
+        if limit is not None and (len(limit) != 2 or limit[0] < 1 or limit[1] <= 0):
+            raise ValueError("The rate limit must be a positive number of changes and a period in seconds.")
+
+        self.rate = rate
+        self.limit = limit
+        self.always_log_fields = frozenset(always_log_fields)
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def allow(self, action, pk):
+        """
+        Check whether a change is audited. This does not query the database.
+
+        :param action: The action, one of the actions of :py:mod:`auditlog.records`.
+        :type action: str
+        :param pk: The primary key of the object, ``None`` for objects that are created.
+        :return: Whether the change is audited.
+        :rtype: bool
+        """
+        if self.rate < 1 and random.random() >= self.rate:
+            return False
+        return self.limit is None or self.take_token((action, pk))
+
+    def take_token(self, key):
+        """
+        Take a token from the bucket of an object and action, if there is one left.
+
+        :param key: The action and primary key.
+        :type key: tuple
+        :return: Whether a token was taken.
+        :rtype: bool
+        """
+        capacity, period = self.limit
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * capacity / period)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+            # The least recently used buckets come first.
+            self.buckets.move_to_end(key)
+
+            while len(self.buckets) > MAX_BUCKETS:
+                # Dropping a bucket that is not full yet allows its object a new burst.
+                self.buckets.popitem(last=False)
+        return allowed
+
+    def sample(self, model, action, pk, fields=None):
+        """
+        Decide whether a change is audited, and count it if it is dropped.
+
+        :param model: The model.
+        :type model: Model
+        :param action: The action, one of the actions of :py:mod:`auditlog.records`.
+        :type action: str
+        :param pk: The primary key of the object.
+        :param fields: The names of the fields that are changed, defaults to all fields.
+        :type fields: frozenset
+        :return: Whether the change is audited, and the names of the fields to compare: ``fields`` if the change is
+            audited, otherwise the fields that are always logged (which may be none).
+        :rtype: tuple
+        """
+        if self.allow(action, pk):
+            return True, fields
+
+        count_dropped(model, action)
+        return False, self.always_log_fields if fields is None else self.always_log_fields & fields
+
+
+_dropped = OrderedDict()
+_dropped_lock = threading.Lock()
+_reported = time.monotonic()
+
+
+def count_dropped(model, action):
+    """
+    Count a change that was dropped by a sampling policy, and report the dropped changes if the last report is older
+    than the ``AUDITLOG_SAMPLING_REPORT_INTERVAL`` setting (60 seconds by default).
+
+    :param model: The model.
+    :type model: Model
+    :param action: The action.
+    :type action: str
+    """
+    label = model._meta.label
+    with _dropped_lock:
+        if label not in _dropped:
+            _dropped[label] = Counter()
+        _dropped[label][action] += 1
+        due = time.monotonic() - _reported >= getattr(settings, 'AUDITLOG_SAMPLING_REPORT_INTERVAL', 60)
+    if due:
+        report_dropped()
+
+
+def report_dropped():
+    """
+    Log the number of changes that were dropped by sampling policies since the last report, by model label and action.
+    """
+    global _reported
+
+    with _dropped_lock:
+        counts = {label: dict(actions) for label, actions in _dropped.items()}
+        _dropped.clear()
+        _reported = time.monotonic()
+    if not counts:
+        return
+
+    from auditlog.receivers import logger
+    from auditlog.serializers import get_serializer
+
+    logger.info(
+        "Sampling dropped %d changes: '%s'",
+        sum(sum(actions.values()) for actions in counts.values()),
+        get_serializer().dumps(counts),
+        extra={'auditlog_changes': counts},
+    )
+
+
+atexit.register(report_dropped)
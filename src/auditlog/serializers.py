@@ -0,0 +1,198 @@
+from __future__ import unicode_literals
+
+import datetime
+import decimal
+import json
+import uuid
+
+from django.conf import settings
+from django.utils.duration import duration_iso_string
+from django.utils.encoding import smart_text
+from django.utils.module_loading import import_string
+
+
+def encode_value(value):
+    """
+    Encode a value that is not natively supported by a serializer. Decimals are encoded as text so no precision is
+    lost, dates and times in ISO 8601 format, and anything else as its text.
+
+    :param value: The value.
+    :return: The encoded value.
+    :rtype: str
+    """
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return duration_iso_string(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return smart_text(value)
+
+
+class Serializer(object):
+    """
+    Encodes the changes of change records (and the records themselves) for the log messages and the sinks that store
+    them. The changes hold native values (e.g., integers, decimals and datetimes), which each serializer encodes in its
+    own way.
+    """
+    #: Whether the serializer produces bytes that are not text.
+    binary = False
+
+    def dumps(self, obj):
+        """
+        Encode an object.
+
+        :param obj: The object to encode.
+        :return: The encoded object, as text unless the serializer is binary.
+        :rtype: str or bytes
+        """
+        raise NotImplementedError
+
+    def dumpb(self, obj):
+        """
+        Encode an object as bytes.
+
+        :param obj: The object to encode.
+        :rtype: bytes
+        """
+        data = self.dumps(obj)
+        return data if self.binary else data.encode('utf-8')
+
+    def loads(self, data):
+        """
+        Decode an object.
+
+        :param data: The encoded object.
+        :type data: str or bytes
+        :return: The decoded object.
+        """
+        raise NotImplementedError
+
+    def dump_many(self, objs, buffer):
+        """
+        Encode objects one after the other into a buffer, so a batch can be written at once. The buffer is not cleared
+        first, so it can be reused for every batch by clearing it after it has been written.
+
+        Text serializers end every object with a newline.
+
+        :param objs: The objects to encode.
+        :type objs: list
+        :param buffer: The buffer to append to.
+        :type buffer: bytearray
+        :return: The buffer.
+        :rtype: bytearray
+        """
+        for obj in objs:
+            buffer += self.dumpb(obj)
+            if not self.binary:
+                buffer += b'\n'
+        return buffer
+
+
+class JSONSerializer(Serializer):
+    """
+    Compact JSON using the standard library. This is the default serializer.
+    """
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators=(',', ':'), default=encode_value)
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonSerializer(Serializer):
+    """
+    Compact JSON using `orjson <https://github.com/ijl/orjson>`_, which is considerably faster than the standard library
+    and encodes datetimes and UUIDs natively.
+    """
+
+    def __init__(self):
+        import orjson
+
+        self.orjson = orjson
+        self.option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj):
+        return self.dumpb(obj).decode('utf-8')
+
+    def dumpb(self, obj):
+        return self.orjson.dumps(obj, default=encode_value, option=self.option)
+
+    def loads(self, data):
+        return self.orjson.loads(data)
+
+
+class MsgpackSerializer(Serializer):
+    """
+    Compact binary encoding using `msgpack <https://msgpack.org/>`_, for sinks that store records as bytes (e.g.,
+    files). It cannot be used for log messages.
+    """
+    binary = True
+
+    def __init__(self):
+        import msgpack
+
+        self.msgpack = msgpack
+
+    def dumps(self, obj):
+        return self.msgpack.packb(obj, default=encode_value, use_bin_type=True)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+SERIALIZERS = {
+    'json': 'auditlog.serializers.JSONSerializer',
+    'orjson': 'auditlog.serializers.OrjsonSerializer',
+    'msgpack': 'auditlog.serializers.MsgpackSerializer',
+}
+
+_serializers = {}
+
+
+def load_serializer(name):
+    """
+    Get the serializer with the given name: a key of :py:data:`SERIALIZERS`, ``'auto'`` for the fastest installed JSON
+    serializer, or the dotted path to a :py:class:`Serializer` class. Serializers are only created once.
+
+    :param name: The name of the serializer.
+    :type name: str
+    :return: The serializer.
+    :rtype: Serializer
+    """
+    try:
+        return _serializers[name]
+    except KeyError:
+        pass
+
+    if name == 'auto':
+        try:
+            serializer = load_serializer('orjson')
+        except ImportError:
+            serializer = load_serializer('json')
+    else:
+        path = SERIALIZERS.get(name, name)
+        if '.' not in path:
+            raise ValueError("Unknown serializer '{}', use one of {}, 'auto' or the path to a serializer class.".format(
+                name, ', '.join(SERIALIZERS)))
+        serializer = import_string(path)()
+
+    _serializers[name] = serializer
+    return serializer
+
+
+def get_serializer():
+    """
+    Get the serializer for log messages configured with the ``AUDITLOG_SERIALIZER`` setting (``'json'`` by default).
+
+    :return: The serializer.
+    :rtype: Serializer
+    """
+    serializer = load_serializer(getattr(settings, 'AUDITLOG_SERIALIZER', 'json'))
+    if serializer.binary:
+        raise ValueError("The serializer for log messages cannot be binary.")
+    return serializer
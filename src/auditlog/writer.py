@@ -0,0 +1,219 @@
+from __future__ import unicode_literals
+
+import contextvars
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import smart_text
+
+from auditlog.records import ChangeBatch, CREATE, UPDATE, DELETE, SUCCESS, SUMMARY
+
+_buffer = contextvars.ContextVar('auditlog_log_entries', default=None)
+_deferred = contextvars.ContextVar('auditlog_log_entries_deferred', default=False)
+
+
+def is_enabled():
+    """
+    Check whether change records are stored as :py:class:`auditlog.models.LogEntry` objects, which is enabled with the
+    ``AUDITLOG_LOG_ENTRIES`` setting.
+
+    :rtype: bool
+    """
+    return getattr(settings, 'AUDITLOG_LOG_ENTRIES', False)
+
+
+def should_store(record):
+    """
+    Check whether a change record is stored. Of the records of a single change, only the record after the change is
+    stored, so changes that fail are not stored. The changes of an update are calculated before the update and passed
+    on to that record.
+
+    :param record: The change record.
+    :type record: auditlog.records.ChangeRecord
+    :rtype: bool
+    """
+    return record.changes is not None and record.phase in (SUCCESS, SUMMARY)
+
+
+@contextmanager
+def defer_flush():
+    """
+    Context manager that keeps the log entries of the changes made in the block buffered until the block is left (or
+    the buffer is full), so they are inserted together. :py:class:`auditlog.middleware.AuditlogMiddleware` defers the
+    log entries of a request, and the background pipeline those of a batch of records.
+    """
+    token = _deferred.set(True)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+        flush()
+
+
+@asynccontextmanager
+async def adefer_flush():
+    """
+    Async version of :py:func:`defer_flush`. The log entries are inserted from a thread, as the database may not be
+    accessed from the event loop.
+    """
+    token = _deferred.set(True)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+        await sync_to_async(flush)()
+
+
+class LogEntryWriter(object):
+    """
+    Stores change records as log entries. The log entry of a change made in a transaction is only buffered when the
+    outermost transaction on the database of the change is committed, and dropped when the transaction (or its
+    savepoint) is rolled back.
+
+    The buffered log entries are inserted with :py:meth:`~django.db.models.query.QuerySet.bulk_create` right away,
+    unless the flush is deferred (see :py:func:`defer_flush`). Deferred log entries are inserted when the deferring
+    block is left, once the buffer holds ``batch_size`` entries, or once the oldest entry has been buffered for
+    ``flush_interval`` seconds.
+    """
+    actions = {
+        CREATE: 0,
+        UPDATE: 1,
+        DELETE: 2,
+    }
+
+    def __init__(self, batch_size=100, using=None, flush_interval=5.0):
+        """
+        :param batch_size: The number of log entries that are inserted at once.
+        :type batch_size: int
+        :param using: The database alias to store the log entries in.
+        :type using: str
+        :param flush_interval: The maximum number of seconds deferred log entries are buffered.
+        :type flush_interval: float
+        """
+        self.batch_size = batch_size
+        self.using = using
+        self.flush_interval = flush_interval
+
+    def _get_buffer(self):
+        buffer = _buffer.get()
+        if buffer is None:
+            buffer = {'entries': [], 'since': None}
+            _buffer.set(buffer)
+        return buffer
+
+    def write(self, record):
+        """
+        Buffer the log entry of a change record, or of the records in a batch of change records.
+
+        :param record: The change record or batch.
+        :type record: auditlog.records.ChangeRecord or auditlog.records.ChangeBatch
+        """
+        records = record.records if isinstance(record, ChangeBatch) else [record]
+        entries = {}
+        for record in records:
+            if should_store(record):
+                entries.setdefault(record.using, []).append(self.make_log_entry(record))
+
+        for using, database_entries in entries.items():
+            # Wait for the transaction the changes were made in, on the database they were made on.
+            if transaction.get_connection(using).in_atomic_block:
+                # Django drops the callbacks of a transaction or savepoint that is rolled back.
+                transaction.on_commit(partial(self.buffer, database_entries), using=using)
+            else:
+                self.buffer(database_entries)
+
+    def buffer(self, entries):
+        """
+        Add log entries to the buffer, and insert the buffered log entries unless the flush is deferred and the buffer
+        is neither full nor too old.
+
+        :param entries: The log entries.
+        :type entries: list
+        """
+        buffer = self._get_buffer()
+        if not buffer['entries']:
+            buffer['since'] = time.monotonic()
+        buffer['entries'].extend(entries)
+
+        if (not _deferred.get() or len(buffer['entries']) >= self.batch_size
+                or time.monotonic() - buffer['since'] >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the buffered log entries.
+        """
+        from auditlog.history import checkpoint
+        from auditlog.models import LogEntry
+
+        buffer = _buffer.get()
+        if not buffer or not buffer['entries']:
+            return
+
+        entries = buffer['entries'][:]
+        del buffer['entries'][:]
+        LogEntry.objects.using(self.using).bulk_create(entries, batch_size=self.batch_size)
+        checkpoint(entries, using=self.using)
+
+    def make_log_entry(self, record):
+        """
+        Create the (unsaved) log entry for a change record.
+
+        :param record: The change record.
+        :type record: auditlog.records.ChangeRecord
+        :rtype: auditlog.models.LogEntry
+        """
+        from django.contrib.contenttypes.models import ContentType
+        from auditlog.models import LogEntry
+
+        if settings.USE_TZ:
+            timestamp = datetime.fromtimestamp(record.timestamp, tz=timezone.utc)
+        else:
+            timestamp = datetime.fromtimestamp(record.timestamp)
+
+        return LogEntry(
+            content_type=ContentType.objects.db_manager(self.using).get_for_model(record.model),
+            object_pk=smart_text(record.pk),
+            action=self.actions[record.action],
+            changes=record.changes,
+            actor_id=record.actor.user_id,
+            remote_addr=record.actor.remote_addr,
+            timestamp=timestamp,
+        )
+
+
+_writer = None
+
+
+def get_writer():
+    """
+    Get the log entry writer configured with the ``AUDITLOG_LOG_ENTRIES``, ``AUDITLOG_LOG_ENTRY_BATCH_SIZE`` and
+    ``AUDITLOG_LOG_ENTRY_FLUSH_INTERVAL`` settings, or ``None`` if log entries are not stored.
+
+    :rtype: LogEntryWriter
+    """
+    global _writer
+
+    if not is_enabled():
+        return None
+
+    batch_size = getattr(settings, 'AUDITLOG_LOG_ENTRY_BATCH_SIZE', 100)
+    flush_interval = getattr(settings, 'AUDITLOG_LOG_ENTRY_FLUSH_INTERVAL', 5.0)
+    if _writer is None or (_writer.batch_size, _writer.flush_interval) != (batch_size, flush_interval):
+        _writer = LogEntryWriter(batch_size=batch_size, flush_interval=flush_interval)
+    return _writer
+
+
+def flush():
+    """
+    Insert the log entries that are buffered in the current context.
+    """
+    writer = get_writer()
+    if writer is not None:
+        writer.flush()
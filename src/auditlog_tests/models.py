@@ -0,0 +1,75 @@
+from django.db import models
+from jsonfield import JSONField
+
+from auditlog.queryset import AuditlogManager
+from auditlog.registry import auditlog
+
+
+class SimpleModel(models.Model):
+    """
+    A simple model with no special things going on.
+    """
+    text = models.TextField(blank=True)
+    integer = models.IntegerField(blank=True, null=True)
+    boolean = models.BooleanField(default=False)
+    datetime = models.DateTimeField(blank=True, null=True)
+    decimal = models.DecimalField(max_digits=10, decimal_places=3, blank=True, null=True)
+
+
+class SnapshotModel(models.Model):
+    """
+    A model of which the old values are taken from a snapshot.
+    """
+    name = models.CharField(max_length=100)
+    count = models.IntegerField(default=0)
+
+
+class RelatedModel(models.Model):
+    """
+    A model with a foreign key.
+    """
+    related = models.ForeignKey(SimpleModel, on_delete=models.CASCADE)
+
+
+class BulkModel(models.Model):
+    """
+    A model of which the changes made by bulk operations are logged.
+    """
+    name = models.CharField(max_length=100)
+    integer = models.IntegerField(default=0)
+
+    objects = AuditlogManager()
+
+
+class HistoryModel(models.Model):
+    """
+    A model of which the changes of some fields are logged as diffs, and the value of a field is masked.
+    """
+    name = models.CharField(max_length=100, blank=True)
+    config = JSONField(default=dict)
+    body = models.TextField(blank=True)
+    secret = models.CharField(max_length=100, blank=True)
+
+
+class TagModel(models.Model):
+    """
+    The other side of the many-to-many relations of :py:class:`M2MModel`.
+    """
+    name = models.CharField(max_length=100)
+
+
+class M2MModel(models.Model):
+    """
+    A model of which the changes of a many-to-many relation are logged, and those of another are not.
+    """
+    name = models.CharField(max_length=100, blank=True)
+    tags = models.ManyToManyField(TagModel, related_name='tagged')
+    labels = models.ManyToManyField(TagModel, related_name='labelled')
+
+
+auditlog.register(SimpleModel)
+auditlog.register(RelatedModel)
+auditlog.register(BulkModel)
+auditlog.register(HistoryModel, mask_value_fields=['secret'], diff_strategies={'config': 'json', 'body': 'text'})
+auditlog.register(SnapshotModel, snapshot=True)
+auditlog.register(M2MModel, m2m=True, exclude_fields=['labels'])
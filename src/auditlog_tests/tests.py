@@ -0,0 +1,1192 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models.signals import pre_delete, pre_save
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from auditlog.buffering import prefetch
+from auditlog.context import is_suspended
+from auditlog.diff import diff_json, diff_text, model_instance_diff
+from auditlog.export import COLUMNS, export, plan_shards
+from auditlog.filestore import ENTRY, FRAME, FileStore
+from auditlog.history import UNKNOWN, apply_text_diff, state_at
+from auditlog.m2m import get_m2m_fields
+from auditlog.metrics import BYTES, Metrics, assert_audit_overhead, collect_metrics, get_metrics
+from auditlog.middleware import AuditlogMiddleware, auditlog_context
+from auditlog.models import Checkpoint, LogEntry
+from auditlog.pipeline import AuditlogPipeline
+from auditlog.receivers import emit_change
+from auditlog.records import ChangeBatch, ChangeRecord, CREATE, DELETE, SUCCESS, SUMMARY, UPDATE
+from auditlog.registry import auditlog
+from auditlog.sampling import SamplingPolicy
+from auditlog.serializers import JSONSerializer, get_serializer, load_serializer
+from auditlog.writer import defer_flush
+from auditlog_tests.models import (BulkModel, HistoryModel, M2MModel, RelatedModel, SimpleModel, SnapshotModel,
+                                   TagModel)
+
+
+class AuditlogTestCase(TestCase):
+    """
+    Base class for tests that inspect the change records passed to the audit logger.
+    """
+
+    def capture_records(self):
+        """
+        Capture the change records logged in a block, as the ``records`` attribute of the returned context manager.
+        """
+        return self.assertLogs('django.auditlogger', 'INFO')
+
+    def get_records(self, logs):
+        return [log.auditlog_record for log in logs.records if hasattr(log, 'auditlog_record')]
+
+
+class SnapshotTest(AuditlogTestCase):
+    def test_refresh_from_db_reloads_snapshot(self):
+        """The changes of another writer are not logged as part of a save after the instance is reloaded."""
+        instance = SnapshotModel.objects.create(name='created')
+        SnapshotModel.objects.filter(pk=instance.pk).update(name='other')
+        instance.refresh_from_db()
+        instance.name = 'saved'
+
+        with self.capture_records() as logs:
+            instance.save()
+
+        changes = [record.changes for record in self.get_records(logs) if record.action == UPDATE]
+        self.assertEqual(changes[0], {'name': ('other', 'saved')})
+
+    def test_refresh_from_db_fields_updates_snapshot(self):
+        """Reloading some fields only reloads those fields in the snapshot."""
+        instance = SnapshotModel.objects.create(name='created', count=1)
+        SnapshotModel.objects.filter(pk=instance.pk).update(name='other', count=2)
+        instance.refresh_from_db(fields=['name'])
+        instance.name = 'saved'
+
+        with self.capture_records() as logs:
+            instance.save(update_fields=['name'])
+
+        changes = [record.changes for record in self.get_records(logs) if record.action == UPDATE]
+        self.assertEqual(changes[0], {'name': ('other', 'saved')})
+
+    def test_unregister_restores_refresh_from_db(self):
+        refresh_from_db = SnapshotModel.refresh_from_db
+        self.assertTrue(refresh_from_db.refreshes_snapshot)
+
+        auditlog.unregister(SnapshotModel)
+        try:
+            self.assertFalse(hasattr(SnapshotModel.refresh_from_db, 'refreshes_snapshot'))
+        finally:
+            auditlog.register(SnapshotModel, snapshot=True)
+
+
+class DiffPlanTest(AuditlogTestCase):
+    def test_update_compares_foreign_keys(self):
+        """Changing a foreign key is logged on update, as the primary keys of the related objects."""
+        first, second = SimpleModel.objects.create(), SimpleModel.objects.create()
+        instance = RelatedModel.objects.create(related=first)
+        instance.related = second
+
+        with self.capture_records() as logs:
+            instance.save()
+
+        changes = [record.changes for record in self.get_records(logs) if record.action == UPDATE]
+        self.assertEqual(changes[0], {'related': (first.pk, second.pk)})
+
+    def test_text_diff_keeps_line_endings(self):
+        """A text diff rebuilds the new value exactly, including trailing newlines and other line endings."""
+        lines = ['line {}'.format(number) for number in range(20)]
+        for old, new in [
+            ('a\nb', 'a\nb\n'),
+            ('\n'.join(lines), '\n'.join(lines) + '\n'),
+            ('\n'.join(lines) + '\n', '\n'.join(lines)),
+            ('\r\n'.join(lines), '\r\n'.join(lines[:10] + ['changed'] + lines[11:]) + '\r\n'),
+            ('\n'.join(lines), '\r\n'.join(lines)),
+        ]:
+            change = diff_text(None, old, new)
+            self.assertIsNotNone(change)
+            rebuilt = apply_text_diff(old, change['diff']) if isinstance(change, dict) else change[1]
+            self.assertEqual(rebuilt, new)
+
+    def test_json_patch_copies_values(self):
+        """The patch does not change when the nested values of the instance are changed afterwards."""
+        old, new = {'a': [1]}, {'a': [1, {'b': [2]}], 'c': {'d': 3}}
+        change = diff_json(None, old, new)
+        new['a'][1]['b'].append(4)
+        new['c']['d'] = 4
+        self.assertEqual(change, {'patch': [
+            {'op': 'add', 'path': '/a/1', 'value': {'b': [2]}},
+            {'op': 'add', 'path': '/c', 'value': {'d': 3}},
+        ]})
+
+        old, new = None, {'a': [1]}
+        change = diff_json(None, old, new)
+        new['a'].append(2)
+        self.assertEqual(change, (None, {'a': [1]}))
+
+
+class FailingHandler(logging.Handler):
+    def emit(self, record):
+        raise RuntimeError("The handler is broken.")
+
+
+class PipelineTest(TestCase):
+    def test_failed_batch_is_reported(self):
+        """A batch that fails to be written is reported, counted as dropped and makes the flush fail."""
+        logger = logging.getLogger('auditlog_tests.pipeline')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+        handler = FailingHandler()
+        logger.addHandler(handler)
+        pipeline = AuditlogPipeline(logger)
+        try:
+            with self.assertLogs('auditlog.pipeline', 'ERROR'):
+                pipeline.put(ChangeRecord(CREATE, SUCCESS, SimpleModel, 1, {'text': (None, 'a')}, None, time.time()))
+                self.assertFalse(pipeline.flush(timeout=5))
+            self.assertEqual(pipeline.dropped, 1)
+            self.assertTrue(pipeline.flush(timeout=5))
+        finally:
+            pipeline.stop()
+            logger.removeHandler(handler)
+
+
+class QuerySetTest(AuditlogTestCase):
+    def test_update_in_chunks(self):
+        """Every row is logged when the update changes the field the queryset is filtered on."""
+        BulkModel.objects.bulk_create([BulkModel(name=str(number), integer=1) for number in range(5)])
+
+        with mock.patch.object(BulkModel.objects._queryset_class, 'audit_chunk_size', 2):
+            with self.capture_records() as logs:
+                rows = BulkModel.objects.filter(integer=1).update(integer=2)
+
+        changes = [record.changes for record in self.get_records(logs) if record.action == UPDATE]
+        self.assertEqual(rows, 5)
+        self.assertEqual(changes, [{'integer': (1, 2)}] * 5)
+
+    def test_chunk_size_fits_query_params(self):
+        queryset = BulkModel.objects.all()
+        with mock.patch.object(connection.features, 'max_query_params', 10):
+            self.assertEqual(queryset._get_chunk_size(), 10)
+        with mock.patch.object(connection.features, 'max_query_params', None):
+            self.assertEqual(queryset._get_chunk_size(), queryset.audit_chunk_size)
+
+    def test_bulk_create_without_primary_keys(self):
+        """Objects of which the database does not return the primary keys are not logged as 'None'."""
+        with mock.patch.object(connection.features, 'can_return_rows_from_bulk_insert', False):
+            with self.capture_records() as logs:
+                BulkModel.objects.bulk_create([BulkModel(name='a'), BulkModel(name='b')])
+
+        self.assertEqual(self.get_records(logs), [])
+        self.assertIn("The creation of 2 auditlog_tests.BulkModel objects", logs.output[0])
+
+
+@override_settings(AUDITLOG_DELETE_MODE='summary')
+class DeleteSummaryTest(AuditlogTestCase):
+    def test_failed_delete_is_not_summarized(self):
+        """The objects of a delete that was rolled back are not listed in the summary of the next delete."""
+        failing, deleted = SimpleModel.objects.create(), SimpleModel.objects.create()
+
+        def fail(sender, instance, **kwargs):
+            if instance.pk == failing.pk:
+                raise RuntimeError("The delete fails.")
+
+        pre_delete.connect(fail, sender=SimpleModel)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                failing.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=SimpleModel)
+
+        pk = deleted.pk
+        with self.capture_records() as logs:
+            deleted.delete()
+
+        records = [record for record in self.get_records(logs) if record.action == DELETE]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].phase, SUMMARY)
+        self.assertEqual(records[0].changes, {'auditlog_tests.SimpleModel': [pk]})
+
+
+@override_settings(AUDITLOG_LOG_ENTRIES=True)
+class LogEntryWriterTest(TransactionTestCase):
+    databases = {'default', 'other'}
+
+    def test_only_saved_changes_are_stored(self):
+        """The changes of an update are stored from the record after the save, so a failed save is not stored."""
+        instance = SimpleModel.objects.create(text='created')
+        instance.text = 'failed'
+
+        def fail(sender, instance, **kwargs):
+            raise RuntimeError("The save fails.")
+
+        pre_save.connect(fail, sender=SimpleModel)
+        try:
+            with self.assertRaises(RuntimeError):
+                instance.save()
+        finally:
+            pre_save.disconnect(fail, sender=SimpleModel)
+
+        instance.text = 'saved'
+        instance.save()
+
+        entries = LogEntry.objects.get_for_object(instance).order_by('pk')
+        self.assertEqual([entry.action for entry in entries], [LogEntry.Action.CREATE, LogEntry.Action.UPDATE])
+        self.assertEqual(entries[1].changes, {'text': ['created', 'saved']})
+
+    def test_rolled_back_changes_are_not_stored(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            SimpleModel.objects.create(text='rolled back')
+            raise RuntimeError("Roll back.")
+        self.assertFalse(LogEntry.objects.exists())
+
+        with transaction.atomic():
+            instance = SimpleModel.objects.create(text='committed')
+            self.assertFalse(LogEntry.objects.exists())
+        self.assertEqual(LogEntry.objects.get_for_object(instance).count(), 1)
+
+    def test_waits_for_transaction_on_database_of_change(self):
+        """The log entry of a change waits for the transaction on the database the change was made on."""
+        with transaction.atomic(using='other'):
+            instance = SimpleModel.objects.using('other').create(text='committed')
+            self.assertFalse(LogEntry.objects.exists())
+        self.assertEqual(LogEntry.objects.get_for_object(instance).count(), 1)
+
+        with self.assertRaises(RuntimeError), transaction.atomic(using='other'):
+            SimpleModel.objects.using('other').create(text='rolled back')
+            raise RuntimeError("Roll back.")
+        self.assertEqual(LogEntry.objects.count(), 1)
+
+    def test_stored_when_logger_is_disabled(self):
+        """Log entries are stored even if the audit logger does not log anything."""
+        logger = logging.getLogger('django.auditlogger')
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            instance = SimpleModel.objects.create(text='created')
+        finally:
+            logger.setLevel(level)
+        self.assertEqual(LogEntry.objects.get_for_object(instance).count(), 1)
+
+    def test_deferred_flush(self):
+        with defer_flush():
+            instance = SimpleModel.objects.create(text='created')
+            self.assertFalse(LogEntry.objects.exists())
+        self.assertEqual(LogEntry.objects.get_for_object(instance).count(), 1)
+
+
+class FileStoreTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def write(self, store, pk, count=1):
+        store.write([
+            ChangeRecord.for_object(SimpleModel, pk, UPDATE, SUCCESS, {'integer': [number, number + 1]})
+            for number in range(count)
+        ])
+
+    def get_changes(self, store, pk):
+        return [record['changes']['integer'] for record in store.history(SimpleModel, pk)]
+
+    def test_torn_tail_record(self):
+        """An incomplete record at the end of the segment is dropped before the next write."""
+        self.write(FileStore(self.path), 1, 2)
+        with open(os.path.join(self.path, 'segment-00000001.log'), 'ab') as segment:
+            segment.write(FRAME.pack(100) + b'{"model":')
+
+        store = FileStore(self.path)
+        self.write(store, 1)
+        self.assertEqual(self.get_changes(store, 1), [[0, 1], [1, 2], [0, 1]])
+
+    def test_torn_index(self):
+        """An index that misses the last records, or ends in an incomplete entry, is repaired from the segment."""
+        self.write(FileStore(self.path), 1, 3)
+        index_path = os.path.join(self.path, 'segment-00000001.idx')
+        os.truncate(index_path, ENTRY.size + 5)
+
+        store = FileStore(self.path)
+        self.write(store, 2)
+        self.assertEqual(self.get_changes(store, 1), [[0, 1], [1, 2], [2, 3]])
+        self.assertEqual(os.path.getsize(index_path), ENTRY.size * 4)
+
+    def test_torn_sorted_index(self):
+        """A segment of which the sealing was interrupted is sealed again, and a damaged sorted index is rebuilt."""
+        store = FileStore(self.path, segment_size=1)
+        self.write(store, 1)
+        self.write(store, 1)
+        # Interrupted after the sorted index was written to its temporary file.
+        os.rename(os.path.join(self.path, 'segment-00000001.sidx'), os.path.join(self.path, 'segment-00000001.idx'))
+        with open(os.path.join(self.path, 'segment-00000001.sidx.tmp'), 'wb') as temp:
+            temp.write(b'\x00' * 5)
+
+        store = FileStore(self.path, segment_size=1)
+        self.write(store, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'segment-00000001.sidx')))
+        self.assertEqual(self.get_changes(store, 1), [[0, 1]] * 3)
+
+        os.truncate(os.path.join(self.path, 'segment-00000001.sidx'), 5)
+        self.assertEqual(store.rebuild(), 3)
+        self.assertEqual(self.get_changes(store, 1), [[0, 1]] * 3)
+
+    def test_segment_sealed_by_another_writer(self):
+        """A writer appends to the new segment after another process sealed the segment it had open."""
+        first, second = FileStore(self.path, segment_size=1), FileStore(self.path, segment_size=1)
+        self.write(first, 1)
+        self.write(second, 2)
+        self.write(first, 1, 2)
+
+        self.assertEqual(first.get_segments(), [1, 2, 3])
+        self.assertEqual(self.get_changes(second, 1), [[0, 1], [0, 1], [1, 2]])
+        self.assertEqual(self.get_changes(first, 2), [[0, 1]])
+
+
+@override_settings(AUDITLOG_LOG_ENTRIES=True)
+class HistoryTest(TransactionTestCase):
+    def test_replay_diffs(self):
+        """The values of fields that are logged as a JSON patch or a text diff are reconstructed."""
+        instance = HistoryModel.objects.create(config={'a': {'b': 1, 'c': [1, 2]}}, body='one\ntwo\nthree')
+        created = LogEntry.objects.get_for_object(instance).get().timestamp
+        instance.config = {'a': {'b': 2, 'c': [1, 3, 4]}, 'd': 'x'}
+        instance.body = 'one\n2\nthree\nfour'
+        instance.save()
+
+        state = state_at(HistoryModel, instance.pk)
+        self.assertEqual(state['config'], instance.config)
+        self.assertEqual(state['body'], instance.body)
+
+        state = state_at(HistoryModel, instance.pk, when=created)
+        self.assertEqual(state['config'], {'a': {'b': 1, 'c': [1, 2]}})
+        self.assertEqual(state['body'], 'one\ntwo\nthree')
+
+    def test_replay_trailing_newline(self):
+        body = '\n'.join('line {}'.format(number) for number in range(20))
+        instance = HistoryModel.objects.create(body=body)
+        instance.body = body + '\n'
+        instance.save()
+
+        entry = LogEntry.objects.get_for_object(instance).latest('pk')
+        self.assertEqual(entry.changes, {'body': {'diff': '@@ -20,0 +21 @@\n+'}})
+        self.assertEqual(state_at(HistoryModel, instance.pk)['body'], body + '\n')
+
+    def test_native_values(self):
+        """The values are converted back to the types of the fields."""
+        created = timezone.now().replace(microsecond=0)
+        instance = SimpleModel.objects.create(text='a', integer=1, decimal=Decimal('12.500'), datetime=created)
+        instance.decimal = Decimal('13.250')
+        instance.save()
+
+        state = state_at(SimpleModel, instance.pk)
+        self.assertEqual(state['decimal'], Decimal('13.250'))
+        self.assertIsInstance(state['decimal'], Decimal)
+        self.assertEqual(state['datetime'], created)
+        self.assertEqual(state['integer'], 1)
+        self.assertEqual(state['text'], 'a')
+
+    def test_replay_text_field(self):
+        """A text field logged with the text strategy is replayed line by line."""
+        lines = ['line {}'.format(number) for number in range(20)]
+        instance = HistoryModel.objects.create(body='\n'.join(lines))
+        created = LogEntry.objects.get_for_object(instance).get().timestamp
+        instance.body = '\n'.join(lines[:5] + ['changed'] + lines[6:])
+        instance.save()
+
+        entry = LogEntry.objects.get_for_object(instance).latest('pk')
+        self.assertEqual(entry.changes, {'body': {'diff': '@@ -6 +6 @@\n-line 5\n+changed'}})
+        self.assertEqual(state_at(HistoryModel, instance.pk)['body'], instance.body)
+        self.assertEqual(state_at(HistoryModel, instance.pk, when=created)['body'], '\n'.join(lines))
+
+    def test_masked_field_is_unknown(self):
+        instance = HistoryModel.objects.create(secret='hunter2')
+        instance.secret = 'hunter3'
+        instance.save()
+
+        state = state_at(HistoryModel, instance.pk)
+        self.assertIs(state['secret'], UNKNOWN)
+        self.assertEqual(state['name'], '')
+
+    @override_settings(AUDITLOG_CHECKPOINT_EVERY=3)
+    def test_state_across_checkpoint(self):
+        """The state before a checkpoint is replayed from the log entries, the state after starts at the checkpoint."""
+        instance = HistoryModel.objects.create(name='0')
+        for number in range(1, 6):
+            instance.name = str(number)
+            instance.save()
+
+        entries = list(LogEntry.objects.get_for_object(instance).order_by('timestamp', 'pk'))
+        checkpoints = Checkpoint.objects.order_by('timestamp', 'log_entry_id')
+        self.assertEqual([checkpoint.log_entry for checkpoint in checkpoints], [entries[2], entries[5]])
+        self.assertEqual([checkpoint.state['name'] for checkpoint in checkpoints], ['2', '5'])
+
+        for number, entry in enumerate(entries):
+            self.assertEqual(state_at(HistoryModel, instance.pk, when=entry.timestamp)['name'], str(number))
+
+        instance.delete()
+        self.assertIsNone(state_at(HistoryModel, instance.pk))
+
+
+class SamplingPolicyTest(TestCase):
+    def test_buckets_are_capped(self):
+        """The least recently used token buckets are dropped once there are more than MAX_BUCKETS."""
+        policy = SamplingPolicy(limit=(1, 60))
+        with mock.patch('auditlog.sampling.MAX_BUCKETS', 3):
+            for pk in range(3):
+                self.assertTrue(policy.allow(UPDATE, pk))
+            self.assertFalse(policy.allow(UPDATE, 0))
+            self.assertTrue(policy.allow(UPDATE, 3))
+
+            self.assertEqual(list(policy.buckets), [(UPDATE, 2), (UPDATE, 0), (UPDATE, 3)])
+            self.assertFalse(policy.allow(UPDATE, 0))
+            # The bucket of the object that was used least recently was dropped.
+            self.assertTrue(policy.allow(UPDATE, 1))
+            self.assertEqual(len(policy.buckets), 3)
+
+
+class IncompleteMetrics(Metrics):
+    """
+    A metrics hook that does not implement observe().
+    """
+
+
+class MetricsTest(TestCase):
+    @override_settings(AUDITLOG_METRICS='auditlog_tests.tests.IncompleteMetrics')
+    def test_observe_is_required(self):
+        """A hook without observe() fails when it is configured, not when the first measurement is made."""
+        with self.assertRaises(TypeError):
+            get_metrics()
+
+    def test_serialization_measured_once(self):
+        """The changes of a record are measured once, not for every handler that renders the message."""
+        logger = logging.getLogger('django.auditlogger')
+        handlers = [logging.StreamHandler(io.StringIO()) for number in range(3)]
+        for handler in handlers:
+            logger.addHandler(handler)
+        try:
+            with collect_metrics() as metrics:
+                SimpleModel.objects.create(text='a')
+        finally:
+            for handler in handlers:
+                logger.removeHandler(handler)
+
+        count, total, maximum = metrics.stats['auditlog_tests.SimpleModel', CREATE, BYTES]
+        # The record before and after creating the object.
+        self.assertEqual(count, 2)
+
+    def test_batch_is_measured(self):
+        record = ChangeRecord.for_object(SimpleModel, 1, UPDATE, SUCCESS, {'text': ['a', 'b']})
+        batch = ChangeBatch(correlation_id='request', actor=record.actor, records=[record], timestamp=time.time())
+
+        with collect_metrics() as metrics:
+            emit_change(batch)
+
+        totals = metrics.get_totals()['auditlog_tests.SimpleModel', UPDATE]
+        self.assertEqual(totals[BYTES], len(get_serializer().dumps(record.as_dict()).encode('utf-8')))
+
+    def test_collector_is_local_to_context(self):
+        seen = []
+        with collect_metrics() as metrics:
+            thread = threading.Thread(target=lambda: seen.append(get_metrics()))
+            thread.start()
+            thread.join()
+            self.assertIs(get_metrics(), metrics)
+        self.assertIsNot(seen[0], metrics)
+
+    def test_stats_requires_command(self):
+        with self.assertRaises(CommandError):
+            call_command('auditlog_stats')
+
+
+class ValueComparisonTest(TestCase):
+    def test_native_values(self):
+        """Equal native values are no change, values that only differ in type or representation are compared as text."""
+        old = SimpleModel(pk=1, text='a', integer=1, decimal=Decimal('1.5'))
+        new = SimpleModel(pk=1, text='a', integer=1, decimal=Decimal('1.5'))
+        self.assertIsNone(model_instance_diff(old, new))
+
+        new.integer = '1'
+        self.assertIsNone(model_instance_diff(old, new))
+
+        new.decimal = Decimal('1.50')
+        self.assertEqual(model_instance_diff(old, new), {'decimal': (Decimal('1.5'), Decimal('1.50'))})
+
+    def test_aware_and_naive_datetimes(self):
+        """An aware datetime and the naive datetime of the same moment in UTC are the same value."""
+        moment = datetime.datetime(2020, 1, 1, 12, 0)
+        old = SimpleModel(pk=1, datetime=moment)
+        new = SimpleModel(pk=1, datetime=timezone.make_aware(moment, timezone.utc))
+        self.assertIsNone(model_instance_diff(old, new))
+
+
+class DisabledLoggerTest(TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('django.auditlogger')
+        self.addCleanup(self.logger.setLevel, self.logger.level)
+
+    def test_no_work_when_logger_is_disabled(self):
+        """Nothing is fetched, compared or rendered when the audit logger is above INFO and nothing else is stored."""
+        instance = SimpleModel.objects.create(text='a')
+        self.logger.setLevel(logging.WARNING)
+        instance.text = 'b'
+
+        with mock.patch('auditlog.receivers.model_instance_diff') as diff, \
+                mock.patch('auditlog.records.get_serializer') as get_serializer, \
+                assert_audit_overhead(max_queries=0):
+            instance.save()
+            instance.delete()
+        diff.assert_not_called()
+        get_serializer.assert_not_called()
+
+    def test_message_rendered_only_by_handlers(self):
+        """The message of a record is not rendered if no handler formats it."""
+        instance = SimpleModel.objects.create(text='a')
+        instance.text = 'b'
+
+        with mock.patch('auditlog.records.get_serializer') as get_serializer:
+            instance.save()
+        get_serializer.assert_not_called()
+
+
+class UpdateFieldsTest(AuditlogTestCase):
+    def test_old_row_fetch_is_narrowed(self):
+        """Saving some fields fetches and compares only those fields."""
+        instance = SimpleModel.objects.create(text='a', integer=1)
+        instance.text = 'b'
+        instance.integer = 2
+
+        with CaptureQueriesContext(connection) as queries, self.capture_records() as logs:
+            with assert_audit_overhead(max_queries=1):
+                instance.save(update_fields=['text'])
+
+        select = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(select), 1)
+        self.assertIn('"text"', select[0])
+        self.assertNotIn('"integer"', select[0])
+        changes = [record.changes for record in self.get_records(logs) if record.action == UPDATE]
+        self.assertEqual(changes[0], {'text': ('a', 'b')})
+
+
+class DeferredFieldsTest(AuditlogTestCase):
+    def test_deferred_fields_are_not_refreshed(self):
+        """Saving an instance loaded with only() does not refresh its deferred fields one by one."""
+        SimpleModel.objects.create(text='a', integer=1, boolean=True)
+        instance = SimpleModel.objects.only('text').get()
+        instance.text = 'b'
+
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=1):
+            instance.save()
+
+        self.assertEqual(instance.get_deferred_fields(), {'integer', 'boolean', 'datetime', 'decimal'})
+        changes = [record.changes for record in self.get_records(logs) if record.action == UPDATE]
+        self.assertEqual(changes[0], {'text': ('a', 'b')})
+
+    def test_deferred_old_fields_load_with_one_query(self):
+        """Deferred fields of the old instance are loaded together with a single query."""
+        SimpleModel.objects.create(text='a', integer=1, boolean=True)
+        old = SimpleModel.objects.only('text').get()
+        new = SimpleModel.objects.get()
+        new.integer = 2
+        new.boolean = False
+
+        with self.assertNumQueries(1):
+            changes = model_instance_diff(old, new)
+
+        self.assertEqual(changes['integer'], (1, 2))
+        self.assertEqual(changes['boolean'], (True, False))
+
+
+class PipelineLevelTest(TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('auditlog_tests.pipeline_level')
+        self.logger.propagate = False
+        self.handler = mock.Mock(spec=logging.Handler, level=logging.NOTSET)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+
+    def test_disabled_logger_is_not_written(self):
+        """The pipeline does not pass records to the handlers of a logger that is not enabled for INFO records."""
+        self.logger.setLevel(logging.WARNING)
+        pipeline = AuditlogPipeline(self.logger)
+        try:
+            pipeline.put(ChangeRecord(CREATE, SUCCESS, SimpleModel, 1, {'text': (None, 'a')}, None, time.time()))
+            self.assertTrue(pipeline.flush(timeout=5))
+        finally:
+            pipeline.stop()
+        self.handler.emit.assert_not_called()
+
+    def test_disabled_pipeline_logger_is_not_auditing(self):
+        """Changes are not diffed when the logger of the pipeline is not enabled for INFO records."""
+        instance = SimpleModel.objects.create(text='a')
+        instance.text = 'b'
+        self.logger.setLevel(logging.WARNING)
+        pipeline = AuditlogPipeline(self.logger)
+        audit_logger = logging.getLogger('django.auditlogger')
+        self.addCleanup(audit_logger.setLevel, audit_logger.level)
+        audit_logger.setLevel(logging.WARNING)
+
+        with mock.patch('auditlog.receivers.get_pipeline', return_value=pipeline):
+            with mock.patch('auditlog.receivers.model_instance_diff') as diff:
+                instance.save()
+        pipeline.stop()
+        diff.assert_not_called()
+
+
+@override_settings(AUDITLOG_TRANSACTION_BUFFERING=True)
+class TransactionBufferingTest(AuditlogTestCase):
+    def test_records_are_emitted_on_commit(self):
+        """Records of changes in a transaction are emitted only once it is committed."""
+        with self.capture_records() as logs:
+            with self.captureOnCommitCallbacks() as callbacks:
+                SimpleModel.objects.create(text='a')
+            logging.getLogger('django.auditlogger').info("Before the commit.")
+            self.assertEqual(self.get_records(logs), [])
+
+            for callback in callbacks:
+                callback()
+
+        self.assertEqual([(record.action, record.phase) for record in self.get_records(logs)][-1], (CREATE, SUCCESS))
+
+    def test_records_are_dropped_on_rollback(self):
+        """Records of changes in a transaction that is rolled back are never emitted."""
+        with self.capture_records() as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        SimpleModel.objects.create(text='a')
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                SimpleModel.objects.create(text='b')
+
+        records = [record for record in self.get_records(logs) if record.phase == SUCCESS]
+        self.assertEqual([record.changes['text'] for record in records], [(None, 'b')])
+
+    def test_prefetch(self):
+        """Prefetching the old rows costs one query per model, and saving the instances fetches nothing."""
+        simple = [SimpleModel.objects.create(text=str(number)) for number in range(3)]
+        bulk = [BulkModel.objects.create(name=str(number), integer=number) for number in range(3)]
+
+        with self.assertNumQueries(2):
+            with prefetch(simple + bulk):
+                pass
+
+        with prefetch(simple + bulk), self.capture_records() as logs:
+            for instance in simple:
+                instance.text += '!'
+            for instance in bulk:
+                instance.integer += 1
+            with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(6):
+                for instance in simple + bulk:
+                    instance.save()
+
+        changes = [record.changes for record in self.get_records(logs) if record.phase == SUCCESS]
+        self.assertEqual(len(changes), 6)
+        self.assertEqual(changes[0], {'text': ('0', '0!')})
+        self.assertEqual(changes[3], {'integer': (0, 1)})
+
+
+class MiddlewareTest(AuditlogTestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')
+
+    def test_context_is_cleared_after_request(self):
+        """The context is set while the view runs and cleared when the response is returned."""
+        def view(request):
+            self.assertEqual(AuditlogMiddleware.get_remote_address(), '127.0.0.1')
+            return HttpResponse()
+
+        AuditlogMiddleware(view)(self.request)
+        self.assertIsNone(auditlog_context.get())
+
+    def test_context_is_cleared_when_view_raises(self):
+        def view(request):
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            AuditlogMiddleware(view)(self.request)
+        self.assertIsNone(auditlog_context.get())
+
+
+@override_settings(AUDITLOG_AGGREGATE_REQUESTS=True, AUDITLOG_AGGREGATE_CHUNK_SIZE=2)
+class AggregationTest(AuditlogTestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')
+
+    def view(self, request):
+        for number in range(3):
+            SimpleModel.objects.create(text=str(number))
+        return HttpResponse()
+
+    def get_batches(self, logs):
+        return [record for record in self.get_records(logs) if isinstance(record, ChangeBatch)]
+
+    def test_records_are_emitted_in_chunks(self):
+        """The records of a request are emitted in batches when the request is done, sharing a correlation id."""
+        with self.capture_records() as logs:
+            AuditlogMiddleware(self.view)(self.request)
+
+        batches = self.get_batches(logs)
+        self.assertEqual([len(batch.records) for batch in batches], [2, 2, 2])
+        self.assertEqual(len({batch.correlation_id for batch in batches}), 1)
+        self.assertEqual(batches[0].actor.remote_addr, '127.0.0.1')
+
+    def test_correlation_id_per_request(self):
+        with self.capture_records() as logs:
+            AuditlogMiddleware(self.view)(self.request)
+            AuditlogMiddleware(self.view)(self.request)
+
+        self.assertEqual(len({batch.correlation_id for batch in self.get_batches(logs)}), 2)
+
+    def test_records_are_emitted_when_view_raises(self):
+        """The changes a view made before it raised are emitted as well."""
+        def view(request):
+            self.view(request)
+            raise RuntimeError
+
+        with self.capture_records() as logs, self.assertRaises(RuntimeError):
+            AuditlogMiddleware(view)(self.request)
+
+        self.assertEqual(sum(len(batch.records) for batch in self.get_batches(logs)), 6)
+        self.assertIsNone(auditlog_context.get())
+
+
+@override_settings(AUDITLOG_AGGREGATE_REQUESTS=True)
+class AsyncMiddlewareTest(TransactionTestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')
+
+    async def view(self, request):
+        await sync_to_async(SimpleModel.objects.create)(text='a')
+        return HttpResponse()
+
+    def test_aggregated_records_are_emitted_outside_event_loop(self):
+        """The batches of an async request are emitted from a thread, not from the event loop."""
+        with self.assertLogs('django.auditlogger', 'INFO') as logs:
+            asyncio.run(AuditlogMiddleware(self.view)(self.request))
+
+        batches = [log for log in logs.records if isinstance(getattr(log, 'auditlog_record', None), ChangeBatch)]
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(len(batches[0].auditlog_record.records), 2)
+        self.assertNotEqual(batches[0].thread, threading.get_ident())
+        self.assertIsNone(auditlog_context.get())
+
+
+@override_settings(AUDITLOG_LOG_ENTRIES=True)
+class AsyncLogEntryTest(TransactionTestCase):
+    async def view(self, request):
+        await sync_to_async(SimpleModel.objects.create)(text='a')
+        return HttpResponse()
+
+    def test_log_entries_of_async_request(self):
+        """The deferred log entries of an async request are inserted when it is done."""
+        request = RequestFactory().get('/', REMOTE_ADDR='127.0.0.1')
+        asyncio.run(AuditlogMiddleware(self.view)(request))
+
+        entry = LogEntry.objects.get()
+        self.assertEqual(entry.action, LogEntry.Action.CREATE)
+        self.assertEqual(entry.remote_addr, '127.0.0.1')
+
+
+class SaveMessageTest(AuditlogTestCase):
+    def update(self):
+        instance = SimpleModel.objects.create(text='a')
+        instance.text = 'b'
+        with self.capture_records() as logs:
+            instance.save()
+        return [record for record in self.get_records(logs) if record.action == UPDATE]
+
+    def test_changes_are_logged_once(self):
+        """The record after an update keeps the changes, but only the record before the update renders them."""
+        attempt, success = self.update()
+        self.assertIn('"text"', attempt.message)
+        self.assertEqual(success.changes, {'text': ('a', 'b')})
+        self.assertNotIn('"text"', success.message)
+
+    @override_settings(AUDITLOG_SAVE_MODE='single')
+    def test_single_record_renders_changes(self):
+        success, = self.update()
+        self.assertIn('"text"', success.message)
+
+
+@override_settings(AUDITLOG_SAVE_MODE='single')
+class SingleSaveModeTest(AuditlogTestCase):
+    def test_create_is_logged_once_with_pk(self):
+        """A new object is logged once, after it is saved, with its new primary key."""
+        with self.capture_records() as logs:
+            instance = SimpleModel.objects.create(text='a')
+
+        records = self.get_records(logs)
+        self.assertEqual([(record.action, record.phase) for record in records], [(CREATE, SUCCESS)])
+        self.assertEqual(records[0].pk, instance.pk)
+        self.assertIsNotNone(records[0].pk)
+        self.assertEqual(records[0].changes['text'], (None, 'a'))
+
+    def test_update_is_logged_once(self):
+        instance = SimpleModel.objects.create(text='a')
+        instance.text = 'b'
+        with self.capture_records() as logs:
+            instance.save()
+
+        records = self.get_records(logs)
+        self.assertEqual([(record.action, record.phase) for record in records], [(UPDATE, SUCCESS)])
+        self.assertEqual(records[0].changes, {'text': ('a', 'b')})
+
+    def test_failed_save_is_not_logged(self):
+        """Nothing is logged for a save that fails, and its changes are not logged by the next save."""
+        instance = SimpleModel.objects.create(text='a')
+        instance.text = 'failed'
+
+        def fail(sender, instance, **kwargs):
+            raise RuntimeError("The save fails.")
+
+        pre_save.connect(fail, sender=SimpleModel)
+        self.addCleanup(pre_save.disconnect, fail, sender=SimpleModel)
+        with self.assertLogs('django.auditlogger', 'INFO') as logs:
+            logging.getLogger('django.auditlogger').info("Start.")
+            with self.assertRaises(RuntimeError):
+                instance.save()
+        self.assertEqual(self.get_records(logs), [])
+        pre_save.disconnect(fail, sender=SimpleModel)
+
+        instance.text = 'b'
+        with self.capture_records() as logs:
+            instance.save()
+        self.assertEqual(self.get_records(logs)[0].changes, {'text': ('a', 'b')})
+
+
+class ManyToManyTest(AuditlogTestCase):
+    def setUp(self):
+        self.obj = M2MModel.objects.create(name='obj')
+        self.other = M2MModel.objects.create(name='other')
+        self.tags = [TagModel.objects.create(name=str(number)) for number in range(3)]
+
+    def get_changes(self, logs):
+        return [(record.pk, record.changes) for record in self.get_records(logs)]
+
+    def test_add(self):
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=0):
+            self.obj.tags.add(*self.tags[:2])
+        self.assertEqual(self.get_changes(logs), [
+            (self.obj.pk, {'tags': {'added': [self.tags[0].pk, self.tags[1].pk]}}),
+        ])
+
+    def test_add_already_related(self):
+        self.obj.tags.add(self.tags[0])
+        with self.capture_records() as logs:
+            self.obj.tags.add(self.tags[0], self.tags[1])
+        self.assertEqual(self.get_changes(logs), [(self.obj.pk, {'tags': {'added': [self.tags[1].pk]}})])
+
+    def test_remove(self):
+        """Only the objects that were actually related are logged, with a single query."""
+        self.obj.tags.add(self.tags[0])
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=1):
+            self.obj.tags.remove(self.tags[0], self.tags[1])
+        self.assertEqual(self.get_changes(logs), [(self.obj.pk, {'tags': {'removed': [self.tags[0].pk]}})])
+
+    def test_set(self):
+        self.obj.tags.add(self.tags[0], self.tags[1])
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=1):
+            self.obj.tags.set([self.tags[1], self.tags[2]])
+        self.assertEqual(self.get_changes(logs), [
+            (self.obj.pk, {'tags': {'removed': [self.tags[0].pk]}}),
+            (self.obj.pk, {'tags': {'added': [self.tags[2].pk]}}),
+        ])
+
+    def test_clear(self):
+        self.obj.tags.add(*self.tags)
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=1):
+            self.obj.tags.clear()
+        self.assertEqual(self.get_changes(logs), [
+            (self.obj.pk, {'tags': {'removed': [tag.pk for tag in self.tags]}}),
+        ])
+
+    def test_reverse(self):
+        """A change from the related model is logged for each object of the registered model."""
+        tag = self.tags[0]
+        with self.capture_records() as logs:
+            tag.tagged.add(self.obj, self.other)
+        self.assertEqual(self.get_changes(logs), [
+            (self.obj.pk, {'tags': {'added': [tag.pk]}}),
+            (self.other.pk, {'tags': {'added': [tag.pk]}}),
+        ])
+
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=1):
+            tag.tagged.remove(self.other)
+        self.assertEqual(self.get_changes(logs), [(self.other.pk, {'tags': {'removed': [tag.pk]}})])
+
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=1):
+            tag.tagged.set([self.other])
+        self.assertEqual(self.get_changes(logs), [
+            (self.obj.pk, {'tags': {'removed': [tag.pk]}}),
+            (self.other.pk, {'tags': {'added': [tag.pk]}}),
+        ])
+
+        with self.capture_records() as logs, assert_audit_overhead(max_queries=1):
+            tag.tagged.clear()
+        self.assertEqual(self.get_changes(logs), [(self.other.pk, {'tags': {'removed': [tag.pk]}})])
+
+    def test_excluded_field(self):
+        """Changes of a many-to-many field that is excluded are not logged, and cost no queries."""
+        with self.assertLogs('django.auditlogger', 'INFO') as logs, assert_audit_overhead(max_queries=0):
+            logging.getLogger('django.auditlogger').info("Start.")
+            self.obj.labels.add(self.tags[0])
+            self.obj.labels.clear()
+            self.tags[0].labelled.set([self.other])
+        self.assertEqual(self.get_records(logs), [])
+
+    def test_field_filters(self):
+        self.assertEqual([field.name for field in get_m2m_fields(M2MModel)], ['tags', 'labels'])
+        self.assertEqual([field.name for field in get_m2m_fields(M2MModel, include_fields=['labels'])], ['labels'])
+        self.assertEqual([field.name for field in get_m2m_fields(M2MModel, exclude_fields=['labels'])], ['tags'])
+        self.assertEqual(get_m2m_fields(M2MModel, include_fields=['name']), ())
+
+
+class SuspendTest(AuditlogTestCase):
+    def get_actions(self, logs):
+        return [(record.model, record.action) for record in self.get_records(logs) if record.phase == SUCCESS]
+
+    def test_no_queries(self):
+        """Inside the block, saving costs only the queries of the save itself."""
+        instance = SimpleModel.objects.create(text='a')
+        instance.text = 'b'
+        with self.assertLogs('django.auditlogger', 'INFO') as logs, auditlog.disable():
+            logging.getLogger('django.auditlogger').info("Start.")
+            with self.assertNumQueries(1), assert_audit_overhead(max_queries=0):
+                instance.save()
+        self.assertEqual(self.get_records(logs), [])
+
+    def test_model_scope(self):
+        with self.capture_records() as logs, auditlog.suspend(models=[SimpleModel]):
+            simple = SimpleModel.objects.create(text='a')
+            RelatedModel.objects.create(related=simple)
+        self.assertEqual(self.get_actions(logs), [(RelatedModel, CREATE)])
+
+    def test_nesting(self):
+        """A change is not audited when any of the enclosing blocks covers its model."""
+        with self.capture_records() as logs:
+            with auditlog.suspend(models=[SimpleModel]):
+                with auditlog.suspend(models=[BulkModel]):
+                    SimpleModel.objects.create(text='a')
+                    BulkModel.objects.create(name='a')
+                    self.assertTrue(is_suspended(SimpleModel))
+                SimpleModel.objects.create(text='b')
+                BulkModel.objects.create(name='b')
+            SimpleModel.objects.create(text='c')
+        self.assertFalse(is_suspended(SimpleModel))
+        self.assertEqual(self.get_actions(logs), [(BulkModel, CREATE), (SimpleModel, CREATE)])
+
+    def test_summary(self):
+        """The changes that were not audited are counted by model and action, and logged once."""
+        instance = SimpleModel.objects.create(text='a')
+        with self.assertLogs('django.auditlogger', 'INFO') as logs:
+            with auditlog.suspend(summary=True):
+                SimpleModel.objects.create(text='b')
+                instance.text = 'c'
+                instance.save()
+                instance.delete()
+                BulkModel.objects.create(name='a')
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(logs.records[0].auditlog_changes, {
+            'auditlog_tests.SimpleModel': {CREATE: 1, UPDATE: 1, DELETE: 1},
+            'auditlog_tests.BulkModel': {CREATE: 1},
+        })
+        self.assertIn('suspended auditing of 4 changes', logs.output[0])
+
+    def test_decorated_coroutine(self):
+        """Auditing is suspended while a decorated coroutine runs, and in the threads it runs code in."""
+        @auditlog.disable()
+        async def view():
+            self.assertTrue(is_suspended(SimpleModel))
+            return await sync_to_async(is_suspended)(SimpleModel)
+
+        self.assertTrue(asyncio.run(view()))
+        self.assertFalse(is_suspended(SimpleModel))
+
+    @override_settings(AUDITLOG_SKIP_RAW=True)
+    def test_skip_raw(self):
+        """Objects loaded from a fixture are not logged."""
+        path = os.path.join(tempfile.mkdtemp(), 'fixture.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as fixture:
+            fixture.write('[{"model": "auditlog_tests.simplemodel", "pk": 1, "fields": {"text": "loaded"}}]')
+
+        with self.assertLogs('django.auditlogger', 'INFO') as logs:
+            logging.getLogger('django.auditlogger').info("Start.")
+            with assert_audit_overhead(max_queries=0):
+                call_command('loaddata', path, verbosity=0)
+        self.assertEqual(self.get_records(logs), [])
+        self.assertEqual(SimpleModel.objects.get().text, 'loaded')
+
+        with self.capture_records() as logs:
+            SimpleModel.objects.create(text='created')
+        self.assertEqual(self.get_actions(logs), [(SimpleModel, CREATE)])
+
+
+@override_settings(AUDITLOG_LOG_ENTRIES=True)
+class ExportTest(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'export.jsonl')
+        for number in range(5):
+            SimpleModel.objects.create(text=str(number))
+        self.entries = list(LogEntry.objects.order_by('pk'))
+
+    def call_export(self, *args, **options):
+        call_command('auditlog_export', *args, stdout=io.StringIO(), **options)
+
+    def read_jsonl(self, path):
+        with open(path, 'rb') as export_file:
+            return [json.loads(line) for line in export_file.read().splitlines()]
+
+    def test_jsonl(self):
+        self.call_export(self.path)
+
+        rows = self.read_jsonl(self.path)
+        self.assertEqual([row['id'] for row in rows], [entry.pk for entry in self.entries])
+        self.assertEqual(rows[0]['content_type'], 'auditlog_tests.simplemodel')
+        self.assertEqual(rows[0]['action'], 'create')
+        self.assertEqual(rows[0]['object_pk'], self.entries[0].object_pk)
+        self.assertEqual(rows[0]['changes']['text'], [None, '0'])
+
+    def test_csv_gzip(self):
+        """A compressed export written in several chunks is a single gzip file."""
+        path = os.path.join(self.directory, 'export.csv.gz')
+        self.call_export(path, format='csv', gzip=True, chunk_size=2)
+
+        with gzip.open(path, 'rt', newline='') as export_file:
+            rows = list(csv.reader(export_file))
+        self.assertEqual(tuple(rows[0]), COLUMNS)
+        self.assertEqual([int(row[0]) for row in rows[1:]], [entry.pk for entry in self.entries])
+        self.assertEqual(json.loads(rows[1][5])['text'], [None, '0'])
+
+    def test_resume(self):
+        """A resumed export continues after the last checkpoint, dropping what was written after it."""
+        self.call_export(self.path, chunk_size=2)
+        with open(self.path, 'rb') as export_file:
+            complete = export_file.read()
+
+        # Interrupted after the first chunk, while writing the second one.
+        offset = len(b''.join(complete.splitlines(True)[:2]))
+        with open(self.path + '.checkpoint', 'w') as checkpoint_file:
+            json.dump({'last_pk': self.entries[1].pk, 'offset': offset, 'done': False}, checkpoint_file)
+        with open(self.path, 'r+b') as export_file:
+            export_file.truncate(offset)
+            export_file.seek(offset)
+            export_file.write(b'{"id": ')
+
+        self.call_export(self.path, chunk_size=2, resume=True)
+        with open(self.path, 'rb') as export_file:
+            self.assertEqual(export_file.read(), complete)
+
+        with mock.patch('auditlog.export.ExportWriter') as writer:
+            self.call_export(self.path, resume=True)
+        writer.assert_not_called()
+
+    def test_plan_shards_by_time(self):
+        """The time range is split into shards that together export every log entry once."""
+        LogEntry.objects.filter(pk__in=[entry.pk for entry in self.entries[:3]]).update(
+            timestamp=timezone.now() - datetime.timedelta(days=1))
+
+        shards = plan_shards(self.path, 2)
+        self.assertEqual([shard.path for shard in shards], [
+            os.path.join(self.directory, 'export.0.jsonl'), os.path.join(self.directory, 'export.1.jsonl'),
+        ])
+        self.assertEqual(shards[0].until, shards[1].since)
+
+        results = export(shards)
+        self.assertEqual(sum(result.rows for result in results), 5)
+        rows = self.read_jsonl(shards[0].path) + self.read_jsonl(shards[1].path)
+        self.assertEqual(sorted(row['id'] for row in rows), [entry.pk for entry in self.entries])
+
+    def test_plan_shards_by_content_type(self):
+        BulkModel.objects.create(name='a')
+        shards = plan_shards(self.path, 3, split='content_type')
+
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(sorted(len(shard.content_types) for shard in shards), [1, 1])
+        results = export(shards)
+        self.assertEqual(sorted(result.rows for result in results), [1, 5])
+
+    def test_single_shard(self):
+        self.assertEqual([shard.path for shard in plan_shards(self.path, 1)], [self.path])
+        with self.assertRaises(ValueError):
+            plan_shards(self.path, 2, split='size')
+
+
+class SortedSerializer(JSONSerializer):
+    """
+    A custom serializer that sorts the keys of the changes.
+    """
+
+    def dumps(self, obj):
+        return json.dumps(obj, sort_keys=True, default=str)
+
+
+class BinarySerializer(JSONSerializer):
+    binary = True
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class SerializerTest(AuditlogTestCase):
+    values = {
+        'decimal': Decimal('12.500'),
+        'date': datetime.date(2020, 3, 1),
+        'datetime': datetime.datetime(2020, 3, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+        'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+    }
+
+    def assert_round_trip(self, serializer):
+        decoded = serializer.loads(serializer.dumps(self.values))
+        self.assertEqual(Decimal(decoded['decimal']), self.values['decimal'])
+        self.assertEqual(str(Decimal(decoded['decimal'])), '12.500')
+        self.assertEqual(parse_date(decoded['date']), self.values['date'])
+        self.assertEqual(parse_datetime(decoded['datetime']), self.values['datetime'])
+        self.assertEqual(uuid.UUID(decoded['uuid']), self.values['uuid'])
+
+    def test_json_round_trip(self):
+        self.assert_round_trip(load_serializer('json'))
+
+    @skipUnless(orjson, "orjson is not installed")
+    def test_orjson_round_trip(self):
+        self.assert_round_trip(load_serializer('orjson'))
+
+    @override_settings(AUDITLOG_SERIALIZER='auditlog_tests.tests.SortedSerializer')
+    def test_custom_serializer(self):
+        """The serializer configured with the setting encodes the changes of the log messages."""
+        self.assertIsInstance(get_serializer(), SortedSerializer)
+        with self.capture_records() as logs:
+            SimpleModel.objects.create(text='a', integer=1)
+        message = self.get_records(logs)[0].message
+        self.assertIn('{"boolean": [null, false], "integer": [null, 1], "text": [null, "a"]}', message)
+
+    def test_invalid_serializers(self):
+        with override_settings(AUDITLOG_SERIALIZER='auditlog_tests.tests.BinarySerializer'):
+            with self.assertRaises(ValueError):
+                get_serializer()
+        with self.assertRaises(ValueError):
+            load_serializer('yaml')
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+import os
+import sys
+
+import django
+from django.conf import settings
+from django.test.utils import get_runner
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'auditlog_tests.test_settings'
+    django.setup()
+    TestRunner = get_runner(settings)
+    test_runner = TestRunner()
+    failures = test_runner.run_tests(sys.argv[1:] or ['auditlog_tests'])
+    sys.exit(bool(failures))